@@ -0,0 +1,182 @@
+"""Temp-space janitor and admission control for downloads"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from metrics import TEMP_BYTES
+
+TEMP_PREFIX = 'bakraload_'
+# bakraload_<kind>_<pid>_<random>, as created by make_temp_dir()
+TEMP_DIR_REGEX = re.compile(r'^bakraload_[a-z]+_(\d+)_')
+
+
+def make_temp_dir(kind):
+    """mkdtemp() for a request's download, tagged with the owning worker's pid for the janitor"""
+    return tempfile.mkdtemp(prefix=f'{TEMP_PREFIX}{kind}_{os.getpid()}_')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _dir_bytes(path):
+    """Bytes a download directory adds to the disk (hard links into the cache are free)"""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.lstat(os.path.join(root, name))
+            except OSError:
+                continue
+            if st.st_nlink == 1:
+                total += st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+    return total
+
+
+class Overloaded(Exception):
+    """Raised when a download can't be admitted right now; reason labels the rejection in metrics"""
+
+    def __init__(self, message, retry_after=30, reason='overloaded'):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TempJanitor:
+    """Reaps bakraload_* download directories that nobody will clean up.
+
+    A directory whose owning worker has died (gunicorn timeout, OOM kill)
+    is removed after a short grace period; one whose owner is still alive
+    only once it is older than max_age, which covers requests whose
+    cleanup never ran because the client went away mid-stream. Other
+    periodic housekeeping (expired jobs, artifacts) is added with add_task()
+    and runs on the same thread after each sweep.
+
+    Between sweeps the thread re-measures the bytes held by live directories
+    and the free space every measure_interval seconds; admission control
+    only reads those figures, so requests never walk the temp tree.
+    """
+
+    def __init__(self, root=None, max_age=3600, orphan_grace=60, interval=60, measure_interval=5):
+        self.root = root or tempfile.gettempdir()
+        self.max_age = max_age
+        self.orphan_grace = orphan_grace
+        self.interval = interval
+        self.measure_interval = measure_interval
+        self.bytes_in_flight = 0
+        # None until the first measurement
+        self.free_bytes = None
+        self.tasks = []
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _temp_dirs(self):
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return []
+        return [name for name in names if name.startswith(TEMP_PREFIX)]
+
+    def sweep(self):
+        """Remove orphaned directories and return the bytes held by the others"""
+        now = time.time()
+        for name in self._temp_dirs():
+            path = os.path.join(self.root, name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except OSError:
+                continue
+            match = TEMP_DIR_REGEX.match(name)
+            orphaned = match is not None and not _pid_alive(int(match.group(1)))
+            if age > self.max_age or (orphaned and age > self.orphan_grace):
+                shutil.rmtree(path, ignore_errors=True)
+        return self.measure()
+
+    def measure(self):
+        """Refresh bytes_in_flight and free_bytes; returns bytes_in_flight"""
+        in_flight = sum(_dir_bytes(os.path.join(self.root, name)) for name in self._temp_dirs())
+        try:
+            self.free_bytes = shutil.disk_usage(self.root).free
+        except OSError:
+            pass
+        self.bytes_in_flight = in_flight
+        TEMP_BYTES.set(in_flight)
+        return in_flight
+
+    def add_task(self, task):
+        """Run task() every interval on the janitor thread"""
+        self.tasks.append(task)
+
+    def _loop(self):
+        next_sweep = 0.0
+        while True:
+            if time.monotonic() >= next_sweep:
+                next_sweep = time.monotonic() + self.interval
+                tasks = [self.sweep, *self.tasks]
+            else:
+                tasks = [self.measure]
+            for task in tasks:
+                try:
+                    task()
+                except Exception:
+                    pass
+            time.sleep(min(self.interval, self.measure_interval))
+
+    def start(self):
+        """Start the background sweep (in the worker, so it survives the fork)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='bakraload-janitor', daemon=True)
+                self._thread.start()
+
+
+class AdmissionControl:
+    """Turns new downloads away while temp space or CPU is exhausted.
+
+    Disk pressure is the bytes held by live download directories against
+    disk_budget, plus a floor of free space on the temp filesystem, both as
+    last measured by the janitor thread; CPU pressure is the 1-minute load
+    average per core.
+    """
+
+    def __init__(self, janitor, disk_budget=None, min_free_bytes=0, max_load=None, retry_after=30):
+        self.janitor = janitor
+        self.disk_budget = disk_budget
+        self.min_free_bytes = min_free_bytes
+        self.max_load = max_load
+        self.retry_after = retry_after
+
+    def reason(self):
+        """Why a download would be rejected right now, or None"""
+        if self.disk_budget and self.janitor.bytes_in_flight >= self.disk_budget:
+            return 'Too many downloads in progress. Please try again shortly.'
+        free_bytes = self.janitor.free_bytes
+        if self.min_free_bytes and free_bytes is not None and free_bytes < self.min_free_bytes:
+            return 'The server is low on disk space. Please try again shortly.'
+        if self.max_load and hasattr(os, 'getloadavg'):
+            if os.getloadavg()[0] / (os.cpu_count() or 1) >= self.max_load:
+                return 'The server is busy. Please try again shortly.'
+        return None
+
+    def check(self):
+        """Raise Overloaded if a new download shouldn't start"""
+        reason = self.reason()
+        if reason:
+            raise Overloaded(reason, self.retry_after)
+
+    def wait(self, poll=2.0, timeout=None):
+        """Block until a download may start (queued jobs wait here instead of being rejected)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.reason():
+            if deadline is not None and time.monotonic() > deadline:
+                self.check()
+            time.sleep(poll)
@@ -1,25 +1,51 @@
-from flask import Flask, request, render_template, jsonify, send_file, abort
+from flask import Flask, Response, request, render_template, jsonify, send_file, abort, url_for, stream_with_context
 import os
 import tempfile
 import threading
-import requests
 import json
 import re
+import time
+import itertools
 from datetime import datetime
-import yt_dlp
-import instaloader
 from werkzeug.utils import secure_filename
-import zipfile
 import shutil
 import secrets
+import subprocess
+from functools import cached_property, wraps
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, as_completed
 # Security imports
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_cors import CORS
 from flask_talisman import Talisman
+from jobs import JobManager, JobStore, QueueFull
+import job_queue
+from bulk import BulkDownloader
+from zipstream import iter_zip, zip_filename_for
+from cache import ResultCache
+from canonical import canonical_key, platform_for
+from info_cache import InfoCache
+from artifacts import ArtifactStore
+from engines import EnginePool
+from tuning import DownloadTuner
+from instagram import InstaloaderPool, download_items
+from profile_sync import ProfileLibrary
+from playlist import EntryFeed
+from admission import AdmissionControl, Overloaded, TempJanitor, make_temp_dir
+import closing
+from audio import AUDIO_FORMATS, AudioExtractor, TranscodePool, can_stream
+from direct import DirectFetcher, is_direct_media
+from scheduler import PlatformScheduler
+from quality import apply_quality, parse_quality
+import metrics
+import profiling
+from profiling import Profiler
 
 
 app = Flask(__name__)
+# Close hooks that also run for send_file responses (metrics.track_transfer, profiled)
+app.wsgi_app = closing.CloseHooks(app.wsgi_app)
 
 # Configuration
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', secrets.token_hex(32))
@@ -47,18 +73,53 @@ limiter = Limiter(
     get_remote_address,
     app=app,
     default_limits=[f"{rate_limit_per_minute}/minute", f"{rate_limit_per_hour}/hour"],
-    storage_uri=os.getenv('REDIS_URL', 'memory://')
+    storage_uri=os.getenv('REDIS_URL', 'memory://'),
+    # Only for load tests (benchmarks/loadtest.py)
+    enabled=os.getenv('RATE_LIMIT_ENABLED', 'True').lower() == 'true',
 )
 
 class UniversalDownloader:
     # Allowed URL schemes and regex for validation
     URL_REGEX = re.compile(r'^(https?://)[\w\-\.]+(\.[a-z]{2,})(:[0-9]+)?(/[\w\-\./?%&=]*)?$', re.IGNORECASE)
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
+    # Values accepted for a request's "format"
+    FORMATS = ('default', 'mp4', *AUDIO_FORMATS)
+    def __init__(self, cache=None, info_cache=None, engines=None, tuner=None, instaloaders=None,
+                 instagram_concurrency=4, profile_library=None, audio=None, playlist_concurrency=4, direct=None,
+                 scheduler=None):
+        self.cache = cache
+        self.info_cache = info_cache
+        self.engines = engines or EnginePool()
+        self.tuner = tuner or DownloadTuner()
+        self.instaloaders = instaloaders or InstaloaderPool()
+        self.instagram_concurrency = instagram_concurrency
+        self.profile_library = profile_library
+        self.playlist_concurrency = playlist_concurrency
+        self.audio = audio or AudioExtractor(TranscodePool(os.path.join(tempfile.gettempdir(), 'bakraload-transcode')))
+        # Fetches direct media links without yt-dlp; None sends them through the generic extractor
+        self.direct = direct
+        # Per-platform pacing and circuit breaking of upstream requests; None lets everything through
+        self.scheduler = scheduler
+        self._local = threading.local()
+
+    # Heavy modules (requests, yt_dlp, instaloader, imageio_ffmpeg) are imported on first use,
+    # so a worker only pays for the platforms it actually serves. See warm_up().
+    @cached_property
+    def session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
-        self.ffmpeg_path = self._get_ffmpeg_path()
+        # Keep-alive connections shared by every thread of the worker; a ranged fetch uses several at once
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @cached_property
+    def ffmpeg_path(self):
+        return self._get_ffmpeg_path()
 
     def _get_ffmpeg_path(self):
         ffmpeg_path = shutil.which('ffmpeg')
@@ -81,31 +142,9 @@ class UniversalDownloader:
         return True
 
     def detect_platform(self, url):
-        """Detect the platform from URL"""
-        url = url.lower()
-        if 'youtube.com' in url or 'youtu.be' in url:
-            return 'youtube'
-        elif 'instagram.com' in url:
-            return 'instagram'
-        elif 'facebook.com' in url or 'fb.watch' in url:
-            return 'facebook'
-        elif 'twitter.com' in url or 'x.com' in url:
-            return 'twitter'
-        elif 'tiktok.com' in url:
-            return 'tiktok'
-        elif 'pinterest.com' in url:
-            return 'pinterest'
-        elif 'linkedin.com' in url:
-            return 'linkedin'
-        elif 'snapchat.com' in url:
-            return 'snapchat'
-        elif 'reddit.com' in url:
-            return 'reddit'
-        elif 'twitch.tv' in url:
-            return 'twitch'
-        else:
-            return 'unknown'
-        
+        """Detect the platform from the URL's host (see canonical.PLATFORM_HOSTS)"""
+        return platform_for(url)
+
     def create_safe_filename(self, filename, max_length=100):
         """Create a safe filename"""
         # Remove invalid characters
@@ -115,301 +154,843 @@ class UniversalDownloader:
             filename = filename[:max_length]
         return filename
     
-    def download_youtube_content(self, url, path, format_type='default'):
+    def ydl_opts_for(self, platform, format_type='default', quality=None):
+        """yt-dlp options profile used for a platform, format and quality profile.
+
+        Audio formats only select the source here; extract_audio() turns the
+        download into the requested format afterwards.
+        """
+        builders = {
+            'youtube': self.youtube_ydl_opts,
+            'tiktok': self.tiktok_ydl_opts,
+            'twitter': self.twitter_ydl_opts,
+            'facebook': self.facebook_ydl_opts,
+            'reddit': self.reddit_ydl_opts,
+        }
+        return builders.get(platform, self.generic_ydl_opts)(format_type, quality)
+
+    def warm_engines(self, profiles):
+        """Pre-build pooled yt-dlp engines for (platform, format_type) pairs"""
+        for platform, format_type in profiles:
+            self.engines.prewarm(self.ydl_opts_for(platform, format_type))
+
+    def youtube_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for YouTube videos, shorts, playlists"""
+        # Set format based on user selection
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': '%(uploader)s - %(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+                'ignoreerrors': True,
+            }
+        elif format_type == 'mp4':
+            ydl_opts = {
+                'outtmpl': '%(uploader)s - %(title)s.%(ext)s',
+                'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+                'merge_output_format': 'mp4',
+                'ignoreerrors': True,
+            }
+        else:  # default
+            ydl_opts = {
+                'outtmpl': '%(uploader)s - %(title)s.%(ext)s',
+                'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
+                'writesubtitles': True,
+                'writeautomaticsub': True,
+                'subtitleslangs': ['en'],
+                'ignoreerrors': True,
+                'merge_output_format': 'mp4',
+            }
+        
+        # Add ffmpeg location
+        ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        if format_type == 'mp4':
+            return apply_quality(ydl_opts, quality, ext='mp4:m4a')
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type), max_height=1080)
+
+    def download_youtube_content(self, url, path, format_type='default', quality=None):
         """Download YouTube videos, shorts, playlists"""
         try:
             # Check if ffmpeg is available
             if not self.ffmpeg_path:
                 return {'status': 'error', 'message': 'ffmpeg is not installed or not in PATH. 1080p downloads require ffmpeg.'}
             
-            # Set format based on user selection
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, '%(uploader)s - %(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                    'ignoreerrors': True,
-                }
-            elif format_type == 'mp4':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, '%(uploader)s - %(title)s.%(ext)s'),
-                    'format': 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                    'merge_output_format': 'mp4',
-                    'ignoreerrors': True,
+            ydl_opts = self.youtube_ydl_opts(format_type, quality)
+
+            info = self._run_ydl('youtube', ydl_opts, path, url, format_type)
+            if 'entries' in info:  # Playlist
+                titles = [entry.get('title', 'Unknown') for entry in info['entries'] if entry]
+                playlist_title = info.get('title', 'YouTube_Playlist')
+                failed = info.get('failed_entries', [])
+                message = f'Downloaded {len(titles)} videos from playlist'
+                if failed:
+                    message += f' ({len(failed)} failed, see errors.txt)'
+                return {
+                    'status': 'success',
+                    'message': message,
+                    'titles': titles[:5],  # Show first 5 titles
+                    'type': 'playlist',
+                    'playlist_title': playlist_title,
+                    'failed': failed,
                 }
-            else:  # default
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, '%(uploader)s - %(title)s.%(ext)s'),
-                    'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]',
-                    'writesubtitles': True,
-                    'writeautomaticsub': True,
-                    'subtitleslangs': ['en'],
-                    'ignoreerrors': True,
-                    'merge_output_format': 'mp4',
+            else:  # Single video
+                return {
+                    'status': 'success',
+                    'message': 'YouTube content downloaded successfully!',
+                    'title': info.get('title', 'Unknown'),
+                    'uploader': info.get('uploader', 'Unknown'),
+                    'type': 'video'
                 }
-            
-            # Add ffmpeg location
-            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if 'entries' in info:  # Playlist
-                    titles = [entry.get('title', 'Unknown') for entry in info['entries'] if entry]
-                    playlist_title = info.get('title', 'YouTube_Playlist')
-                    return {
-                        'status': 'success',
-                        'message': f'Downloaded {len(titles)} videos from playlist',
-                        'titles': titles[:5],  # Show first 5 titles
-                        'type': 'playlist',
-                        'playlist_title': playlist_title
-                    }
-                else:  # Single video
-                    return {
-                        'status': 'success',
-                        'message': 'YouTube content downloaded successfully!',
-                        'title': info.get('title', 'Unknown'),
-                        'uploader': info.get('uploader', 'Unknown'),
-                        'type': 'video'
-                    }
         except Exception as e:
             return {'status': 'error', 'message': f'YouTube error: {str(e)}'}
     
     def download_instagram_content(self, url, path):
         """Download Instagram posts, reels, stories, IGTV"""
+        import instaloader
         try:
-            loader = instaloader.Instaloader(
-                dirname_pattern=path,
-                filename_pattern='{profile}_{mediaid}_{date_utc}',
-                download_videos=True,
-                download_video_thumbnails=False,
-                download_geotags=False,
-                download_comments=False,  # Do not download comments
-                save_metadata=False,      # Do not save metadata JSON
-                compress_json=False       # Do not compress JSON (no JSON will be saved)
-            )
-            
-            # Handle different Instagram URL types
-            if '/stories/' in url:
-                # Story URL
-                username = self.extract_instagram_username(url)
-                if username:
+            with self.instaloaders.loader(path) as loader:
+                progress = self._progress()
+
+                # Handle different Instagram URL types
+                if '/stories/' in url:
+                    # Story URL
+                    username = self.extract_instagram_username(url)
+                    if username:
+                        profile = instaloader.Profile.from_username(loader.context, username)
+                        items = [item for story in loader.get_stories([profile.userid]) for item in story.get_items()]
+                        if self.profile_library is not None:
+                            self._sync_instagram_stories(loader, username, items, path, progress)
+                        else:
+                            self._download_instagram_items(loader, items, username, progress, captions=False)
+                        return {
+                            'status': 'success',
+                            'message': f'Instagram stories downloaded for {username}',
+                            'type': 'stories'
+                        }
+                elif '/reel/' in url or '/p/' in url or '/tv/' in url:
+                    # Post, Reel, or IGTV (carousel nodes are fetched in parallel)
+                    shortcode = self.extract_instagram_shortcode(url)
+                    post = self._get_instagram_post(loader.context, shortcode)
+
+                    self._download_instagram_items(loader, [post], post.owner_username, progress)
+
+                    content_type = 'reel' if post.is_video else 'post'
+                    if post.typename == 'GraphSidecar':
+                        content_type = 'carousel'
+                    return {
+                        'status': 'success',
+                        'message': f'Instagram {content_type} downloaded successfully!',
+                        'username': post.owner_username,
+                        'type': content_type
+                    }
+                else:
+                    # Profile URL - download recent posts
+                    username = self.extract_instagram_username(url)
                     profile = instaloader.Profile.from_username(loader.context, username)
-                    for story in loader.get_stories([profile.userid]):
-                        for item in story.get_items():
-                            loader.download_storyitem(item, target=username)
+
+                    if self.profile_library is not None:
+                        count, new = self._sync_instagram_profile(loader, profile, path, progress)
+                    else:
+                        # Limit to 10 recent posts
+                        posts = itertools.islice(profile.get_posts(), 10)
+                        count = new = self._download_instagram_items(loader, posts, username, progress,
+                                                                     total=min(10, profile.mediacount))
+
                     return {
                         'status': 'success',
-                        'message': f'Instagram stories downloaded for {username}',
-                        'type': 'stories'
+                        'message': f'Downloaded {count} recent posts from {username}',
+                        'type': 'profile',
+                        'new_posts': new,
                     }
-            elif '/reel/' in url or '/p/' in url or '/tv/' in url:
-                # Post, Reel, or IGTV
-                shortcode = self.extract_instagram_shortcode(url)
-                post = instaloader.Post.from_shortcode(loader.context, shortcode)
-                
-                loader.download_post(post, target=post.owner_username)
-                
-                content_type = 'reel' if post.is_video else 'post'
-                if post.typename == 'GraphSidecar':
-                    content_type = 'carousel'
-                return {
-                    'status': 'success',
-                    'message': f'Instagram {content_type} downloaded successfully!',
-                    'username': post.owner_username,
-                    'type': content_type
-                }
-            else:
-                # Profile URL - download recent posts
-                username = self.extract_instagram_username(url)
-                profile = instaloader.Profile.from_username(loader.context, username)
-                
-                count = 0
-                for post in profile.get_posts():
-                    if count >= 10:  # Limit to 10 recent posts
-                        break
-                    loader.download_post(post, target=username)
-                    count += 1
-                
-                return {
-                    'status': 'success',
-                    'message': f'Downloaded {count} recent posts from {username}',
-                    'type': 'profile'
-                }
-                
+
         except Exception as e:
             return {'status': 'error', 'message': f'Instagram error: {str(e)}'}
-    
-    def download_tiktok_content(self, url, path, format_type='default'):
+
+    def _sync_instagram_profile(self, loader, profile, path, progress=None, limit=10):
+        """Download only posts newer than the profile's watermark and link the rest from the library.
+
+        Returns (posts delivered, posts downloaded now).
+        """
+        library = self.profile_library
+        username = profile.username
+        with library.lock(username):
+            watermark = library.watermark(username)
+            known = library.known_ids(username, 'post')
+            new_posts = []
+            seen = 0
+            for post in profile.get_posts():
+                taken_at = post.date_utc.timestamp()
+                # Pinned posts come first regardless of age, so only a non-pinned post ends the walk
+                if watermark is not None and taken_at <= watermark and not post.is_pinned:
+                    break
+                if post.mediaid in known:
+                    # Refresh the pinned flag without fetching anything
+                    library.add(username, 'post', post.mediaid, taken_at,
+                                loader.format_filename(post, target=username), pinned=post.is_pinned)
+                else:
+                    new_posts.append(post)
+                seen += 1
+                if seen >= limit:
+                    break
+            self._download_instagram_items(loader, new_posts, username, progress,
+                                           dirname=library.media_dir(username))
+            for post in new_posts:
+                library.add(username, 'post', post.mediaid, post.date_utc.timestamp(),
+                            loader.format_filename(post, target=username), pinned=post.is_pinned)
+            library.prune(username)
+            items = library.files_for(username, 'post', limit=limit)
+            library.link_into(items, path)
+        return len(items), len(new_posts)
+
+    def _sync_instagram_stories(self, loader, username, story_items, path, progress=None):
+        """Download only story items that aren't in the library yet"""
+        library = self.profile_library
+        with library.lock(username):
+            known = library.known_ids(username, 'story')
+            new_items = [item for item in story_items if item.mediaid not in known]
+            self._download_instagram_items(loader, new_items, username, progress, captions=False,
+                                           dirname=library.media_dir(username))
+            for item in new_items:
+                library.add(username, 'story', item.mediaid, item.date_utc.timestamp(),
+                            loader.format_filename(item, target=username))
+            library.prune(username)
+            library.link_into(library.files_for(username, 'story', mediaids={item.mediaid for item in story_items}),
+                              path)
+
+    def _download_instagram_items(self, loader, items, target, progress=None, total=None, captions=True,
+                                  dirname=None):
+        """Fetch the media of posts or story items on a bounded pool, reporting each item"""
+        count = total or (len(items) if isinstance(items, list) else None)
+
+        def on_item(index, item):
+            if progress:
+                progress.item(index, count, getattr(item, 'shortcode', None) or target)
+
+        return download_items(loader, items, target, max_workers=self.instagram_concurrency,
+                              on_item=on_item, captions=captions, dirname=dirname)
+
+    def tiktok_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for TikTok videos"""
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': 'TikTok_%(uploader)s_%(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+            }
+        else:
+            ydl_opts = {
+                'outtmpl': 'TikTok_%(uploader)s_%(title)s.%(ext)s',
+                'format': 'best',
+            }
+        
+        if self.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type), merge=False)
+
+    def download_tiktok_content(self, url, path, format_type='default', quality=None):
         """Download TikTok videos"""
         try:
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'TikTok_%(uploader)s_%(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                }
-            else:
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'TikTok_%(uploader)s_%(title)s.%(ext)s'),
-                    'format': 'best',
-                }
-            
-            if self.ffmpeg_path:
-                ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+            ydl_opts = self.tiktok_ydl_opts(format_type, quality)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return {
-                    'status': 'success',
-                    'message': 'TikTok video downloaded successfully!',
-                    'title': info.get('title', 'TikTok Video'),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'type': 'video'
-                }
+            info = self._run_ydl('tiktok', ydl_opts, path, url, format_type)
+            return {
+                'status': 'success',
+                'message': 'TikTok video downloaded successfully!',
+                'title': info.get('title', 'TikTok Video'),
+                'uploader': info.get('uploader', 'Unknown'),
+                'type': 'video'
+            }
         except Exception as e:
             return {'status': 'error', 'message': f'TikTok error: {str(e)}'}
     
-    def download_twitter_content(self, url, path, format_type='default'):
+    def twitter_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for Twitter/X videos, images, threads"""
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': 'Twitter_%(uploader)s_%(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+            }
+        else:
+            ydl_opts = {
+                'outtmpl': 'Twitter_%(uploader)s_%(title)s.%(ext)s',
+                'writesubtitles': True,
+            }
+        
+        if self.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type))
+
+    def download_twitter_content(self, url, path, format_type='default', quality=None):
         """Download Twitter/X videos, images, threads"""
         try:
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Twitter_%(uploader)s_%(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                }
-            else:
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Twitter_%(uploader)s_%(title)s.%(ext)s'),
-                    'writesubtitles': True,
-                }
-            
-            if self.ffmpeg_path:
-                ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+            ydl_opts = self.twitter_ydl_opts(format_type, quality)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return {
-                    'status': 'success',
-                    'message': 'Twitter content downloaded successfully!',
-                    'title': info.get('title', 'Twitter Content'),
-                    'uploader': info.get('uploader', 'Unknown'),
-                    'type': 'tweet'
-                }
+            info = self._run_ydl('twitter', ydl_opts, path, url, format_type)
+            return {
+                'status': 'success',
+                'message': 'Twitter content downloaded successfully!',
+                'title': info.get('title', 'Twitter Content'),
+                'uploader': info.get('uploader', 'Unknown'),
+                'type': 'tweet'
+            }
         except Exception as e:
             return {'status': 'error', 'message': f'Twitter error: {str(e)}'}
     
-    def download_facebook_content(self, url, path, format_type='default'):
+    def facebook_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for Facebook videos, posts"""
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': 'Facebook_%(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+            }
+        else:
+            ydl_opts = {
+                'outtmpl': 'Facebook_%(title)s.%(ext)s',
+                'format': 'best',
+            }
+        
+        if self.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type), merge=False)
+
+    def download_facebook_content(self, url, path, format_type='default', quality=None):
         """Download Facebook videos, posts"""
         try:
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Facebook_%(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                }
-            else:
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Facebook_%(title)s.%(ext)s'),
-                    'format': 'best',
-                }
-            
-            if self.ffmpeg_path:
-                ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+            ydl_opts = self.facebook_ydl_opts(format_type, quality)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return {
-                    'status': 'success',
-                    'message': 'Facebook content downloaded successfully!',
-                    'title': info.get('title', 'Facebook Content'),
-                    'type': 'video'
-                }
+            info = self._run_ydl('facebook', ydl_opts, path, url, format_type)
+            return {
+                'status': 'success',
+                'message': 'Facebook content downloaded successfully!',
+                'title': info.get('title', 'Facebook Content'),
+                'type': 'video'
+            }
         except Exception as e:
             return {'status': 'error', 'message': f'Facebook error: {str(e)}'}
     
-    def download_reddit_content(self, url, path, format_type='default'):
+    def reddit_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for Reddit videos, images, gifs"""
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': 'Reddit_%(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+            }
+        else:
+            ydl_opts = {
+                'outtmpl': 'Reddit_%(title)s.%(ext)s',
+            }
+        
+        if self.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type))
+
+    def download_reddit_content(self, url, path, format_type='default', quality=None):
         """Download Reddit videos, images, gifs"""
         try:
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Reddit_%(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                }
-            else:
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, 'Reddit_%(title)s.%(ext)s'),
-                }
-            
-            if self.ffmpeg_path:
-                ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+            ydl_opts = self.reddit_ydl_opts(format_type, quality)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return {
-                    'status': 'success',
-                    'message': 'Reddit content downloaded successfully!',
-                    'title': info.get('title', 'Reddit Post'),
-                    'type': 'post'
-                }
+            info = self._run_ydl('reddit', ydl_opts, path, url, format_type)
+            return {
+                'status': 'success',
+                'message': 'Reddit content downloaded successfully!',
+                'title': info.get('title', 'Reddit Post'),
+                'type': 'post'
+            }
         except Exception as e:
             return {'status': 'error', 'message': f'Reddit error: {str(e)}'}
     
-    def download_generic_content(self, url, path, format_type='default'):
+    def generic_ydl_opts(self, format_type='default', quality=None):
+        """yt-dlp options for any other platform yt-dlp supports"""
+        if format_type in AUDIO_FORMATS:
+            ydl_opts = {
+                'outtmpl': '%(extractor)s_%(title)s.%(ext)s',
+                'format': AUDIO_FORMATS[format_type].selector,
+            }
+        else:
+            ydl_opts = {
+                'outtmpl': '%(extractor)s_%(title)s.%(ext)s',
+                'format': 'best',
+            }
+        
+        if self.ffmpeg_path:
+            ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+        return apply_quality(ydl_opts, quality, AUDIO_FORMATS.get(format_type), merge=False)
+
+    def download_generic_content(self, url, path, format_type='default', quality=None):
         """Download from any supported platform using yt-dlp"""
         try:
-            if format_type == 'mp3':
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, '%(extractor)s_%(title)s.%(ext)s'),
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                }
-            else:
-                ydl_opts = {
-                    'outtmpl': os.path.join(path, '%(extractor)s_%(title)s.%(ext)s'),
-                    'format': 'best',
-                }
-            
-            if self.ffmpeg_path:
-                ydl_opts['ffmpeg_location'] = self.ffmpeg_path
+            ydl_opts = self.generic_ydl_opts(format_type, quality)
 
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                return {
-                    'status': 'success',
-                    'message': 'Content downloaded successfully!',
-                    'title': info.get('title', 'Unknown'),
-                    'extractor': info.get('extractor', 'Unknown'),
-                    'type': 'media'
-                }
+            info = self._run_ydl(self.detect_platform(url), ydl_opts, path, url, format_type)
+            return {
+                'status': 'success',
+                'message': 'Content downloaded successfully!',
+                'title': info.get('title', 'Unknown'),
+                'extractor': info.get('extractor', 'Unknown'),
+                'type': 'media'
+            }
         except Exception as e:
             return {'status': 'error', 'message': f'Download error: {str(e)}'}
     
+    def download_direct_content(self, url, path, format_type='default', quality=None):
+        """Fetch a direct media link over the pooled session; None when it turns out to be a web page"""
+        try:
+            progress = self._progress()
+            start = time.perf_counter()
+            fetched = self.direct.fetch(self.session, url, path, sanitize=self.create_safe_filename,
+                                        progress_hook=progress.ydl_hook if progress else None,
+                                        max_size=quality.max_filesize if quality else None)
+            if fetched is None:
+                return None
+            file_path, size, mode = fetched
+            self._add_stage('download', time.perf_counter() - start)
+            self._local.downloaded_bytes = getattr(self._local, 'downloaded_bytes', 0) + size
+            metrics.DIRECT_FETCHES.labels(mode).inc()
+            if format_type in AUDIO_FORMATS:
+                self.extract_audio([file_path], format_type)
+            return {
+                'status': 'success',
+                'message': 'Content downloaded successfully!',
+                'title': os.path.splitext(os.path.basename(file_path))[0],
+                'extractor': 'direct',
+                'type': 'media'
+            }
+        except Exception as e:
+            return {'status': 'error', 'message': f'Download error: {str(e)}'}
+
+    def _open_direct_passthrough(self, url, platform, format_type, quality=None):
+        """open_passthrough() for a direct media link: one GET on the pooled session, no extraction"""
+        try:
+            response = self.direct.open(self.session, url)
+        except Exception:
+            return None
+        if response is None:
+            return None
+        size = None
+        if response.headers.get('Content-Encoding', 'identity') == 'identity':
+            size = response.headers.get('Content-Length')
+        if quality and quality.max_filesize and not (size and size.isdigit() and int(size) <= quality.max_filesize):
+            # Only a download can enforce the size budget on this file
+            response.close()
+            return None
+        metrics.DOWNLOADS.labels(platform, metrics.format_label(format_type), 'streamed').inc()
+        metrics.DIRECT_FETCHES.labels('passthrough').inc()
+        response.raw.decode_content = True
+        return {
+            'upstream': response.raw,
+            'platform': platform,
+            'filename': self.create_safe_filename(self.direct.filename(response, url)),
+            'size': int(size) if size and size.isdigit() else None,
+            'close': response.close,
+        }
+
+    def _info_key(self, kind, value):
+        return f'{kind}:{canonical_key(value) if kind == "ytdlp" else value}'
+
+    def _extract_unprocessed(self, ydl, url, remember=False):
+        """extract_info(process=False), reusing a probed result instead of re-extracting.
+
+        remember=True stores a fresh result in the info cache for the download that follows.
+        """
+        key = self._info_key('ytdlp', url)
+        info = self.info_cache.get(key) if self.info_cache else None
+        if info is None:
+            # Extract and process separately so extraction gets its own timing
+            start = time.perf_counter()
+            info = ydl.extract_info(url, download=False, process=False)
+            self._add_stage('extract', time.perf_counter() - start)
+            if remember and info is not None and self.info_cache:
+                self.info_cache.set(key, self._serializable_info(info))
+        return info
+
+    def _resolve_url_result(self, ydl, info):
+        """Follow a url/url_transparent result one level, as process_ie_result would.
+
+        watch?v=X&list=Y comes back as a url result pointing at the playlist,
+        whose entries are only seen once it is extracted.
+        """
+        if info is None or info.get('_type') not in ('url', 'url_transparent'):
+            return info
+        start = time.perf_counter()
+        extra_info = {'original_url': info['original_url']} if info.get('original_url') else {}
+        resolved = ydl.extract_info(info['url'], ie_key=info.get('ie_key'), extra_info=extra_info,
+                                    download=False, process=False)
+        self._add_stage('extract', time.perf_counter() - start)
+        if not resolved or info['_type'] == 'url':
+            return resolved
+        # The embedding page's metadata wins, except for what says where the media is
+        exempted = {'_type', 'url', 'ie_key'}
+        if not info.get('section_end') and info.get('section_start') is None:
+            exempted |= {'id', 'extractor', 'extractor_key'}
+        resolved = dict(resolved, **{k: v for k, v in info.items() if v is not None and k not in exempted})
+        if resolved.get('_type') == 'url':
+            resolved['_type'] = 'url_transparent'
+        return resolved
+
+    def _add_stage(self, stage, seconds):
+        """Add to the per-stage timings of the download running on this thread"""
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def _progress(self):
+        """ProgressReporter for the download running on this thread, if anyone is listening"""
+        return getattr(self._local, 'progress', None)
+
+    def _run_ydl(self, platform, ydl_opts, path, url, format_type='default'):
+        """Download with a pooled engine, applying and feeding back the platform's download tuning.
+
+        Playlists are flattened and their entries downloaded concurrently
+        (see _download_entries). Audio formats are converted here, so every
+        file in path is final when this returns.
+        """
+        tuning = self.tuner.options_for(platform)
+        stats = {'bytes': 0, 'seconds': 0.0, 'fragmented': False}
+        stats_lock = threading.Lock()
+
+        def measure(d):
+            with stats_lock:
+                if d.get('fragment_count'):
+                    stats['fragmented'] = True
+                if d.get('status') == 'finished':
+                    stats['bytes'] += d.get('downloaded_bytes') or d.get('total_bytes') or 0
+                    stats['seconds'] += d.get('elapsed') or 0
+
+        postprocess_started = {}
+
+        def time_postprocessor(d):
+            key = (threading.get_ident(), d.get('postprocessor'))
+            if d.get('status') == 'started':
+                postprocess_started[key] = time.perf_counter()
+            elif d.get('status') == 'finished' and key in postprocess_started:
+                self._add_stage('postprocess', time.perf_counter() - postprocess_started.pop(key))
+
+        progress = self._progress()
+        progress_hooks = [measure, progress.ydl_hook] if progress else [measure]
+        postprocessor_hooks = [time_postprocessor, progress.postprocessor_hook] if progress else [time_postprocessor]
+        entries = None
+        with self.engines.engine(ydl_opts, path, params=tuning, progress_hooks=progress_hooks,
+                                 postprocessor_hooks=postprocessor_hooks) as ydl:
+            info = self._resolve_url_result(ydl, self._extract_unprocessed(ydl, url))
+            if info is not None and info.get('entries') is not None:
+                info['entries'] = entries = [entry for entry in info['entries'] if entry]
+            if entries is None or len(entries) < 2 or self.playlist_concurrency < 2:
+                entries = None
+                info = ydl.process_ie_result(info, download=True) if info is not None else None
+        if entries is not None:
+            start = time.perf_counter()
+            info = self._download_entries(ydl_opts, path, info, format_type, tuning,
+                                          progress_hooks=[measure], postprocessor_hooks=[time_postprocessor])
+            # Entries overlap, so the wall time is what the download cost
+            self._add_stage('download', time.perf_counter() - start)
+        else:
+            self._add_stage('download', stats['seconds'])
+            if format_type in AUDIO_FORMATS:
+                self.extract_audio([os.path.join(root, f) for root, dirs, files in os.walk(path) for f in files],
+                                   format_type)
+        self._local.downloaded_bytes = getattr(self._local, 'downloaded_bytes', 0) + stats['bytes']
+        # Only fragmented (DASH/HLS) downloads say anything about fragment concurrency
+        if stats['fragmented']:
+            self.tuner.record(platform, stats['bytes'], stats['seconds'])
+        self._local.tuning = dict(tuning, downloaded_bytes=stats['bytes'], seconds=round(stats['seconds'], 3))
+        return info
+
+    def _download_entry(self, ydl_opts, path, entry, extra_info, format_type, tuning, stages, hooks, feed=None):
+        """Download one playlist entry into its own directory; returns (info, files)"""
+        if feed is not None and feed.cancelled.is_set():
+            raise RuntimeError('Download cancelled.')
+        self._local.stages = stages
+        progress_hooks, postprocessor_hooks = hooks
+        # Errors are reported per entry instead of being swallowed by ignoreerrors
+        with self.engines.engine(dict(ydl_opts, ignoreerrors=False), path, params=tuning,
+                                 progress_hooks=progress_hooks, postprocessor_hooks=postprocessor_hooks) as ydl:
+            info = ydl.process_ie_result(dict(entry), download=True, extra_info=extra_info)
+        files = [os.path.join(root, f) for root, dirs, files in os.walk(path) for f in files]
+        if not files:
+            # yt-dlp skips files over max_filesize without raising
+            raise RuntimeError(self._nothing_downloaded(ydl_opts.get('max_filesize')))
+        if format_type in AUDIO_FORMATS:
+            files = self.extract_audio(files, format_type)
+        return info, files
+
+    def _download_entries(self, ydl_opts, path, playlist, format_type, tuning, progress_hooks, postprocessor_hooks):
+        """Download a flattened playlist's entries on a bounded pool.
+
+        Each finished entry's files are moved into path and handed to the
+        request's EntryFeed (if any) right away, so a streaming response can
+        send them while later entries are still downloading. Failed entries
+        are listed in errors.txt and in the returned info's failed_entries.
+        """
+        entries = playlist['entries']
+        feed = getattr(self._local, 'entry_feed', None)
+        progress = self._progress()
+        stages = getattr(self._local, 'stages', None)
+        if feed is not None:
+            feed.title = playlist.get('title')
+        extra = {
+            'playlist': playlist.get('title') or playlist.get('id'),
+            'playlist_id': playlist.get('id'),
+            'playlist_title': playlist.get('title'),
+            'n_entries': len(entries),
+        }
+        results = [None] * len(entries)
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.playlist_concurrency, thread_name_prefix='bakraload-entry') as pool:
+            futures = {}
+            for index, entry in enumerate(entries, 1):
+                entry_dir = os.path.join(path, f'.entry_{index}')
+                os.makedirs(entry_dir)
+                future = pool.submit(self._download_entry, ydl_opts, entry_dir, entry,
+                                     dict(extra, playlist_index=index), format_type, tuning, stages,
+                                     (progress_hooks, postprocessor_hooks), feed)
+                futures[future] = (index, entry, entry_dir)
+            done = 0
+            for future in as_completed(futures):
+                index, entry, entry_dir = futures[future]
+                label = entry.get('title') or entry.get('url') or entry.get('id') or f'Entry {index}'
+                try:
+                    info, files = future.result()
+                except Exception as e:
+                    failed.append({'index': index, 'title': label, 'error': str(e).removeprefix('ERROR: ')})
+                    continue
+                finally:
+                    done += 1
+                    if progress:
+                        progress.item(done, len(entries), label)
+                results[index - 1] = info
+                moved = []
+                for src in files:
+                    name = os.path.basename(src)
+                    dest = os.path.join(path, name)
+                    if os.path.exists(dest):
+                        base, ext = os.path.splitext(name)
+                        dest = os.path.join(path, f'{base} ({index}){ext}')
+                    os.replace(src, dest)
+                    moved.append(dest)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                if feed is not None:
+                    feed.entry(path, moved)
+        for index in range(1, len(entries) + 1):
+            shutil.rmtree(os.path.join(path, f'.entry_{index}'), ignore_errors=True)
+        if feed is not None and feed.cancelled.is_set():
+            raise RuntimeError('Download cancelled.')
+        if not any(results):
+            raise RuntimeError(failed[0]['error'] if failed else 'No downloadable content found.')
+        if failed:
+            failed.sort(key=lambda f: f['index'])
+            with open(os.path.join(path, 'errors.txt'), 'w') as f:
+                f.writelines(f"{item['index']}. {item['title']}: {item['error']}\n" for item in failed)
+        return dict(playlist, entries=results, failed_entries=failed)
+
+    def open_passthrough(self, url, format_type='default', quality=None):
+        """Open the selected format upstream so it can be streamed without touching disk.
+
+        Only single-file downloads qualify: no merge, no post-processing, no
+        subtitles and a plain HTTP(S) format (not HLS/DASH fragments); for an
+        audio format, the selected upstream format must already be it. Returns
+        a dict with the upstream response, filename, size (or None) and a
+        close() callable, or None when the normal download path is needed.
+        """
+        platform = self.detect_platform(url)
+        if platform == 'instagram' or not self.is_valid_url(url):
+            return None
+        if self.direct and is_direct_media(url):
+            # DirectFetcher downloads these anyway, so extracting them here would be wasted
+            if format_type in AUDIO_FORMATS:
+                return None
+            stream = self._open_direct_passthrough(url, platform, format_type, quality)
+            if stream:
+                return stream
+        ydl_opts = self.ydl_opts_for(platform, format_type, quality)
+        if ydl_opts.get('postprocessors') or ydl_opts.get('writesubtitles'):
+            return None
+        if self.scheduler:
+            # Raises Overloaded while the platform is degraded, before anything is sent upstream
+            self.scheduler.acquire(platform)
+        streamed = False
+        stack = ExitStack()
+        self._local.stages = {}
+        try:
+            ydl = stack.enter_context(self.engines.engine(ydl_opts, ''))
+            # A download that follows reuses the extraction instead of repeating it
+            info = self._extract_unprocessed(ydl, url, remember=True)
+            info = ydl.process_ie_result(info, download=False) if info is not None else None
+            metrics.observe_stages(platform, format_type, self._local.stages)
+            if (not info or info.get('entries') is not None or info.get('requested_formats')
+                    or info.get('protocol') not in ('http', 'https') or not info.get('url')
+                    or (format_type in AUDIO_FORMATS and not can_stream(format_type, info))):
+                stack.close()
+                return None
+            from yt_dlp.networking import Request
+            # Goes through the engine so the extractor's cookies and headers apply
+            upstream = ydl.urlopen(Request(info['url'], headers=info.get('http_headers') or {}))
+            stack.callback(upstream.close)
+            # Only the upstream's own length may become ours; without one the response is chunked
+            size = None
+            if upstream.headers.get('Content-Encoding', 'identity') == 'identity':
+                length = upstream.headers.get('Content-Length')
+                size = int(length) if length and length.isdigit() else None
+            if quality and quality.max_filesize:
+                # Extractor sizes are often approximate, but good enough to keep within the budget
+                known = size or info.get('filesize') or info.get('filesize_approx')
+                if not (known and known <= quality.max_filesize):
+                    # Only a download can enforce the size budget on this file
+                    stack.close()
+                    return None
+            metrics.DOWNLOADS.labels(platform, metrics.format_label(format_type), 'streamed').inc()
+            streamed = True
+            return {
+                'upstream': upstream,
+                'platform': platform,
+                'filename': os.path.basename(ydl.prepare_filename(info)),
+                'size': size,
+                'close': stack.close,
+            }
+        except Exception:
+            # Let the regular download path retry and report the error
+            stack.close()
+            return None
+        finally:
+            if self.scheduler:
+                if streamed:
+                    self.scheduler.record(platform)
+                else:
+                    # The download that follows takes the slot again and records the outcome once
+                    self.scheduler.release(platform)
+
+    def _get_instagram_post(self, context, shortcode):
+        """Post.from_shortcode, reusing a probed post when there is one"""
+        import instaloader
+        key = self._info_key('instagram_post', shortcode)
+        cached = self.info_cache.get(key) if self.info_cache else None
+        if cached is not None:
+            return instaloader.load_structure(context, cached)
+        post = instaloader.Post.from_shortcode(context, shortcode)
+        if self.info_cache:
+            self.info_cache.set(key, instaloader.get_json_structure(post))
+        return post
+
+    def _serializable_info(self, info):
+        """Turn an unprocessed extractor result into plain JSON data"""
+        import yt_dlp
+        if info.get('entries') is not None and not isinstance(info['entries'], list):
+            info['entries'] = list(info['entries'])
+        # Drop extractor internals (callables etc.) that cannot round-trip through JSON
+        info = {k: v for k, v in info.items() if not k.startswith('__')}
+        return yt_dlp.YoutubeDL.sanitize_info(info)
+
+    def _summarize_info(self, info, platform):
+        """Client-facing metadata for a probed extractor result"""
+        summary = {
+            'status': 'success',
+            'platform': platform,
+            'title': info.get('title', 'Unknown'),
+            'uploader': info.get('uploader'),
+            'webpage_url': info.get('webpage_url'),
+        }
+        if info.get('_type') in ('playlist', 'multi_video') or info.get('entries') is not None:
+            entries = [entry for entry in (info.get('entries') or []) if entry]
+            summary.update({
+                'type': 'playlist',
+                'entry_count': info.get('playlist_count') or len(entries),
+                'entries': [{
+                    'title': entry.get('title', 'Unknown'),
+                    'duration': entry.get('duration'),
+                    'url': entry.get('webpage_url') or entry.get('url'),
+                } for entry in entries[:50]],
+            })
+            return summary
+        formats = []
+        for f in info.get('formats') or []:
+            formats.append({
+                'format_id': f.get('format_id'),
+                'ext': f.get('ext'),
+                'width': f.get('width'),
+                'height': f.get('height'),
+                'vcodec': f.get('vcodec'),
+                'acodec': f.get('acodec'),
+                'tbr': f.get('tbr'),
+                'filesize': f.get('filesize') or f.get('filesize_approx'),
+            })
+        summary.update({
+            'type': 'video',
+            'duration': info.get('duration'),
+            'thumbnail': info.get('thumbnail'),
+            'formats': formats,
+        })
+        return summary
+
+    def probe_instagram_content(self, url):
+        """Instagram metadata without downloading media"""
+        import instaloader
+        with self.instaloaders.loader('') as loader:
+            return self._probe_instagram(instaloader, loader, url)
+
+    def _probe_instagram(self, instaloader, loader, url):
+        if '/stories/' in url:
+            return {'status': 'success', 'platform': 'instagram', 'type': 'stories',
+                    'username': self.extract_instagram_username(url)}
+        elif '/reel/' in url or '/p/' in url or '/tv/' in url:
+            post = self._get_instagram_post(loader.context, self.extract_instagram_shortcode(url))
+            content_type = 'reel' if post.is_video else 'post'
+            if post.typename == 'GraphSidecar':
+                content_type = 'carousel'
+            return {
+                'status': 'success',
+                'platform': 'instagram',
+                'type': content_type,
+                'username': post.owner_username,
+                'title': post.title or (post.caption or '')[:100],
+                'duration': post.video_duration,
+                'media_count': post.mediacount,
+                'thumbnail': post.url,
+            }
+        else:
+            username = self.extract_instagram_username(url)
+            profile = instaloader.Profile.from_username(loader.context, username)
+            return {
+                'status': 'success',
+                'platform': 'instagram',
+                'type': 'profile',
+                'username': profile.username,
+                'title': profile.full_name,
+                'entry_count': profile.mediacount,
+            }
+
+    def probe_content(self, url):
+        """Fetch metadata without downloading. The result is reused by the download that follows"""
+        import yt_dlp
+        if not self.is_valid_url(url):
+            return {'status': 'error', 'message': 'Invalid or unsupported URL.'}
+        platform = self.detect_platform(url)
+        try:
+            if platform == 'instagram':
+                return self.probe_instagram_content(url)
+            key = self._info_key('ytdlp', url)
+            info = self.info_cache.get(key) if self.info_cache else None
+            if info is None:
+                info = self._probe_upstream(yt_dlp, url, platform)
+                if self.info_cache:
+                    self.info_cache.set(key, info)
+            return self._summarize_info(info, platform)
+        except Overloaded:
+            raise
+        except Exception as e:
+            return {'status': 'error', 'message': f'Probe error: {str(e)}'}
+
+    def _probe_upstream(self, yt_dlp, url, platform):
+        """extract_info(process=False) as a paced, circuit-broken request to the platform"""
+        if self.scheduler:
+            self.scheduler.acquire(platform)
+        error = None
+        try:
+            with yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True}) as ydl:
+                return self._serializable_info(ydl.extract_info(url, download=False, process=False))
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            if self.scheduler:
+                self.scheduler.record(platform, error)
+
     def extract_instagram_shortcode(self, url):
         """Extract shortcode from Instagram URL"""
         patterns = [
@@ -430,31 +1011,106 @@ class UniversalDownloader:
             return match.group(1)
         return None
     
-    def download_content(self, url, format_type='default'):
-        """Main download function. Returns (download_dir, file_list, error_msg, info_dict)"""
-        platform = self.detect_platform(url)
+    def download_content(self, url, format_type='default', progress=None, entry_feed=None, quality=None):
+        """Main download function. Returns (download_dir, file_list, error_msg, info_dict)
+
+        progress is an optional ProgressReporter fed from the yt-dlp/instaloader callbacks;
+        entry_feed is an optional EntryFeed that gets playlist entries as they finish;
+        quality is an optional quality.Quality profile the selected formats must satisfy.
+        """
+        self._local.progress = progress
+        self._local.entry_feed = entry_feed
+        self._local.stages = {}
+        self._local.downloaded_bytes = 0
+        try:
+            with profiling.stage('download'):
+                if self.cache is None or not self.is_valid_url(url):
+                    result = self._download_content(url, format_type, quality)
+                else:
+                    result = self.cache.fetch(url, format_type, self._download_content, quality)
+                    metrics.CACHE_REQUESTS.labels('result', 'hit' if (result[3] or {}).get('cached') else 'miss').inc()
+        finally:
+            self._local.progress = None
+            self._local.entry_feed = None
+        metrics.record_download(self.detect_platform(url), format_type, error=result[2], info=result[3],
+                                stages=self._local.stages, downloaded_bytes=self._local.downloaded_bytes)
+        self._local.stages = None
+        return result
+
+    def extract_audio(self, file_list, format_type):
+        """Turn downloaded files into the requested audio format (see AudioExtractor); returns the new paths"""
+        if not self.ffmpeg_path:
+            raise RuntimeError('ffmpeg is not installed or not in PATH. Audio downloads require ffmpeg.')
+        progress = self._progress()
+        if progress:
+            progress.update(force=True, stage='postprocessing')
+        try:
+            return [self.audio.convert(self.ffmpeg_path, path, format_type, add_stage=self._add_stage)
+                    for path in file_list]
+        except subprocess.CalledProcessError as e:
+            detail = (e.stderr or b'').decode(errors='replace').strip().splitlines()
+            raise RuntimeError(f'Postprocessing: audio conversion failed{": " + detail[-1] if detail else ""}')
+
+    def _download_content(self, url, format_type='default', quality=None):
+        """Download straight from the platform, bypassing the result cache.
+
+        With a scheduler, the download waits for the platform's pacing and
+        raises Overloaded instead of starting while its circuit is open.
+        """
         if not self.is_valid_url(url):
             return None, None, 'Invalid or unsupported URL.', None
-        temp_dir = tempfile.mkdtemp(prefix=f"bakraload_{platform}_")
+        if self.scheduler is None:
+            return self._fetch_content(url, format_type, quality)
+        platform = self.detect_platform(url)
+        self.scheduler.acquire(platform)
+        result = (None, None, 'An error occurred while processing your request.', None)
         try:
-            if platform == 'youtube':
-                result = self.download_youtube_content(url, temp_dir, format_type)
-            elif platform == 'instagram':
-                result = self.download_instagram_content(url, temp_dir)
-            elif platform == 'tiktok':
-                result = self.download_tiktok_content(url, temp_dir, format_type)
-            elif platform == 'twitter':
-                result = self.download_twitter_content(url, temp_dir, format_type)
-            elif platform == 'facebook':
-                result = self.download_facebook_content(url, temp_dir, format_type)
-            elif platform == 'reddit':
-                result = self.download_reddit_content(url, temp_dir, format_type)
-            else:
-                result = self.download_generic_content(url, temp_dir, format_type)
+            result = self._fetch_content(url, format_type, quality)
+            return result
+        finally:
+            # The platform's own error message tells throttles and login walls apart from bad links
+            self.scheduler.record(platform, result[2])
+
+    def _nothing_downloaded(self, max_filesize=None):
+        if max_filesize:
+            return f'No downloadable content within the size budget of {max_filesize // (1024 * 1024)} MB.'
+        return 'No downloadable content found.'
+
+    def _fetch_content(self, url, format_type='default', quality=None):
+        """Dispatch to the platform's downloader; returns (download_dir, file_list, error_msg, info_dict)"""
+        platform = self.detect_platform(url)
+        temp_dir = make_temp_dir(platform)
+        self._local.tuning = None
+        try:
+            result = None
+            if self.direct and is_direct_media(url):
+                # Plain media files skip extraction; a URL that serves a page goes on to yt-dlp
+                result = self.download_direct_content(url, temp_dir, format_type, quality)
+            if result is None:
+                if platform == 'youtube':
+                    result = self.download_youtube_content(url, temp_dir, format_type, quality)
+                elif platform == 'instagram':
+                    start = time.perf_counter()
+                    result = self.download_instagram_content(url, temp_dir)
+                    self._add_stage('download', time.perf_counter() - start)
+                elif platform == 'tiktok':
+                    result = self.download_tiktok_content(url, temp_dir, format_type, quality)
+                elif platform == 'twitter':
+                    result = self.download_twitter_content(url, temp_dir, format_type, quality)
+                elif platform == 'facebook':
+                    result = self.download_facebook_content(url, temp_dir, format_type, quality)
+                elif platform == 'reddit':
+                    result = self.download_reddit_content(url, temp_dir, format_type, quality)
+                else:
+                    result = self.download_generic_content(url, temp_dir, format_type, quality)
             # If result is error dict, return error
             if isinstance(result, dict) and result.get('status') == 'error':
+                self.tuner.record_error(platform, result.get('message'))
                 shutil.rmtree(temp_dir, ignore_errors=True)
                 return None, None, result.get('message', 'Download error.'), None
+            # Report the download tuning that was used
+            if isinstance(result, dict) and getattr(self._local, 'tuning', None):
+                result['tuning'] = self._local.tuning
             # List downloaded files
             file_list = []
             for root, dirs, files in os.walk(temp_dir):
@@ -462,14 +1118,189 @@ class UniversalDownloader:
                     file_list.append(os.path.join(root, f))
             if not file_list:
                 shutil.rmtree(temp_dir, ignore_errors=True)
-                return None, None, 'No downloadable content found.', None
+                return None, None, self._nothing_downloaded(quality and quality.max_filesize), None
             return temp_dir, file_list, None, result
         except Exception as e:
             shutil.rmtree(temp_dir, ignore_errors=True)
             return None, None, 'An error occurred while processing your request.', None
 
-# Initialize downloader
-downloader = UniversalDownloader()
+# Where job records, cached results and other shared state live
+data_dir = os.getenv('DATA_DIR', os.path.join(tempfile.gettempdir(), 'bakraload-data'))
+
+# Initialize downloader, with finished results cached on disk
+result_cache = None
+if os.getenv('RESULT_CACHE_ENABLED', 'True').lower() == 'true':
+    result_cache = ResultCache(
+        os.path.join(data_dir, 'cache'),
+        max_bytes=int(os.getenv('RESULT_CACHE_MAX_BYTES', str(2 * 1024 ** 3))),
+        ttl=int(os.getenv('RESULT_CACHE_TTL', '3600')),
+    )
+# Probed metadata is kept briefly so the download that follows skips extraction
+info_cache = InfoCache(
+    ttl=int(os.getenv('INFO_CACHE_TTL', '300')),
+    redis_url=os.getenv('REDIS_URL'),
+)
+downloader = UniversalDownloader(
+    cache=result_cache,
+    info_cache=info_cache,
+    engines=EnginePool(max_idle_per_profile=int(os.getenv('YDL_ENGINES_PER_PROFILE', '4'))),
+    # Fragment concurrency, chunk and buffer sizes per platform, e.g.
+    # DOWNLOAD_TUNING='{"youtube": {"concurrent_fragment_downloads": 8}}'
+    tuner=DownloadTuner(
+        profiles=json.loads(os.getenv('DOWNLOAD_TUNING', '{}')),
+        adaptive=os.getenv('DOWNLOAD_TUNING_ADAPTIVE', 'True').lower() == 'true',
+        max_fragments=int(os.getenv('DOWNLOAD_MAX_FRAGMENTS', '16')),
+    ),
+    # Long-lived Instaloader contexts, optionally logged in with a session file from `instaloader --login`
+    instaloaders=InstaloaderPool(
+        size=int(os.getenv('INSTAGRAM_CONTEXTS', '2')),
+        session_user=os.getenv('INSTAGRAM_SESSION_USER') or None,
+        session_file=os.getenv('INSTAGRAM_SESSION_FILE') or None,
+    ),
+    instagram_concurrency=int(os.getenv('INSTAGRAM_FETCH_CONCURRENCY', '4')),
+    # Repeat profile/story syncs only fetch what is new since the last one
+    profile_library=ProfileLibrary(os.path.join(data_dir, 'instagram')) if os.getenv(
+        'INSTAGRAM_PROFILE_SYNC', 'True').lower() == 'true' else None,
+    # Playlist entries downloaded at once per request
+    playlist_concurrency=int(os.getenv('PLAYLIST_CONCURRENCY', '4')),
+    # Audio transcodes share this many slots across all workers (default: one per CPU core)
+    audio=AudioExtractor(TranscodePool(
+        os.path.join(data_dir, 'transcode'),
+        size=int(os.getenv('TRANSCODE_SLOTS', '0')) or None,
+    )),
+    # Per-platform request pacing, e.g. PLATFORM_RATE_LIMITS='{"instagram": {"rate": 0.5, "burst": 5}}',
+    # and a circuit breaker that fails fast (503 + Retry-After) while a platform is throttling or failing
+    scheduler=PlatformScheduler(
+        limits=json.loads(os.getenv('PLATFORM_RATE_LIMITS', '{}')),
+        max_wait=float(os.getenv('PLATFORM_MAX_WAIT', '10')),
+        window=int(os.getenv('CIRCUIT_WINDOW', '60')),
+        min_requests=int(os.getenv('CIRCUIT_MIN_REQUESTS', '5')),
+        failure_ratio=float(os.getenv('CIRCUIT_FAILURE_RATIO', '0.5')),
+        cooldown=int(os.getenv('CIRCUIT_COOLDOWN', '30')),
+        max_cooldown=int(os.getenv('CIRCUIT_MAX_COOLDOWN', '600')),
+    ) if os.getenv('PLATFORM_SCHEDULER', 'True').lower() == 'true' else None,
+    # Direct media links skip yt-dlp; big files are fetched as parallel Range chunks
+    direct=DirectFetcher(
+        connections=int(os.getenv('DIRECT_CONNECTIONS', '4')),
+        chunk_size=int(os.getenv('DIRECT_CHUNK_SIZE', str(8 * 1024 ** 2))),
+    ) if os.getenv('DIRECT_FETCH', 'True').lower() == 'true' else None,
+)
+# Comma-separated platform:format profiles to build engines for at startup, e.g. youtube:default,tiktok:default
+# (built by warm_up(), or lazily on first use)
+prewarm_profiles = [p.split(':', 1) for p in os.getenv('YDL_PREWARM_PROFILES', '').split(',') if ':' in p]
+
+# Background jobs: download concurrency is capped per worker, independently of the web tier
+# Finished downloads stay available as signed, resumable links for a while.
+# SECRET_KEY must be shared by all workers or links only work on the worker that signed them.
+artifact_store = ArtifactStore(
+    os.path.join(data_dir, 'artifacts'),
+    app.config['SECRET_KEY'],
+    retention=int(os.getenv('ARTIFACT_RETENTION', '3600')),
+)
+
+# How finished files are delivered: 'direct' streams them from Python, 'x-accel' (nginx) and
+# 'x-sendfile' (Apache, lighttpd, Caddy) hand the artifact path to the fronting proxy
+delivery_mode = os.getenv('DELIVERY_MODE', 'direct').lower()
+if delivery_mode not in ('direct', 'x-accel', 'x-sendfile'):
+    raise ValueError(f"Unknown DELIVERY_MODE '{delivery_mode}'")
+# Internal proxy location that maps onto the artifact directory (x-accel only)
+accel_redirect_prefix = os.getenv('ACCEL_REDIRECT_PREFIX', '/protected-artifacts/')
+# Files published only so the proxy can send one response are reaped after this, not ARTIFACT_RETENTION
+offload_retention = int(os.getenv('OFFLOAD_RETENTION', '300'))
+
+# Stream single-file formats straight from upstream instead of via a temp dir
+passthrough_streaming = os.getenv('PASSTHROUGH_STREAMING', 'True').lower() == 'true'
+# Direct playlist downloads: stream the zip while later entries are still downloading
+playlist_streaming = os.getenv('PLAYLIST_STREAMING', 'True').lower() == 'true'
+
+# Reap download dirs left behind by killed workers or aborted responses
+janitor = TempJanitor(
+    max_age=int(os.getenv('TEMP_MAX_AGE', '3600')),
+    orphan_grace=int(os.getenv('TEMP_ORPHAN_GRACE', '60')),
+    interval=int(os.getenv('TEMP_SWEEP_INTERVAL', '60')),
+    # How fresh the temp usage and free space that admission control reads are
+    measure_interval=float(os.getenv('TEMP_MEASURE_INTERVAL', '5')),
+)
+# Turn downloads away (503 + Retry-After) while temp space or CPU is exhausted; queued jobs wait instead
+admission = AdmissionControl(
+    janitor,
+    disk_budget=int(os.getenv('TEMP_DISK_BUDGET', str(10 * 1024 ** 3))),
+    min_free_bytes=int(os.getenv('TEMP_MIN_FREE_BYTES', str(1024 ** 3))),
+    max_load=float(os.getenv('MAX_LOAD_PER_CPU', '0')) or None,
+    retry_after=int(os.getenv('OVERLOAD_RETRY_AFTER', '30')),
+)
+
+# Opt-in profiles of slow requests (or of any request an admin flags with X-Profile: 1)
+profiler = Profiler(
+    os.path.join(data_dir, 'profiles'),
+    enabled=os.getenv('PROFILE_SLOW_REQUESTS', 'False').lower() == 'true',
+    threshold=float(os.getenv('PROFILE_THRESHOLD', '30')),
+    interval=float(os.getenv('PROFILE_SAMPLE_INTERVAL', '0.01')),
+    keep=int(os.getenv('PROFILE_KEEP', '50')),
+)
+# Bearer token for the /admin endpoints; they are disabled when unset
+admin_token = os.getenv('ADMIN_TOKEN')
+
+# Jobs run in the web workers unless JOB_QUEUE_URL is set: with redis://... they are queued in Redis
+# for worker.py processes on any node (which must share DATA_DIR/artifacts with the web tier);
+# memory:// is an in-process stand-in that runs the queue inside this process. Its records stay in the
+# file store under DATA_DIR, which every gunicorn worker shares, so /jobs/<id> answers from any of them
+job_queue_url = os.getenv('JOB_QUEUE_URL')
+job_redis = job_queue.connect(job_queue_url) if job_queue_url else None
+job_manager = JobManager(
+    downloader,
+    job_queue.RedisJobStore(job_redis) if job_redis and job_queue_url != 'memory://'
+    else JobStore(os.path.join(data_dir, 'jobs')),
+    artifact_store,
+    admission=admission,
+    profiler=profiler,
+    max_workers=int(os.getenv('JOB_WORKERS', '2')),
+    queue_limit=int(os.getenv('JOB_QUEUE_LIMIT', '50')),
+    result_ttl=int(os.getenv('JOB_RESULT_TTL', '3600')),
+    queue=job_queue.DownloadQueue(job_redis, node=os.getenv('WORKER_NAME') or None) if job_redis else None,
+    # Jobs for a paced or circuit-broken platform wait this long for it instead of failing at once
+    platform_wait=int(os.getenv('JOB_PLATFORM_WAIT', '900')),
+)
+# Expired job records and artifacts are reaped in the background, not by the requests that create new ones
+janitor.add_task(job_manager.reap_expired)
+janitor.add_task(artifact_store.reap_expired)
+# How often /jobs/<id>/events re-reads the job, and how long one stream stays open
+job_events_interval = float(os.getenv('JOB_EVENTS_INTERVAL', '0.5'))
+job_events_timeout = int(os.getenv('JOB_EVENTS_TIMEOUT', '300'))
+
+# Bulk batches run concurrently, capped overall and per platform
+bulk_downloader = BulkDownloader(
+    downloader,
+    max_workers=int(os.getenv('BULK_CONCURRENCY', '4')),
+    per_platform=int(os.getenv('BULK_PER_PLATFORM', '2')),
+)
+
+def warm_up():
+    """Import heavy modules and build pooled engines before the first request.
+
+    Called from the gunicorn master when the app is preloaded, so workers
+    inherit the loaded modules copy-on-write instead of importing them each.
+    """
+    import requests  # noqa: F401
+    import instaloader  # noqa: F401
+    from yt_dlp.extractor import gen_extractor_classes
+    gen_extractor_classes()
+    downloader.ffmpeg_path
+    downloader.warm_engines(prewarm_profiles)
+
+@app.before_request
+def start_janitor():
+    # Started per worker on first use, so the thread isn't lost across the gunicorn fork
+    janitor.start()
+
+if job_queue_url == 'memory://':
+    # Nothing outside this process can reach an in-process queue, so work it here
+    app.before_request(job_manager.start_worker)
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    metrics.REJECTED.labels(e.reason).inc()
+    return jsonify({'status': 'error', 'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
 
 @app.route('/')
 def index():
@@ -478,81 +1309,363 @@ def index():
 
 from flask import after_this_request
 
+def send_downloaded_content(temp_dir, file_list, info, platform='unknown', format_type='default'):
+    """Serve a single file directly, or zip multiple files"""
+    # If only one file, serve it directly
+    if len(file_list) == 1:
+        file_path = file_list[0]
+        filename = os.path.basename(file_path)
+        @after_this_request
+        def cleanup(response):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return response
+        response = send_file(file_path, as_attachment=True, download_name=filename,
+                             mimetype='application/octet-stream')
+        return metrics.track_transfer(response, 'file', platform, format_type)
+    # If multiple files, stream a zip while reading them
+    return send_zip_stream(temp_dir, file_list, zip_filename_for(info), platform, format_type)
+
+def send_zip_stream(temp_dir, file_list, zip_filename, platform='unknown', format_type='default'):
+    """Stream a zip of file_list (paths relative to temp_dir) as a chunked response"""
+    entries = [(f, os.path.relpath(f, temp_dir)) for f in file_list]
+    chunks = metrics.timed_iter(iter_zip(entries), 'zip', platform, format_type)
+    response = Response(chunks, mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=zip_filename)
+    # The body is generated after the view returns, so clean up once it is closed
+    response.call_on_close(lambda: shutil.rmtree(temp_dir, ignore_errors=True))
+    return metrics.track_transfer(response, 'zip', platform, format_type)
+
+def start_download(url, format_type, quality=None):
+    """Run download_content on its own thread; the returned EntryFeed says when there is something to send"""
+    feed = EntryFeed()
+    capture = profiling.current()
+
+    def run():
+        if capture is not None:
+            capture.attach()
+        exception = None
+        try:
+            result = downloader.download_content(url, format_type, entry_feed=feed, quality=quality)
+        except Exception as e:
+            result = (None, None, 'An error occurred while processing your request.', None)
+            # A paced or circuit-broken platform still answers 503 + Retry-After
+            exception = e if isinstance(e, Overloaded) else None
+        feed.finish(result, exception)
+
+    threading.Thread(target=run, name='bakraload-download', daemon=True).start()
+    return feed
+
+def send_entry_stream(feed, platform='unknown', format_type='default'):
+    """Stream a zip of a playlist whose entries are still downloading, adding each one as it finishes"""
+    response = Response(iter_zip(feed.files()), mimetype='application/zip')
+    zip_filename = zip_filename_for({'type': 'playlist', 'playlist_title': feed.title or 'Playlist'})
+    response.headers.set('Content-Disposition', 'attachment', filename=zip_filename)
+    # Stops entries that haven't started; the download dir goes once both sides are done
+    response.call_on_close(feed.close)
+    return metrics.track_transfer(response, 'zip', platform, format_type)
+
+def send_passthrough(stream, format_type='default', chunk_size=64 * 1024):
+    """Relay an upstream media response to the client chunk by chunk"""
+    upstream = stream['upstream']
+
+    def generate():
+        relayed = 0
+        try:
+            while True:
+                chunk = upstream.read(chunk_size)
+                if not chunk:
+                    break
+                relayed += len(chunk)
+                yield chunk
+        finally:
+            metrics.DOWNLOADED_BYTES.labels(stream['platform']).inc(relayed)
+
+    response = Response(generate(), mimetype='application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment', filename=stream['filename'])
+    if stream['size']:
+        response.headers['Content-Length'] = str(stream['size'])
+    # Return the engine to the pool once the client has the last byte (or went away)
+    response.call_on_close(stream['close'])
+    return metrics.track_transfer(response, 'passthrough', stream['platform'], format_type)
+
+def is_admin():
+    auth = request.headers.get('Authorization', '')
+    return bool(admin_token) and secrets.compare_digest(auth, f'Bearer {admin_token}')
+
+def profile_requested():
+    return request.headers.get('X-Profile') == '1' and is_admin()
+
+def profiled(view):
+    """Profile the view and the sending of its response body when the profiler asks for it"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        capture = profiler.start(request.path, force=profile_requested())
+        if capture is None:
+            return view(*args, **kwargs)
+        try:
+            with capture.stage('handler'):
+                response = app.make_response(view(*args, **kwargs))
+        except BaseException:
+            capture.finish()
+            raise
+        # send_file bodies go to the server untouched, so it can still use sendfile()
+        if response.is_streamed and not response.direct_passthrough:
+            body = response.response
+
+            def profiled_body():
+                # Zipping and streaming happen while the server iterates the body
+                capture.attach()
+                with capture.stage('send'):
+                    yield from body
+            response.response = profiled_body()
+            if hasattr(body, 'close'):
+                response.call_on_close(body.close)
+        closing.call_on_close(capture.finish)
+        return response
+    return wrapper
+
+def artifact_url_for(artifact):
+    return url_for('get_artifact', token=artifact_store.sign(artifact['id']))
+
+def publish_artifact(temp_dir, file_list, archive_name, always_archive=False, retention=None):
+    """Move a finished download into the artifact store; the temp dir is removed either way"""
+    try:
+        return artifact_store.publish(temp_dir, file_list, archive_name, always_archive=always_archive,
+                                      retention=retention)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def send_link(artifact):
+    """Return a signed link to the artifact instead of the bytes"""
+    return jsonify({
+        'status': 'success',
+        'filename': artifact['filename'],
+        'size': artifact['size'],
+        'artifact_url': artifact_url_for(artifact),
+        'expires_at': artifact['expires_at'],
+    })
+
 @app.route('/download', methods=['POST'])
 @limiter.limit("10/minute")
+@profiled
 def download():
     """Handle download requests and return file/zip directly"""
+    admission.check()
     try:
         data = request.get_json()
         url = data.get('url', '').strip()
         format_type = data.get('format', 'default')
+        if format_type not in downloader.FORMATS:
+            return jsonify({'status': 'error',
+                            'message': f'Unsupported format. Use one of: {", ".join(downloader.FORMATS)}.'}), 400
         if not url:
             return jsonify({'status': 'error', 'message': 'No URL provided.'}), 400
-        temp_dir, file_list, error, info = downloader.download_content(url, format_type)
+        try:
+            quality = parse_quality(data.get('quality'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        delivery = data.get('delivery')
+        if (delivery == 'stream' or (passthrough_streaming and delivery is None and delivery_mode == 'direct')) \
+                and not (result_cache and result_cache.contains(url, format_type, quality)):
+            stream = downloader.open_passthrough(url, format_type, quality)
+            if stream:
+                return send_passthrough(stream, format_type)
+        if delivery is None and delivery_mode == 'direct' and playlist_streaming:
+            # Playlist entries go out as soon as each one is downloaded
+            feed = start_download(url, format_type, quality)
+            if feed.wait():
+                return send_entry_stream(feed, downloader.detect_platform(url), format_type)
+            if feed.exception:
+                raise feed.exception
+            temp_dir, file_list, error, info = feed.result
+        else:
+            temp_dir, file_list, error, info = downloader.download_content(url, format_type, quality=quality)
         if error:
             return jsonify({'status': 'error', 'message': error}), 400
-        # If only one file, serve it directly
-        if len(file_list) == 1:
-            file_path = file_list[0]
-            filename = os.path.basename(file_path)
-            @after_this_request
-            def cleanup(response):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                return response
-            return send_file(file_path, as_attachment=True, download_name=filename, mimetype='application/octet-stream')
-        # If multiple files, zip them
-        else:
-            # Use playlist title if available, otherwise default name
-            zip_filename = 'download.zip'
-            if info and isinstance(info, dict):
-                if info.get('type') == 'playlist':
-                    playlist_title = info.get('playlist_title', 'Playlist')
-                    # Sanitize playlist title for filename
-                    safe_title = re.sub(r'[<>:"/\\|?*]', '_', playlist_title)
-                    safe_title = safe_title.strip()[:100]  # Limit length
-                    if safe_title:
-                        zip_filename = f"{safe_title}.zip"
-            
-            zip_path = os.path.join(temp_dir, zip_filename)
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for f in file_list:
-                    arcname = os.path.relpath(f, temp_dir)
-                    zipf.write(f, arcname)
-            @after_this_request
-            def cleanup(response):
-                shutil.rmtree(temp_dir, ignore_errors=True)
-                return response
-            return send_file(zip_path, as_attachment=True, download_name=zip_filename, mimetype='application/zip')
+        if delivery == 'link':
+            return send_link(publish_artifact(temp_dir, file_list, zip_filename_for(info)))
+        if delivery_mode != 'direct':
+            # Hand the file to the proxy; nothing links to it afterwards, so it is kept only briefly
+            return send_artifact(publish_artifact(temp_dir, file_list, zip_filename_for(info),
+                                                  retention=offload_retention))
+        return send_downloaded_content(temp_dir, file_list, info, downloader.detect_platform(url), format_type)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': 'Server error.'}), 500
+
+@app.route('/info', methods=['POST'])
+@limiter.limit("30/minute")
+def info():
+    """Return title, formats, durations and playlist size without downloading"""
+    try:
+        data = request.get_json()
+        url = data.get('url', '').strip()
+        if not url:
+            return jsonify({'status': 'error', 'message': 'No URL provided.'}), 400
+        result = downloader.probe_content(url)
+        if result.get('status') == 'error':
+            return jsonify(result), 400
+        return jsonify(result)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({'status': 'error', 'message': 'Server error.'}), 500
 
+@app.route('/jobs', methods=['POST'])
+@limiter.limit("10/minute")
+def create_job():
+    """Queue a download and return its job id immediately"""
+    try:
+        data = request.get_json()
+        url = data.get('url', '').strip()
+        format_type = data.get('format', 'default')
+        if format_type not in downloader.FORMATS:
+            return jsonify({'status': 'error',
+                            'message': f'Unsupported format. Use one of: {", ".join(downloader.FORMATS)}.'}), 400
+        if not url:
+            return jsonify({'status': 'error', 'message': 'No URL provided.'}), 400
+        if not downloader.is_valid_url(url):
+            return jsonify({'status': 'error', 'message': 'Invalid or unsupported URL.'}), 400
+        try:
+            quality = parse_quality(data.get('quality'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        job = job_manager.submit(url, format_type, profile=profile_requested(), quality=quality)
+    except QueueFull as e:
+        metrics.REJECTED.labels('queue_full').inc()
+        return jsonify({'status': 'error', 'message': str(e)}), 503, {'Retry-After': '30'}
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': 'Server error.'}), 500
+    return jsonify({
+        'status': 'success',
+        'job_id': job['id'],
+        'state': job['state'],
+        'status_url': url_for('job_status', job_id=job['id']),
+        'events_url': url_for('job_events', job_id=job['id']),
+        'result_url': url_for('job_result', job_id=job['id']),
+    }), 202
+
+@app.route('/jobs/<job_id>')
+@limiter.exempt
+def job_status(job_id):
+    """Report the state of a queued download"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found.'}), 404
+    return jsonify({'status': 'success', 'job': job_view(job)})
+
+def job_view(job):
+    view = job_manager.public_view(job)
+    if job.get('artifact'):
+        view['artifact_url'] = artifact_url_for(job['artifact'])
+    return view
+
+@app.route('/jobs/<job_id>/events')
+@limiter.exempt
+def job_events(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found.'}), 404
+
+    def generate(job):
+        # The job may run in another worker, so follow its record rather than the hooks
+        deadline = time.monotonic() + job_events_timeout
+        last_sent = None
+        last_beat = time.monotonic()
+        while job is not None:
+            if job['updated_at'] != last_sent:
+                last_sent = job['updated_at']
+                finished = job['state'] in job_manager.FINISHED_STATES
+                yield f"event: {'done' if finished else 'progress'}\ndata: {json.dumps(job_view(job))}\n\n"
+                if finished:
+                    return
+            elif time.monotonic() - last_beat > 15:
+                # Keeps proxies from closing an idle connection
+                yield ': keep-alive\n\n'
+                last_beat = time.monotonic()
+            if time.monotonic() > deadline:
+                # EventSource reconnects on its own
+                return
+            time.sleep(job_events_interval)
+            job = job_manager.get(job_id)
+
+    # url_for() in job_view needs the request context while the body is generated
+    response = Response(stream_with_context(generate(job)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/jobs/<job_id>/result')
+@limiter.exempt
+def job_result(job_id):
+    """Serve the file/zip produced by a finished job"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Job not found.'}), 404
+    if job['state'] == 'failed':
+        return jsonify({'status': 'error', 'message': job.get('error') or 'Download error.'}), 400
+    if job['state'] != 'succeeded':
+        return jsonify({'status': 'error', 'message': 'Job is not finished yet.', 'state': job['state']}), 409
+    artifact = artifact_store.get(job['artifact']['id'])
+    if artifact is None:
+        return jsonify({'status': 'error', 'message': 'Job result has expired.'}), 410
+    return send_artifact(artifact)
+
+def send_artifact(artifact):
+    """Send a stored artifact with Range, ETag and If-None-Match support"""
+    if delivery_mode != 'direct':
+        return offload_artifact(artifact)
+    response = send_file(artifact['path'], as_attachment=True, download_name=artifact['filename'],
+                         mimetype=artifact['mimetype'], conditional=True, etag=True,
+                         max_age=max(0, int(artifact['expires_at'] - time.time())))
+    response.headers['Accept-Ranges'] = 'bytes'
+    return metrics.track_transfer(response, 'artifact')
+
+def offload_artifact(artifact):
+    """Let the fronting proxy send the file (X-Accel-Redirect / X-Sendfile) so the worker is freed at once"""
+    response = Response(mimetype=artifact['mimetype'])
+    response.headers.set('Content-Disposition', 'attachment', filename=artifact['filename'])
+    if delivery_mode == 'x-accel':
+        response.headers['X-Accel-Redirect'] = '/'.join([
+            accel_redirect_prefix.rstrip('/'), artifact['id'], ArtifactStore.CONTENT_NAME,
+        ])
+    else:
+        response.headers['X-Sendfile'] = artifact['path']
+    metrics.SENT_BYTES.labels(delivery_mode).inc(artifact['size'])
+    return response
+
+@app.route('/artifacts/<token>')
+@limiter.exempt
+def get_artifact(token):
+    """Download a stored artifact through its signed link; resumable via Range requests"""
+    artifact = artifact_store.resolve(token)
+    if artifact is None:
+        return jsonify({'status': 'error', 'message': 'Link is invalid or has expired.'}), 404
+    return send_artifact(artifact)
+
 @app.route('/bulk-download', methods=['POST'])
 @limiter.limit("3/minute")
+@profiled
 def bulk_download():
     """Handle bulk download requests and return a zip"""
+    admission.check()
     try:
         data = request.get_json()
         urls = data.get('urls', [])
         format_type = data.get('format', 'default')
+        if format_type not in downloader.FORMATS:
+            return jsonify({'status': 'error',
+                            'message': f'Unsupported format. Use one of: {", ".join(downloader.FORMATS)}.'}), 400
         if not urls:
             return jsonify({'status': 'error', 'message': 'No URLs provided.'}), 400
-        temp_dir = tempfile.mkdtemp(prefix="bakraload_bulk_")
-        all_files = []
-        errors = []
-        for idx, url in enumerate(urls):
-            sub_dir = os.path.join(temp_dir, f'item_{idx+1}')
-            os.makedirs(sub_dir, exist_ok=True)
-            d_temp, file_list, error, info = downloader.download_content(url, format_type)
-            if error:
-                errors.append(f"URL {idx+1}: {error}")
-                continue
-            # Move files from d_temp to sub_dir
-            for f in file_list:
-                dest = os.path.join(sub_dir, os.path.basename(f))
-                shutil.move(f, dest)
-            shutil.rmtree(d_temp, ignore_errors=True)
-            for f in os.listdir(sub_dir):
-                all_files.append(os.path.join(sub_dir, f))
+        try:
+            quality = parse_quality(data.get('quality'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        temp_dir = make_temp_dir('bulk')
+        all_files, errors = bulk_downloader.download_all(urls, format_type, temp_dir, quality)
         if not all_files:
             shutil.rmtree(temp_dir, ignore_errors=True)
             return jsonify({'status': 'error', 'message': 'No downloadable content found.\\n' + '\\n'.join(errors)}), 400
@@ -561,24 +1674,51 @@ def bulk_download():
         import random
         random_hash = ''.join(random.choices('0123456789ABCDEF', k=6))
         zip_filename = f'Bulk_vid_{random_hash}.zip'
-        zip_path = os.path.join(temp_dir, zip_filename)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for root, dirs, files in os.walk(temp_dir):
-                for f in files:
-                    if f.endswith('.zip'):
-                        continue
-                    abs_path = os.path.join(root, f)
-                    arcname = os.path.relpath(abs_path, temp_dir)
-                    zipf.write(abs_path, arcname)
-        @after_this_request
-        def cleanup(response):
-            shutil.rmtree(temp_dir, ignore_errors=True)
-            return response
-        return send_file(zip_path, as_attachment=True, download_name=zip_filename, mimetype='application/zip')
+        if data.get('delivery') == 'link':
+            return send_link(publish_artifact(temp_dir, all_files, zip_filename, always_archive=True))
+        if delivery_mode != 'direct':
+            return send_artifact(publish_artifact(temp_dir, all_files, zip_filename, always_archive=True,
+                                                  retention=offload_retention))
+        return send_zip_stream(temp_dir, all_files, zip_filename, 'bulk', format_type)
     except Exception as e:
         return jsonify({'status': 'error', 'message': 'Bulk download error.'}), 500
 
+@app.route('/admin/profiles')
+@limiter.exempt
+def list_profiles():
+    """Stored slow-request profiles, newest first"""
+    if not admin_token:
+        abort(404)
+    if not is_admin():
+        return jsonify({'status': 'error', 'message': 'Unauthorized.'}), 401
+    profiles = profiler.list()
+    for meta in profiles:
+        meta['folded_url'] = url_for('get_profile', capture_id=meta['id'], kind='folded')
+        meta['pstats_urls'] = {stage: url_for('get_profile', capture_id=meta['id'], kind=f'{stage}.prof')
+                               for stage in meta['pstats']}
+    return jsonify({'status': 'success', 'profiles': profiles})
+
+@app.route('/admin/profiles/<capture_id>/<kind>')
+@limiter.exempt
+def get_profile(capture_id, kind):
+    """Folded stacks (for flamegraph.pl / speedscope) or a stage's pstats dump"""
+    if not admin_token:
+        abort(404)
+    if not is_admin():
+        return jsonify({'status': 'error', 'message': 'Unauthorized.'}), 401
+    path = profiler.path_for(capture_id, kind)
+    if path is None:
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=f'{capture_id}.{kind}',
+                     mimetype='text/plain' if kind == 'folded' else 'application/octet-stream')
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    """Prometheus metrics, merged across gunicorn workers"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
 @app.route('/supported-platforms')
 def supported_platforms():
     """List supported platforms"""
@@ -0,0 +1,107 @@
+"""Finished downloads kept on disk for a retention window and handed out as signed links"""
+import json
+import os
+import re
+import secrets
+import shutil
+import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+from zipstream import iter_zip
+
+
+class ArtifactStore:
+    """Directory of published files, one sub-directory per artifact"""
+    ARTIFACT_ID_REGEX = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+    # The payload is stored under a fixed name; the download name lives in meta.json
+    CONTENT_NAME = 'content'
+
+    def __init__(self, root, secret_key, retention=3600):
+        self.root = root
+        self.retention = retention
+        self._serializer = URLSafeTimedSerializer(secret_key, salt='bakraload-artifact')
+        os.makedirs(self.root, exist_ok=True)
+
+    def _dir(self, artifact_id):
+        return os.path.join(self.root, artifact_id)
+
+    def publish(self, temp_dir, file_list, archive_name, always_archive=False, retention=None):
+        """Move a single file, or zip several files, into the store. Returns the artifact metadata
+
+        retention overrides the store's retention window for this artifact.
+        """
+        artifact_id = secrets.token_urlsafe(16)
+        artifact_dir = self._dir(artifact_id)
+        os.makedirs(artifact_dir)
+        try:
+            if len(file_list) == 1 and not always_archive:
+                filename = os.path.basename(file_list[0])
+                path = os.path.join(artifact_dir, self.CONTENT_NAME)
+                shutil.move(file_list[0], path)
+                mimetype = 'application/octet-stream'
+            else:
+                filename = archive_name
+                path = os.path.join(artifact_dir, self.CONTENT_NAME)
+                entries = [(f, os.path.relpath(f, temp_dir)) for f in file_list]
+                with open(path, 'wb') as archive:
+                    for chunk in iter_zip(entries):
+                        archive.write(chunk)
+                mimetype = 'application/zip'
+            now = time.time()
+            meta = {
+                'id': artifact_id,
+                'filename': filename,
+                'mimetype': mimetype,
+                'size': os.path.getsize(path),
+                'created_at': now,
+                'expires_at': now + (self.retention if retention is None else retention),
+            }
+            with open(os.path.join(artifact_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+        except Exception:
+            shutil.rmtree(artifact_dir, ignore_errors=True)
+            raise
+        return dict(meta, path=path)
+
+    def get(self, artifact_id):
+        """Metadata plus on-disk path for a live artifact, or None"""
+        if not artifact_id or not self.ARTIFACT_ID_REGEX.match(artifact_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(artifact_id), 'meta.json')) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta['expires_at'] < time.time():
+            return None
+        meta['path'] = os.path.join(self._dir(artifact_id), self.CONTENT_NAME)
+        return meta if os.path.exists(meta['path']) else None
+
+    def sign(self, artifact_id):
+        return self._serializer.dumps(artifact_id)
+
+    def resolve(self, token):
+        """Artifact for a signed token, or None if the token is forged or expired"""
+        try:
+            artifact_id = self._serializer.loads(token, max_age=self.retention)
+        except BadSignature:
+            return None
+        return self.get(artifact_id)
+
+    def reap_expired(self):
+        """Delete artifacts past their retention window; run by the janitor, off the request path"""
+        now = time.time()
+        for artifact_id in os.listdir(self.root):
+            artifact_dir = self._dir(artifact_id)
+            try:
+                with open(os.path.join(artifact_dir, 'meta.json')) as f:
+                    expires_at = json.load(f)['expires_at']
+            except (OSError, ValueError, KeyError):
+                # Half-written artifact: only reap it once it is clearly abandoned
+                try:
+                    expires_at = os.path.getmtime(artifact_dir) + self.retention
+                except OSError:
+                    continue
+            if expires_at < now:
+                shutil.rmtree(artifact_dir, ignore_errors=True)
@@ -0,0 +1,158 @@
+"""Audio downloads: keep or remux the source audio when its codec allows, transcode on a bounded pool otherwise"""
+import os
+import re
+import subprocess
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from metrics import AUDIO_OUTPUTS, TRANSCODES_WAITING
+
+try:
+    import fcntl
+except ImportError:  # Windows: the pool only bounds transcodes within a process
+    fcntl = None
+    import threading
+
+AudioFormat = namedtuple('AudioFormat', 'selector codecs ext keep_exts encoder')
+
+# format_type -> how to get there. The selector prefers a source whose codec can be copied,
+# `codecs` are the source codecs that need no transcode, and files already in one of
+# `keep_exts` (audio only) are delivered untouched.
+AUDIO_FORMATS = {
+    'mp3': AudioFormat('bestaudio[acodec=mp3]/bestaudio/best', {'mp3'}, 'mp3', {'mp3'},
+                       ['-c:a', 'libmp3lame', '-b:a', '192k']),
+    'm4a': AudioFormat('bestaudio[ext=m4a]/bestaudio[acodec^=mp4a]/bestaudio/best', {'aac', 'alac'}, 'm4a', {'m4a'},
+                       ['-c:a', 'aac', '-b:a', '192k']),
+    'opus': AudioFormat('bestaudio[acodec=opus]/bestaudio/best', {'opus'}, 'opus', {'opus', 'webm', 'ogg'},
+                        ['-c:a', 'libopus', '-b:a', '160k']),
+}
+
+STREAM_REGEX = re.compile(r'Stream #\d+:\d+.*?: (Audio|Video): (\w+)(.*)')
+
+
+def probe(ffmpeg, path):
+    """(audio codec or None, has a video stream) from `ffmpeg -i`, which works without ffprobe"""
+    result = subprocess.run([ffmpeg, '-hide_banner', '-i', path], capture_output=True, text=True, errors='replace')
+    audio_codec, has_video = None, False
+    for kind, codec, rest in STREAM_REGEX.findall(result.stderr):
+        if kind == 'Audio' and audio_codec is None:
+            audio_codec = codec
+        elif kind == 'Video' and 'attached pic' not in rest:
+            has_video = True
+    return audio_codec, has_video
+
+
+def can_stream(format_type, info):
+    """Whether the selected upstream format can be sent as-is for an audio format_type"""
+    audio_format = AUDIO_FORMATS[format_type]
+    acodec = (info.get('acodec') or '').split('.')[0]
+    if acodec == 'mp4a':
+        acodec = 'aac'
+    if info.get('vcodec') != 'none' or info.get('ext') not in audio_format.keep_exts:
+        return False
+    # Direct links carry no codec, but the target's own extension is unambiguous
+    return acodec in audio_format.codecs or (not acodec and info['ext'] == audio_format.ext)
+
+
+class TranscodePool:
+    """Host-wide cap on concurrent ffmpeg transcodes.
+
+    Each slot is a lock file under `root`, shared by every gunicorn worker,
+    so at most `size` encoders (one core each) run at once; further
+    transcodes queue for a free slot instead of oversubscribing the CPU.
+    """
+
+    def __init__(self, root, size=None, poll=0.1):
+        self.root = root
+        self.size = size or os.cpu_count() or 1
+        self.poll = poll
+        os.makedirs(self.root, exist_ok=True)
+        if fcntl is None:
+            self._semaphore = threading.BoundedSemaphore(self.size)
+
+    def _try_acquire(self):
+        for index in range(self.size):
+            fd = os.open(os.path.join(self.root, f'slot-{index}.lock'), os.O_CREAT | os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except OSError:
+                os.close(fd)
+        return None
+
+    @contextmanager
+    def slot(self):
+        """Hold a transcode slot, waiting in line for one if all are busy"""
+        if fcntl is None:
+            with self._semaphore:
+                yield
+            return
+        fd = self._try_acquire()
+        if fd is None:
+            TRANSCODES_WAITING.inc()
+            try:
+                while fd is None:
+                    time.sleep(self.poll)
+                    fd = self._try_acquire()
+            finally:
+                TRANSCODES_WAITING.dec()
+        try:
+            yield
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def run(self, cmd):
+        """Run an ffmpeg command in a slot; returns the seconds spent waiting for it"""
+        start = time.perf_counter()
+        with self.slot():
+            waited = time.perf_counter() - start
+            subprocess.run(cmd, check=True, capture_output=True)
+        return waited
+
+
+class AudioExtractor:
+    """Turns downloaded media into the requested audio format with as little encoding as possible.
+
+    A file that is already audio-only in an accepted container is kept; a
+    compatible codec in another container (or next to video) is remuxed
+    with stream copy, which is IO-bound and runs immediately; anything else
+    is a real transcode and goes through the TranscodePool.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def convert(self, ffmpeg, path, format_type, add_stage=None):
+        """Convert one file in place; returns the new path (or path when kept)"""
+        audio_format = AUDIO_FORMATS[format_type]
+        codec, has_video = probe(ffmpeg, path)
+        if codec is None:
+            # Not media (e.g. a thumbnail yt-dlp wrote next to it)
+            return path
+        base, ext = os.path.splitext(path)
+        if codec in audio_format.codecs and not has_video and ext[1:].lower() in audio_format.keep_exts:
+            AUDIO_OUTPUTS.labels(format_type, 'kept').inc()
+            return path
+        out_path = f'{base}.{audio_format.ext}'
+        temp_path = f'{base}.temp.{audio_format.ext}'
+        start = time.perf_counter()
+        if codec in audio_format.codecs:
+            mode = 'remux'
+            subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', path, '-vn', '-c:a', 'copy', temp_path],
+                           check=True, capture_output=True)
+        else:
+            mode = 'transcode'
+            waited = self.pool.run([ffmpeg, '-y', '-loglevel', 'error', '-i', path, '-vn', '-threads', '1',
+                                    *audio_format.encoder, temp_path])
+            if add_stage:
+                add_stage('transcode_wait', waited)
+            start += waited
+        if add_stage:
+            add_stage(mode, time.perf_counter() - start)
+        AUDIO_OUTPUTS.labels(format_type, mode).inc()
+        os.replace(temp_path, out_path)
+        if out_path != path:
+            os.remove(path)
+        return out_path
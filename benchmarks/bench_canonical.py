@@ -0,0 +1,109 @@
+"""Microbenchmark: platform detection and canonical keys over a large list of links.
+
+Generates a mix of real-world link shapes (youtu.be, watch?v=, shorts,
+TikTok/Instagram posts with tracking parameters, short links, lookalike
+hosts) with a share of duplicates, then reports URLs per second for the
+host index vs the old substring detection and for canonical_key vs
+canonical_url, and how many downloads each key saves in a batch.
+
+    python benchmarks/bench_canonical.py --urls 200000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from canonical import canonical_key, canonical_url, platform_for  # noqa: E402
+
+
+def substring_platform(url):
+    """detect_platform as it was before the host index"""
+    url = url.lower()
+    for platform, needles in (('youtube', ('youtube.com', 'youtu.be')), ('instagram', ('instagram.com',)),
+                              ('facebook', ('facebook.com', 'fb.watch')), ('twitter', ('twitter.com', 'x.com')),
+                              ('tiktok', ('tiktok.com',)), ('pinterest', ('pinterest.com',)),
+                              ('linkedin', ('linkedin.com',)), ('snapchat', ('snapchat.com',)),
+                              ('reddit', ('reddit.com',)), ('twitch', ('twitch.tv',))):
+        if any(needle in url for needle in needles):
+            return platform
+    return 'unknown'
+
+
+def make_urls(count, duplicate_share, seed=1):
+    rng = random.Random(seed)
+
+    def token(length, alphabet=string.ascii_letters + string.digits + '_-'):
+        return ''.join(rng.choice(alphabet) for _ in range(length))
+
+    def tracking():
+        return rng.choice(['', f'?si={token(16)}', f'?utm_source=share&utm_medium={token(6)}', f'?igsh={token(12)}'])
+
+    def number(v):
+        return int.from_bytes(v.encode(), 'big') % 10 ** 19
+
+    # Every link shape a family's content is shared as
+    families = [
+        [lambda v: f'https://youtu.be/{v}{tracking()}',
+         lambda v: f'https://www.youtube.com/watch?v={v}&feature=share',
+         lambda v: f'https://m.youtube.com/shorts/{v}{tracking()}',
+         lambda v: f'https://music.youtube.com/watch?v={v}'],
+        [lambda v: f'https://www.tiktok.com/@{token(8)}/video/{number(v)}{tracking()}',
+         lambda v: f'https://m.tiktok.com/@user/video/{number(v)}?is_from_webapp=1&sender_device=pc'],
+        [lambda v: f'https://www.instagram.com/reel/{v}/{tracking()}',
+         lambda v: f'https://instagram.com/p/{v}'],
+        [lambda v: f'https://x.com/{token(8)}/status/{number(v)}',
+         lambda v: f'https://twitter.com/i/status/{number(v)}?s=20'],
+        [lambda v: f'https://www.reddit.com/r/videos/comments/{v[:6].lower()}/{token(12)}/',
+         lambda v: f'https://redd.it/{v[:6].lower()}'],
+        [lambda v: f'https://vm.tiktok.com/{v[:9]}/'],
+        [lambda v: f'https://www.netflix.com/title/{number(v) % 10 ** 8}'],
+        [lambda v: f'https://cdn.example.org/media/{v}.mp4{tracking()}'],
+    ]
+    contents = []
+    urls = []
+    for _ in range(count):
+        if contents and rng.random() < duplicate_share:
+            # Same content, usually through another shape of link
+            family, v = contents[rng.randrange(len(contents))]
+        else:
+            family, v = rng.choice(families), token(11)
+            contents.append((family, v))
+        urls.append(rng.choice(family)(v))
+    return urls
+
+
+def throughput(label, fn, urls):
+    start = time.perf_counter()
+    for url in urls:
+        fn(url)
+    seconds = time.perf_counter() - start
+    print(f'{label:<20} {len(urls) / seconds:>12,.0f} URLs/s   {seconds * 1e6 / len(urls):6.2f} us/URL')
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--urls', type=int, default=200000, help='links in the generated list')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='share of links that repeat earlier content')
+    args = parser.parse_args()
+
+    urls = make_urls(args.urls, args.duplicates)
+    print(f'{len(urls):,} links, {args.duplicates:.0%} repeated')
+    throughput('substring detect', substring_platform, urls)
+    throughput('host index detect', platform_for, urls)
+    throughput('canonical_url', canonical_url, urls)
+    throughput('canonical_key', canonical_key, urls)
+
+    misrouted = sum(substring_platform(url) != platform_for(url) for url in urls)
+    by_url = len({canonical_url(url) for url in urls})
+    by_key = len({canonical_key(url) for url in urls})
+    print(f'links routed differently by the host index: {misrouted:,}')
+    print(f'downloads per batch: {len(urls):,} as given, {by_url:,} by canonical_url, {by_key:,} by canonical_key')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Microbenchmark: per-request latency with a fresh YoutubeDL vs a pooled engine.
+
+Serves a small synthetic clip from a local HTTP server (no network needed)
+and downloads it repeatedly through yt-dlp's generic extractor.
+
+    python benchmarks/bench_engines.py --requests 50
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp  # noqa: E402
+
+from engines import EnginePool  # noqa: E402
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The generic extractor drops the connection after sniffing the headers
+        pass
+
+
+def serve(directory):
+    server = QuietServer(('127.0.0.1', 0), partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(label, download, count):
+    timings = []
+    for _ in range(count):
+        path = tempfile.mkdtemp(prefix='bakraload_bench_')
+        start = time.perf_counter()
+        download(path)
+        timings.append((time.perf_counter() - start) * 1000)
+        shutil.rmtree(path, ignore_errors=True)
+    timings.sort()
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+    print(f'{label:<8} mean {statistics.mean(timings):8.2f} ms   p50 {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms')
+    return statistics.mean(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=30, help='downloads per variant')
+    parser.add_argument('--size', type=int, default=256 * 1024, help='bytes in the synthetic clip')
+    args = parser.parse_args()
+
+    fixtures = tempfile.mkdtemp(prefix='bakraload_bench_fixtures_')
+    with open(os.path.join(fixtures, 'clip.mp4'), 'wb') as f:
+        f.write(os.urandom(args.size))
+    server = serve(fixtures)
+    url = f'http://127.0.0.1:{server.server_address[1]}/clip.mp4'
+    ydl_opts = {'outtmpl': '%(extractor)s_%(title)s.%(ext)s', 'format': 'best', 'quiet': True, 'no_warnings': True, 'noprogress': True}
+
+    def fresh(path):
+        with yt_dlp.YoutubeDL(dict(ydl_opts, paths={'home': path})) as ydl:
+            ydl.extract_info(url, download=True)
+
+    pool = EnginePool()
+
+    def pooled(path):
+        with pool.engine(ydl_opts, path) as ydl:
+            ydl.extract_info(url, download=True)
+
+    try:
+        pooled(tempfile.mkdtemp(prefix='bakraload_bench_'))  # warm the pool once
+        print(f'{args.requests} downloads of a {args.size // 1024} KiB clip per variant')
+        fresh_mean = run('fresh', fresh, args.requests)
+        pooled_mean = run('pooled', pooled, args.requests)
+        print(f'pooled engines save {fresh_mean - pooled_mean:.2f} ms per request ({fresh_mean / pooled_mean:.2f}x)')
+    finally:
+        pool.close()
+        server.shutdown()
+        shutil.rmtree(fixtures, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
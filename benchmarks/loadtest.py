@@ -0,0 +1,392 @@
+"""Offline load test: the app under gunicorn against a local media stand-in.
+
+Generates real fixtures with the bundled ffmpeg (an mp4 clip, an HLS
+rendition of it, a JPEG and an HTML page embedding several clips), serves
+them from a local HTTP server that also acts as a forward proxy for the
+made-up host media.bench.test, and boots gunicorn with http_proxy pointing
+at it. The app is unmodified: direct media links and yt-dlp's generic
+extractor fetch the fixtures through the proxy, so nothing leaves the
+machine. The stand-in honours Range requests, and DIRECT_CHUNK_SIZE is
+lowered so the clip is fetched in several parallel chunks.
+
+Each flow is driven at the given concurrency, reporting throughput,
+p50/p95/p99 latency, time to first byte, peak RSS of the gunicorn process
+tree and peak temp disk usage:
+
+    python benchmarks/loadtest.py --requests 40 --concurrency 4
+    python benchmarks/loadtest.py --flows single,multi --save baseline.json
+    python benchmarks/loadtest.py --compare baseline.json --tolerance 0.25   # exits 1 on regression
+
+Every request gets a unique query string so result/metadata caches don't
+turn the run into a cache benchmark (pass --cache to measure with them).
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEDIA_HOST = 'media.bench.test'
+
+# name -> (endpoint, body for request number n)
+FLOWS = {
+    'single': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/clip.mp4?n={n}'}),
+    'ranged': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/clip.mp4?n={n}', 'delivery': 'link'}),
+    'hls': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/hls/index.m3u8?n={n}'}),
+    'multi': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/gallery.html?n={n}'}),
+    'audio': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/clip.mp4?n={n}', 'format': 'mp3'}),
+    'remux': ('/download', lambda n: {'url': f'http://{MEDIA_HOST}/clip.mp4?n={n}', 'format': 'm4a'}),
+    'bulk': ('/bulk-download', lambda n: {'urls': [f'http://{MEDIA_HOST}/clip.mp4?n={n}&item={i}' for i in range(4)]}),
+}
+# yt-dlp's HLS fixup probes the result, and imageio-ffmpeg ships no ffprobe
+NEEDS_FFPROBE = {'hls'}
+GALLERY_CLIPS = 3
+# Small enough that the clip takes several ranged requests
+DIRECT_CHUNK_SIZE = 128 * 1024
+RANGE_REGEX = re.compile(r'bytes=(\d+)-(\d*)$')
+
+
+class MediaHandler(SimpleHTTPRequestHandler):
+    """Serves the fixtures, both directly and as a forward proxy for MEDIA_HOST"""
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{
+        '.m3u8': 'application/vnd.apple.mpegurl',
+        '.ts': 'video/mp2t',
+        '.mp4': 'video/mp4',
+    })
+
+    def _strip_proxy_url(self):
+        if self.path.startswith('http://'):
+            parts = urlsplit(self.path)
+            self.path = parts.path + (f'?{parts.query}' if parts.query else '')
+
+    def do_GET(self):
+        self._strip_proxy_url()
+        match = RANGE_REGEX.match(self.headers.get('Range', ''))
+        path = self.translate_path(self.path)
+        if match and os.path.isfile(path):
+            self._send_range(path, int(match.group(1)), match.group(2))
+        else:
+            super().do_GET()
+
+    def _send_range(self, path, start, end):
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_error(416)
+            return
+        end = min(int(end), size - 1) if end else size - 1
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+    def do_HEAD(self):
+        self._strip_proxy_url()
+        super().do_HEAD()
+
+    def log_message(self, *args):
+        pass
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The generic extractor drops the connection after sniffing the headers
+        pass
+
+
+def make_fixtures(directory, seconds):
+    """Real, decodable media so ffmpeg post-processing does real work"""
+    import imageio_ffmpeg
+    ffmpeg = imageio_ffmpeg.get_ffmpeg_exe()
+
+    def run(*args):
+        subprocess.run([ffmpeg, '-v', 'error', '-y', *args], check=True, cwd=directory)
+
+    run('-f', 'lavfi', '-i', f'testsrc=duration={seconds}:size=640x360:rate=25',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '25', '-c:a', 'aac', '-shortest', 'clip.mp4')
+    os.makedirs(os.path.join(directory, 'hls'))
+    run('-i', 'clip.mp4', '-c', 'copy', '-f', 'hls', '-hls_time', '1', '-hls_playlist_type', 'vod', 'hls/index.m3u8')
+    run('-i', 'clip.mp4', '-frames:v', '1', 'thumb.jpg')
+    videos = []
+    for i in range(1, GALLERY_CLIPS + 1):
+        shutil.copy(os.path.join(directory, 'clip.mp4'), os.path.join(directory, f'clip{i}.mp4'))
+        videos.append(f'<video poster="thumb.jpg" src="clip{i}.mp4"></video>')
+    with open(os.path.join(directory, 'gallery.html'), 'w') as f:
+        f.write(f'<html><head><title>Gallery</title></head><body>{"".join(videos)}</body></html>')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    pids = [pid]
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.extend(process_tree(int(entry)))
+    return pids
+
+
+def rss_bytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+
+def disk_bytes(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+class Monitor:
+    """Samples RSS of the gunicorn tree and disk usage of its temp dir in the background"""
+
+    def __init__(self, pid, temp_dir, interval=0.05):
+        self.pid = pid
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        pids = process_tree(self.pid)
+        last_scan = time.monotonic()
+        while not self._stop.wait(self.interval):
+            if time.monotonic() - last_scan > 1:
+                pids, last_scan = process_tree(self.pid), time.monotonic()
+            self.peak_rss = max(self.peak_rss, rss_bytes(pids))
+            self.peak_disk = max(self.peak_disk, disk_bytes(self.temp_dir))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def boot(port, proxy_port, work_dir, workers, cache):
+    temp_dir = os.path.join(work_dir, 'tmp')
+    os.makedirs(temp_dir)
+    env = dict(
+        os.environ,
+        http_proxy=f'http://127.0.0.1:{proxy_port}',
+        HTTP_PROXY=f'http://127.0.0.1:{proxy_port}',
+        no_proxy='', NO_PROXY='',
+        TMPDIR=temp_dir,
+        DATA_DIR=os.path.join(work_dir, 'data'),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(work_dir, 'metrics'),
+        RATE_LIMIT_ENABLED='False',
+        DIRECT_CHUNK_SIZE=str(DIRECT_CHUNK_SIZE),
+        RESULT_CACHE_ENABLED=str(cache),
+        INFO_CACHE_TTL='300' if cache else '0',
+    )
+    cmd = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+           '--workers', str(workers), '--timeout', '300', 'wsgi:app']
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while True:
+        if proc.poll() is not None or time.monotonic() > deadline:
+            raise RuntimeError('gunicorn did not start')
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/supported-platforms')
+            conn.getresponse().read()
+            conn.close()
+            return proc, temp_dir
+        except OSError:
+            time.sleep(0.1)
+
+
+def one_request(port, endpoint, body):
+    """POST and read the whole response; returns (ok, latency, ttfb, bytes)"""
+    start = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    try:
+        conn.request('POST', endpoint, body=json.dumps(body), headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        first = response.read(1)
+        ttfb = time.perf_counter() - start
+        size = len(first)
+        while True:
+            chunk = response.read(256 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        return response.status == 200, time.perf_counter() - start, ttfb, size
+    except OSError:
+        return False, time.perf_counter() - start, None, 0
+    finally:
+        conn.close()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def run_flow(name, port, gunicorn_pid, temp_dir, requests, concurrency, offset):
+    endpoint, make_body = FLOWS[name]
+    with Monitor(gunicorn_pid, temp_dir) as monitor, ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda n: one_request(port, endpoint, make_body(offset + n)), range(requests)))
+        wall = time.perf_counter() - start
+    ok = [r for r in results if r[0]]
+    latencies = [r[1] for r in ok]
+    ttfbs = [r[2] for r in ok]
+    return {
+        'flow': name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': len(results) - len(ok),
+        'throughput_rps': len(ok) / wall if wall else 0,
+        'throughput_mbps': sum(r[3] for r in ok) / wall / 1e6 if wall else 0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'ttfb_p50': percentile(ttfbs, 50),
+        'ttfb_p95': percentile(ttfbs, 95),
+        'peak_rss_mb': monitor.peak_rss / 1e6,
+        'peak_temp_mb': monitor.peak_disk / 1e6,
+    }
+
+
+def fmt(seconds):
+    return f'{seconds * 1000:8.0f}' if seconds is not None else '       -'
+
+
+def report(results):
+    print(f'{"flow":<8}{"ok/err":>9}{"req/s":>8}{"MB/s":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+          f'{"ttfb50":>9}{"ttfb95":>9}{"RSS MB":>9}{"tmp MB":>9}')
+    for r in results:
+        print(f'{r["flow"]:<8}{r["requests"] - r["errors"]:>5}/{r["errors"]:<3}{r["throughput_rps"]:8.2f}'
+              f'{r["throughput_mbps"]:8.2f}{fmt(r["p50"])} {fmt(r["p95"])} {fmt(r["p99"])} '
+              f'{fmt(r["ttfb_p50"])} {fmt(r["ttfb_p95"])}{r["peak_rss_mb"]:9.0f}{r["peak_temp_mb"]:9.1f}')
+
+
+def regressions(results, baseline, tolerance):
+    """Flows whose p95 latency or throughput got worse than the baseline by more than tolerance"""
+    previous = {r['flow']: r for r in baseline}
+    problems = []
+    for r in results:
+        base = previous.get(r['flow'])
+        if base is None:
+            continue
+        if r['errors'] > base['errors']:
+            problems.append(f'{r["flow"]}: {r["errors"]} errors (baseline {base["errors"]})')
+        if base['p95'] and r['p95'] and r['p95'] > base['p95'] * (1 + tolerance):
+            problems.append(f'{r["flow"]}: p95 {r["p95"] * 1000:.0f} ms (baseline {base["p95"] * 1000:.0f} ms)')
+        if base['throughput_rps'] and r['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            problems.append(f'{r["flow"]}: {r["throughput_rps"]:.2f} req/s (baseline {base["throughput_rps"]:.2f})')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--flows', default='single,hls,multi,audio,remux,bulk',
+                        help=f'comma-separated: {",".join(FLOWS)}')
+    parser.add_argument('--requests', type=int, default=20, help='requests per flow')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--seconds', type=int, default=10, help='length of the fixture clip')
+    parser.add_argument('--cache', action='store_true', help='keep the result and metadata caches on')
+    parser.add_argument('--save', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON from --save; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args()
+    flows = [name for name in args.flows.split(',') if name]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f'unknown flows: {", ".join(sorted(unknown))}')
+    if not shutil.which('ffprobe'):
+        skipped = [name for name in flows if name in NEEDS_FFPROBE]
+        if skipped:
+            print(f'ffprobe not found, skipping: {", ".join(skipped)}')
+            flows = [name for name in flows if name not in NEEDS_FFPROBE]
+
+    work_dir = tempfile.mkdtemp(prefix='bakraload-loadtest-')
+    fixtures = os.path.join(work_dir, 'fixtures')
+    os.makedirs(fixtures)
+    make_fixtures(fixtures, args.seconds)
+    server = QuietServer(('127.0.0.1', 0), partial(MediaHandler, directory=fixtures))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = free_port()
+    proc = None
+    try:
+        proc, temp_dir = boot(port, server.server_address[1], work_dir, args.workers, args.cache)
+        # One untimed request per flow warms engines and imports in every code path
+        for name in flows:
+            one_request(port, FLOWS[name][0], FLOWS[name][1](-1))
+        print(f'{args.requests} requests per flow, concurrency {args.concurrency}, {args.workers} workers, '
+              f'{os.path.getsize(os.path.join(fixtures, "clip.mp4")) / 1e6:.1f} MB clip')
+        results = []
+        for index, name in enumerate(flows):
+            results.append(run_flow(name, port, proc.pid, temp_dir, args.requests, args.concurrency,
+                                    offset=index * args.requests))
+        report(results)
+    finally:
+        if proc is not None:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=30)
+        server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            problems = regressions(results, json.load(f), args.tolerance)
+        for problem in problems:
+            print(f'REGRESSION {problem}')
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Worker startup time and memory: lazy imports vs preload + warm-up.
+
+Measures how long `import app` takes in a fresh interpreter, then boots
+gunicorn with and without --preload and reports time to the first served
+request plus RSS/PSS per worker (PSS counts shared pages fractionally, so
+copy-on-write sharing shows up there). Linux only (/proc).
+
+    python benchmarks/startup.py --workers 4
+"""
+import argparse
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = '''
+import time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+if {warm}:
+    app.warm_up()
+print(imported - start, time.perf_counter() - start)
+'''
+
+
+def time_imports(runs, warm):
+    imports, totals = [], []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, '-c', IMPORT_SNIPPET.format(warm=warm)], cwd=ROOT,
+                                      stderr=subprocess.DEVNULL)
+        imported, total = map(float, out.split())
+        imports.append(imported * 1000)
+        totals.append(total * 1000)
+    return statistics.median(imports), statistics.median(totals)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == pid:
+            pids.append(int(entry))
+    return pids
+
+
+def memory_kb(pid):
+    usage = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                usage[key] = int(value.split()[0])
+    return usage
+
+
+def boot(workers, preload, timeout=60):
+    port = free_port()
+    env = dict(os.environ, GUNICORN_PRELOAD=str(preload), WARM_UP=str(preload))
+    cmd = [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+           '--workers', str(workers), 'wsgi:app']
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError('gunicorn did not become ready')
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/supported-platforms', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+        # Let every worker finish booting before sampling memory
+        time.sleep(2)
+        usage = [memory_kb(pid) for pid in children(proc.pid)]
+        return ready, usage
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters for the import timing')
+    args = parser.parse_args()
+
+    lazy_import, _ = time_imports(args.runs, warm=False)
+    _, warm_total = time_imports(args.runs, warm=True)
+    print(f'import app (lazy)            {lazy_import:8.1f} ms')
+    print(f'import app + warm_up()       {warm_total:8.1f} ms')
+    print()
+    print(f'{"mode":<22}{"first request":>14}{"RSS/worker":>14}{"PSS/worker":>14}')
+    for preload in (False, True):
+        ready, usage = boot(args.workers, preload)
+        rss = statistics.mean(u['Rss'] for u in usage) / 1024 if usage else 0
+        pss = statistics.mean(u['Pss'] for u in usage) / 1024 if usage else 0
+        mode = 'preload + warm-up' if preload else 'lazy, no preload'
+        print(f'{mode:<22}{ready * 1000:11.0f} ms{rss:11.1f} MB{pss:11.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Concurrent execution of bulk download batches"""
+import os
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from admission import Overloaded
+from canonical import canonical_key
+
+
+class BulkDownloader:
+    """Runs batch items on a shared thread pool, capped globally and per platform"""
+
+    def __init__(self, downloader, max_workers=4, per_platform=2):
+        self.downloader = downloader
+        self.max_workers = max_workers
+        self.per_platform = per_platform
+        self._executor = None
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._active = defaultdict(int)
+
+    def _get_executor(self):
+        # Threads are started lazily so a preloaded app forks cleanly
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bakraload-bulk')
+            return self._executor
+
+    def _claim_slot(self, pending, platforms):
+        """Block until some pending item's platform is under its cap, and claim it"""
+        with self._cond:
+            while True:
+                for idx in pending:
+                    if self._active[platforms[idx]] < self.per_platform:
+                        self._active[platforms[idx]] += 1
+                        return idx
+                self._cond.wait()
+
+    def _release_slot(self, platform):
+        with self._cond:
+            self._active[platform] -= 1
+            self._cond.notify_all()
+
+    def _download_item(self, indices, url, format_type, temp_dir, platform, quality=None):
+        """Download url once into item_N of its first index and link the files into the other items'"""
+        message = 'An error occurred while processing your request.'
+        try:
+            first = indices[0]
+            sub_dir = os.path.join(temp_dir, f'item_{first+1}')
+            os.makedirs(sub_dir, exist_ok=True)
+            d_temp, file_list, error, info = self.downloader.download_content(url, format_type, quality=quality)
+            if error:
+                message = error
+            else:
+                # Move files from d_temp to sub_dir
+                for f in file_list:
+                    dest = os.path.join(sub_dir, os.path.basename(f))
+                    shutil.move(f, dest)
+                shutil.rmtree(d_temp, ignore_errors=True)
+                files = [os.path.join(sub_dir, f) for f in os.listdir(sub_dir)]
+                results = [(first, files, None)]
+                for idx in indices[1:]:
+                    dup_dir = os.path.join(temp_dir, f'item_{idx+1}')
+                    os.makedirs(dup_dir, exist_ok=True)
+                    results.append((idx, [self._fan_out(f, dup_dir) for f in files], None))
+                return results
+        except Overloaded as e:
+            # Only this item's platform is paced or paused; the rest of the batch goes on
+            message = str(e)
+        except Exception:
+            pass
+        finally:
+            self._release_slot(platform)
+        return [(idx, [], f"URL {idx+1}: {message}") for idx in indices]
+
+    def _fan_out(self, path, directory):
+        """Hard-link a downloaded file into a duplicate item's directory (copy where links aren't possible)"""
+        dest = os.path.join(directory, os.path.basename(path))
+        try:
+            os.link(path, dest)
+        except OSError:
+            shutil.copy2(path, dest)
+        return dest
+
+    def _group(self, urls):
+        """Indices of urls that point at the same content (canonical_key), in input order"""
+        groups = {}
+        for idx, url in enumerate(urls):
+            try:
+                key = canonical_key(url) if isinstance(url, str) else None
+            except ValueError:
+                key = None
+            groups.setdefault(key if key is not None else ('item', idx), []).append(idx)
+        return {indices[0]: indices for indices in groups.values()}
+
+    def download_all(self, urls, format_type, temp_dir, quality=None):
+        """Download every URL into temp_dir/item_N. Returns (all_files, errors) in input order.
+
+        Links to the same content (youtu.be/X and watch?v=X, tracking
+        parameters, ...) are downloaded once and shared by their items.
+        quality is the batch's quality.Quality profile, applied to every item.
+        """
+        executor = self._get_executor()
+        platforms = [self.downloader.detect_platform(url) if isinstance(url, str) else 'unknown' for url in urls]
+        groups = self._group(urls)
+        pending = list(groups)
+        futures = []
+        while pending:
+            idx = self._claim_slot(pending, platforms)
+            pending.remove(idx)
+            futures.append(executor.submit(self._download_item, groups[idx], urls[idx], format_type, temp_dir,
+                                           platforms[idx], quality))
+        wait(futures)
+
+        results = sorted(result for future in futures for result in future.result())
+        all_files = [f for _, files, _ in results for f in files]
+        errors = [error for _, _, error in results if error]
+        return all_files, errors
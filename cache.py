@@ -0,0 +1,221 @@
+"""On-disk cache of finished downloads, keyed on canonical content key + format + quality profile"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from admission import make_temp_dir
+from canonical import canonical_key
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-flight is per process only
+    fcntl = None
+
+# Keys the download path adds to info for its own use (cache-hit metrics, tuning feedback)
+INTERNAL_INFO_KEYS = ('cached', 'tuning')
+
+
+def public_info(info):
+    """info without the download path's internal keys, fit to store or show to clients"""
+    if not isinstance(info, dict):
+        return info
+    return {key: value for key, value in info.items() if key not in INTERNAL_INFO_KEYS}
+
+class ResultCache:
+    """Content-addressed store of finished downloads with LRU/TTL eviction.
+
+    Concurrent requests for the same key are coalesced: one runs the
+    download, the others wait for it and are then served from disk.
+    """
+    # Results that change over time are never cached
+    UNCACHEABLE_TYPES = ('stories', 'profile')
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3, ttl=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries_dir = os.path.join(root, 'entries')
+        self.locks_dir = os.path.join(root, 'locks')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.locks_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def key_for(self, url, format_type, quality=None):
+        key = f'{canonical_key(url)}\n{format_type}'
+        if quality is not None:
+            key += f'\n{quality.key}'
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.entries_dir, key)
+
+    def _read_meta(self, key):
+        try:
+            with open(os.path.join(self._entry_dir(key), 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def contains(self, url, format_type, quality=None):
+        """Whether a live entry exists, without touching it"""
+        meta = self._read_meta(self.key_for(url, format_type, quality))
+        return meta is not None and time.time() - meta['created_at'] <= self.ttl
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = [threading.Lock(), 0]
+            lock[1] += 1
+            return lock
+
+    def _drop_key_lock(self, key, lock):
+        with self._lock:
+            lock[1] -= 1
+            if lock[1] == 0:
+                self._key_locks.pop(key, None)
+
+    def _lookup(self, key):
+        """Return (temp_dir, file_list, None, info) for a live entry, or None"""
+        meta = self._read_meta(key)
+        if meta is None:
+            return None
+        if time.time() - meta['created_at'] > self.ttl:
+            self._remove(key)
+            return None
+        entry_files = os.path.join(self._entry_dir(key), 'files')
+        temp_dir = make_temp_dir('cache')
+        file_list = []
+        try:
+            for rel in meta['files']:
+                dest = os.path.join(temp_dir, rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                link_or_copy(os.path.join(entry_files, rel), dest)
+                file_list.append(dest)
+        except OSError:
+            # Entry was evicted underneath us
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return None
+        # meta.json mtime doubles as the LRU access time
+        try:
+            os.utime(os.path.join(self._entry_dir(key), 'meta.json'))
+        except OSError:
+            pass
+        return temp_dir, file_list, None, dict(meta['info'] or {}, cached=True)
+
+    def _store(self, key, temp_dir, file_list, info):
+        if isinstance(info, dict) and info.get('type') in self.UNCACHEABLE_TYPES:
+            return
+        # A playlist with failed entries is served this once; the next request retries them
+        if isinstance(info, dict) and info.get('failed_entries'):
+            return
+        size = sum(os.path.getsize(f) for f in file_list)
+        if size > self.max_bytes:
+            return
+        staging = tempfile.mkdtemp(prefix=f'.{key}.', dir=self.entries_dir)
+        try:
+            rel_files = []
+            for f in file_list:
+                rel = os.path.relpath(f, temp_dir)
+                dest = os.path.join(staging, 'files', rel)
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                link_or_copy(f, dest)
+                rel_files.append(rel)
+            meta = {'created_at': time.time(), 'size': size, 'files': rel_files, 'info': public_info(info)}
+            with open(os.path.join(staging, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            self._remove(key)
+            os.rename(staging, self._entry_dir(key))
+        except (OSError, TypeError, ValueError):
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+        self.evict()
+
+    def _remove(self, key):
+        # Rename first so readers never see a half-deleted entry
+        entry = self._entry_dir(key)
+        trash = f'{entry}.{os.getpid()}.{threading.get_ident()}.trash'
+        try:
+            os.rename(entry, trash)
+        except OSError:
+            return
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def evict(self):
+        """Drop expired entries, then least recently used ones until under the byte budget"""
+        now = time.time()
+        live = []
+        for key in os.listdir(self.entries_dir):
+            if key.startswith('.'):
+                continue
+            meta = self._read_meta(key)
+            if meta is None:
+                continue
+            if now - meta['created_at'] > self.ttl:
+                self._remove(key)
+                continue
+            try:
+                last_access = os.path.getmtime(os.path.join(self._entry_dir(key), 'meta.json'))
+            except OSError:
+                continue
+            live.append((last_access, key, meta['size']))
+        total = sum(size for _, _, size in live)
+        for _, key, size in sorted(live):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= size
+
+    def fetch(self, url, format_type, download_fn, quality=None):
+        """Serve url from the cache, or run download_fn(url, format_type, quality) once and cache it"""
+        key = self.key_for(url, format_type, quality)
+        hit = self._lookup(key)
+        if hit:
+            return hit
+        lock = self._key_lock(key)
+        try:
+            with lock[0], FileLock(os.path.join(self.locks_dir, f'{key}.lock')):
+                # Another request may have finished the same download while we waited
+                hit = self._lookup(key)
+                if hit:
+                    return hit
+                result = download_fn(url, format_type, quality)
+                temp_dir, file_list, error, info = result
+                if not error:
+                    self._store(key, temp_dir, file_list, info)
+                return result
+        finally:
+            self._drop_key_lock(key, lock)
+
+
+class FileLock:
+    """Exclusive flock, so workers on the same host also coalesce"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR)
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def link_or_copy(src, dest):
+    """Hard link when possible so cached files cost no extra disk or IO"""
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
@@ -0,0 +1,189 @@
+"""Platform detection and canonical content keys, so equivalent links share downloads and cache entries"""
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that never change which media a URL points to, anywhere (utm_* is dropped too)
+TRACKING_PARAMS = {'fbclid', 'gclid'}
+
+# platform -> parameters that are tracking-only on that platform's links; elsewhere they may select content
+PLATFORM_TRACKING_PARAMS = {
+    'youtube': {'si', 'feature'},
+    'instagram': {'igshid', 'igsh'},
+    'tiktok': {'is_from_webapp', 'sender_device'},
+    'twitter': {'ref_src'},
+}
+
+# Host -> platform. Subdomains (m., vm., music., old., clips., ...) are looked up label by label,
+# so hosts that merely contain a platform's name (netflix.com, not x.com) stay unknown.
+PLATFORM_HOSTS = {
+    'youtube.com': 'youtube', 'youtu.be': 'youtube', 'youtube-nocookie.com': 'youtube',
+    'instagram.com': 'instagram', 'instagr.am': 'instagram',
+    'facebook.com': 'facebook', 'fb.com': 'facebook', 'fb.watch': 'facebook',
+    'twitter.com': 'twitter', 'x.com': 'twitter',
+    'tiktok.com': 'tiktok',
+    'pinterest.com': 'pinterest', 'pin.it': 'pinterest',
+    'linkedin.com': 'linkedin',
+    'snapchat.com': 'snapchat',
+    'reddit.com': 'reddit', 'redd.it': 'reddit',
+    'twitch.tv': 'twitch',
+}
+
+# Scheme, optional userinfo, then the host: much cheaper than urlsplit() when only the host is needed
+HOST_REGEX = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*://(?:[^@/?#]*@)?([^:/?#]*)')
+YOUTUBE_PATH_REGEX = re.compile(r'/(?:shorts|embed|live|v|e)/([\w-]{11})')
+YOUTU_BE_REGEX = re.compile(r'/([\w-]{11})')
+TIKTOK_REGEX = re.compile(r'/(?:video|photo)/(\d+)')
+INSTAGRAM_POST_REGEX = re.compile(r'^/(?:[\w.]+/)?(?:p|reels?|tv)/([\w-]+)')
+INSTAGRAM_STORIES_REGEX = re.compile(r'^/stories/([\w.]+)')
+INSTAGRAM_PROFILE_REGEX = re.compile(r'^/([\w.]+)/?$')
+INSTAGRAM_RESERVED = {'explore', 'accounts', 'direct', 'about', 'developer', 'legal'}
+TWITTER_REGEX = re.compile(r'/status(?:es)?/(\d+)')
+FACEBOOK_REGEX = re.compile(r'/(?:reel|videos)/(\d+)')
+REDDIT_REGEX = re.compile(r'/comments/(\w+)')
+REDD_IT_REGEX = re.compile(r'^/(\w+)/?$')
+TWITCH_VIDEO_REGEX = re.compile(r'^/videos/(\d+)')
+TWITCH_CLIP_REGEX = re.compile(r'^/\w+/clip/([\w-]+)')
+
+
+def _strip_host(host):
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def _platform_for_host(host):
+    while host:
+        platform = PLATFORM_HOSTS.get(host)
+        if platform:
+            return platform
+        host = host.partition('.')[2]
+    return 'unknown'
+
+
+def _host(url):
+    match = HOST_REGEX.match(url.strip())
+    return _strip_host(match.group(1).lower()) if match else ''
+
+
+def platform_for(url):
+    """Platform a URL belongs to, by host ('unknown' when it isn't one of the supported ones)"""
+    try:
+        return _platform_for_host(_host(url))
+    except AttributeError:
+        return 'unknown'
+
+
+def _query(parts):
+    return dict(parse_qsl(parts.query))
+
+
+def _youtube_id(host, parts):
+    query = _query(parts) if parts.query else {}
+    # Without noplaylist, a watch URL with a list downloads the whole playlist
+    if query.get('list'):
+        return f'playlist:{query["list"]}'
+    if host == 'youtu.be':
+        match = YOUTU_BE_REGEX.match(parts.path)
+    elif parts.path.rstrip('/') == '/watch':
+        return f'video:{query["v"]}' if query.get('v') else None
+    else:
+        match = YOUTUBE_PATH_REGEX.match(parts.path)
+    return f'video:{match.group(1)}' if match else None
+
+
+def _instagram_id(host, parts):
+    match = INSTAGRAM_POST_REGEX.match(parts.path)
+    if match:
+        return f'post:{match.group(1)}'
+    match = INSTAGRAM_STORIES_REGEX.match(parts.path)
+    if match:
+        return f'stories:{match.group(1).lower()}'
+    match = INSTAGRAM_PROFILE_REGEX.match(parts.path)
+    if match and match.group(1).lower() not in INSTAGRAM_RESERVED:
+        return f'profile:{match.group(1).lower()}'
+    return None
+
+
+def _facebook_id(host, parts):
+    match = FACEBOOK_REGEX.search(parts.path)
+    if match:
+        return f'video:{match.group(1)}'
+    if parts.path.rstrip('/') in ('/watch', '/video.php'):
+        video_id = _query(parts).get('v')
+        return f'video:{video_id}' if video_id else None
+    return None
+
+
+def _reddit_id(host, parts):
+    match = REDD_IT_REGEX.match(parts.path) if host == 'redd.it' else REDDIT_REGEX.search(parts.path)
+    return f'post:{match.group(1).lower()}' if match else None
+
+
+def _twitch_id(host, parts):
+    if host == 'clips.twitch.tv':
+        slug = parts.path.strip('/')
+        return f'clip:{slug}' if slug and '/' not in slug else None
+    match = TWITCH_VIDEO_REGEX.match(parts.path)
+    if match:
+        return f'video:{match.group(1)}'
+    match = TWITCH_CLIP_REGEX.match(parts.path)
+    return f'clip:{match.group(1)}' if match else None
+
+
+def _path_id(regex, kind):
+    def content_id(host, parts):
+        match = regex.search(parts.path)
+        return f'{kind}:{match.group(1)}' if match else None
+    return content_id
+
+
+# platform -> (host, urlsplit parts) -> 'kind:id' or None
+CONTENT_IDS = {
+    'youtube': _youtube_id,
+    'instagram': _instagram_id,
+    'tiktok': _path_id(TIKTOK_REGEX, 'post'),
+    'twitter': _path_id(TWITTER_REGEX, 'status'),
+    'facebook': _facebook_id,
+    'reddit': _reddit_id,
+    'twitch': _twitch_id,
+}
+
+
+def content_id(url):
+    """'platform:kind:id' for a supported platform's link, or None.
+
+    youtu.be/X, watch?v=X&si=... and shorts/X are all 'youtube:video:X'.
+    Short links and unknown hosts don't name their content and get None.
+    """
+    try:
+        host = _host(url)
+        platform = _platform_for_host(host)
+        extract = CONTENT_IDS.get(platform)
+        content = extract(host, urlsplit(url.strip())) if extract else None
+    except (AttributeError, ValueError):
+        return None
+    return f'{platform}:{content}' if content else None
+
+
+def canonical_url(url):
+    """Normalize a URL so trivially different links share a cache entry; one that can't be parsed is kept as is"""
+    try:
+        parts = urlsplit(url.strip())
+        host = _strip_host((parts.hostname or '').lower())
+        if parts.port:
+            host = f'{host}:{parts.port}'
+    except ValueError:
+        # Out-of-range port or malformed IPv6 host
+        return url.strip()
+    tracking = TRACKING_PARAMS | PLATFORM_TRACKING_PARAMS.get(_platform_for_host(host.partition(':')[0]), set())
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k.lower() not in tracking and not k.lower().startswith('utm_')]
+    query.sort()
+    path = parts.path.rstrip('/') or '/'
+    return urlunsplit(('https', host, path, urlencode(query), ''))
+
+
+def canonical_key(url):
+    """The content id where the platform has one, else the normalized URL"""
+    return content_id(url) or canonical_url(url)
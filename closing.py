@@ -0,0 +1,90 @@
+"""Hooks that run once the server is done with a response body, send_file responses included.
+
+Werkzeug hands direct_passthrough bodies (send_file) to the server as they
+are, so Response.call_on_close() never fires for them. CloseHooks wraps the
+WSGI app instead: other bodies are returned wrapped in one whose close() runs
+the request's hooks, and the server's wsgi.file_wrapper is swapped for a
+subclass that runs them itself, so gunicorn still sends files with sendfile().
+"""
+import functools
+
+from flask import request
+from werkzeug.wsgi import FileWrapper
+
+ENVIRON_KEY = 'bakraload.close_hooks'
+
+
+def call_on_close(callback):
+    """Run callback() once the server has closed the current request's response body"""
+    request.environ[ENVIRON_KEY].append(callback)
+
+
+def _run(hooks):
+    # A failing hook doesn't stop the ones after it; the first error is raised at the end
+    error = None
+    while hooks:
+        try:
+            hooks.pop(0)()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+
+@functools.lru_cache(maxsize=None)
+def _closing_file_wrapper(base):
+    class ClosingFileWrapper(base):
+        close_hooks = ()
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            # gunicorn's and wsgiref's wrappers set close to the file's own on the instance
+            self.close_file = vars(self).pop('close', None) or getattr(super(), 'close', None)
+
+        def close(self):
+            try:
+                if self.close_file is not None:
+                    self.close_file()
+            finally:
+                _run(self.close_hooks)
+    return ClosingFileWrapper
+
+
+class ClosingBody:
+    """A response body that runs the request's hooks after closing the one it wraps"""
+
+    def __init__(self, body, hooks):
+        self.body = body
+        self.hooks = hooks
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            _run(self.hooks)
+
+
+class CloseHooks:
+    """WSGI middleware that gives every request a list of close hooks (see call_on_close)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        hooks = environ[ENVIRON_KEY] = []
+        file_wrapper = _closing_file_wrapper(environ.get('wsgi.file_wrapper', FileWrapper))
+        environ['wsgi.file_wrapper'] = file_wrapper
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            _run(hooks)
+            raise
+        if isinstance(body, file_wrapper):
+            # Returned as is, so the server still recognizes it as its own file wrapper
+            body.close_hooks = hooks
+            return body
+        return ClosingBody(body, hooks)
@@ -0,0 +1,205 @@
+"""Direct media links (CDN files, i.redd.it images, ...) fetched without yt-dlp, in parallel Range chunks"""
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from urllib.parse import unquote, urlparse
+
+MB = 1024 * 1024
+BUFFER_SIZE = 256 * 1024
+
+MEDIA_EXTENSIONS = {
+    'mp4', 'm4v', 'mov', 'webm', 'mkv', 'avi', 'flv', 'ts',
+    'mp3', 'm4a', 'aac', 'opus', 'ogg', 'oga', 'wav', 'flac',
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'heic',
+}
+# Hosts that only serve media files, whatever their paths look like
+MEDIA_HOSTS = {'i.redd.it', 'i.imgur.com', 'pbs.twimg.com', 'video.twimg.com'}
+# Answers that are a page or a manifest rather than the media itself: left to yt-dlp
+NOT_MEDIA_TYPES = ('text/', 'application/json', 'application/xml', 'application/xhtml',
+                   'application/vnd.apple.mpegurl', 'application/x-mpegurl', 'application/dash+xml')
+
+CONTENT_RANGE_REGEX = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+
+def is_direct_media(url):
+    """Whether url points straight at a media file (by extension or host)"""
+    parsed = urlparse(url)
+    extension = os.path.splitext(unquote(parsed.path))[1][1:].lower()
+    return (parsed.hostname or '').lower() in MEDIA_HOSTS or extension in MEDIA_EXTENSIONS
+
+
+class DirectFetcher:
+    """Downloads direct media URLs over a shared, keep-alive requests.Session.
+
+    The first request only asks for the first chunk. When the server
+    answers 206, the total size is known: the file is preallocated and the
+    remaining chunks are fetched `connections` at a time, each written at
+    its own offset, which multiplies throughput on CDNs that throttle per
+    connection. A server without range support answers 200 and the file is
+    streamed in one piece from that same response.
+    """
+
+    def __init__(self, connections=4, chunk_size=8 * MB, timeout=30, retries=2):
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.retries = retries
+
+    def open(self, session, url, headers=None):
+        """GET url as a stream; None when the answer is not media (a web page, a manifest)"""
+        response = session.get(url, headers=dict(headers or {}, **{'Accept-Encoding': 'identity'}),
+                               stream=True, timeout=self.timeout)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        if self.content_type(response).startswith(NOT_MEDIA_TYPES):
+            response.close()
+            return None
+        return response
+
+    def content_type(self, response):
+        return response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+
+    def filename(self, response, url):
+        """From Content-Disposition, else the URL path; the extension comes from Content-Type if missing"""
+        message = Message()
+        message['Content-Disposition'] = response.headers.get('Content-Disposition', '')
+        name = message.get_filename() or unquote(urlparse(url).path)
+        base, extension = os.path.splitext(os.path.basename(name))
+        if not extension:
+            extension = mimetypes.guess_extension(self.content_type(response)) or ''
+        return (base.strip('. ') or 'media') + extension
+
+    def fetch(self, session, url, path, sanitize=None, progress_hook=None, max_size=None):
+        """Download url into directory path.
+
+        Returns (file path, size, mode) with mode 'ranged' or 'single', or
+        None when url turns out not to be media. progress_hook gets
+        yt-dlp-style progress dicts. A file larger than max_size bytes is
+        refused as soon as its size is known, or cut off once it passes it.
+        """
+        response = self.open(session, url, {'Range': f'bytes=0-{self.chunk_size - 1}'})
+        if response is None:
+            return None
+        name = self.filename(response, url)
+        dest = os.path.join(path, sanitize(name) if sanitize else name)
+        tracker = _Tracker(progress_hook, os.path.basename(dest))
+        with response:
+            match = CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+            if response.status_code != 206 or not match or int(match.group(1)) != 0:
+                length = response.headers.get('Content-Length')
+                tracker.total = int(length) if length and length.isdigit() else None
+                self._check_size(tracker.total, max_size)
+                with open(dest, 'wb') as f:
+                    size = self._copy(response, f, tracker, max_size)
+                tracker.finish()
+                return dest, size, 'single'
+            first_end, total = int(match.group(2)), int(match.group(3))
+            self._check_size(total, max_size)
+            tracker.total = total
+            with open(dest, 'wb') as f:
+                self._preallocate(f, total)
+                self._expect(self._copy(response, f, tracker), first_end + 1)
+        # Later chunks go to the final URL, skipping any redirect
+        url = response.url or url
+        ranges = [(start, min(start + self.chunk_size, total) - 1)
+                  for start in range(first_end + 1, total, self.chunk_size)]
+        if ranges:
+            self._fetch_ranges(session, url, dest, ranges, tracker)
+        tracker.finish()
+        return dest, total, 'ranged' if ranges else 'single'
+
+    def _fetch_ranges(self, session, url, dest, ranges, tracker):
+        failed = threading.Event()
+
+        def fetch_range(byte_range):
+            start, end = byte_range
+            for attempt in range(self.retries + 1):
+                if failed.is_set():
+                    return
+                written = 0
+                try:
+                    response = self.open(session, url, {'Range': f'bytes={start}-{end}'})
+                    if response is None:
+                        raise IOError(f'{url} stopped serving media')
+                    with response:
+                        match = CONTENT_RANGE_REGEX.match(response.headers.get('Content-Range', ''))
+                        if response.status_code != 206 or not match or int(match.group(1)) != start:
+                            raise IOError(f'{url} did not honour range {start}-{end}')
+                        with open(dest, 'r+b') as f:
+                            f.seek(start)
+                            for chunk in response.iter_content(BUFFER_SIZE):
+                                f.write(chunk)
+                                written += len(chunk)
+                                tracker.add(len(chunk))
+                    self._expect(written, end - start + 1)
+                    return
+                except Exception:
+                    # Bytes of a failed attempt are fetched again
+                    tracker.add(-written)
+                    if attempt == self.retries:
+                        failed.set()
+                        raise
+
+        with ThreadPoolExecutor(max_workers=min(self.connections, len(ranges)),
+                                thread_name_prefix='bakraload-range') as pool:
+            list(pool.map(fetch_range, ranges))
+
+    def _copy(self, response, f, tracker, max_size=None):
+        copied = 0
+        for chunk in response.iter_content(BUFFER_SIZE):
+            f.write(chunk)
+            copied += len(chunk)
+            tracker.add(len(chunk))
+            self._check_size(copied, max_size)
+        return copied
+
+    def _check_size(self, size, max_size):
+        if max_size and size and size > max_size:
+            raise IOError(f'File is larger than the size budget of {max_size // MB} MB')
+
+    def _expect(self, received, expected):
+        if received != expected:
+            raise IOError(f'Incomplete download: got {received} of {expected} bytes')
+
+    def _preallocate(self, f, size):
+        try:
+            os.posix_fallocate(f.fileno(), 0, size)
+        except (AttributeError, OSError):
+            # Not available on this platform or filesystem: a sparse file still takes writes at any offset
+            f.truncate(size)
+
+
+class _Tracker:
+    """Bytes received across all chunks of one download, reported as yt-dlp progress dicts"""
+
+    def __init__(self, hook, filename):
+        self.hook = hook
+        self.info = {'title': filename}
+        self.total = None
+        self.downloaded = 0
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.downloaded += count
+        if self.hook and count > 0:
+            self.hook(self._snapshot('downloading'))
+
+    def finish(self):
+        if self.hook:
+            self.hook(self._snapshot('finished'))
+
+    def _snapshot(self, status):
+        elapsed = time.monotonic() - self.started
+        speed = self.downloaded / elapsed if elapsed > 0 else None
+        eta = round((self.total - self.downloaded) / speed) if speed and self.total else None
+        return {'status': status, 'downloaded_bytes': self.downloaded, 'total_bytes': self.total,
+                'elapsed': elapsed, 'speed': speed, 'eta': eta, 'info_dict': self.info}
@@ -0,0 +1,93 @@
+"""Pool of long-lived yt-dlp engines, reused across requests"""
+import atexit
+import json
+import threading
+from contextlib import contextmanager
+
+
+class EnginePool:
+    """Keeps pre-configured YoutubeDL instances per option profile.
+
+    Building a YoutubeDL loads extractors, cookie jars and HTTP handlers; a
+    pooled engine keeps them (and its open connections) between requests.
+    An engine is checked out by one request at a time, and the per-request
+    download directory is applied through the 'paths' option, so profiles
+    never embed a request path.
+    """
+
+    def __init__(self, max_idle_per_profile=4):
+        self.max_idle_per_profile = max_idle_per_profile
+        self._idle = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @staticmethod
+    def profile_key(ydl_opts):
+        return json.dumps(ydl_opts, sort_keys=True, default=repr)
+
+    @staticmethod
+    def _build(ydl_opts):
+        # yt_dlp is imported on first use to keep worker startup fast
+        import yt_dlp
+        return yt_dlp.YoutubeDL(dict(ydl_opts))
+
+    def _take(self, key, ydl_opts):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return self._build(ydl_opts)
+
+    def _give_back(self, key, ydl):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_profile:
+                idle.append(ydl)
+                return
+        ydl.close()
+
+    @contextmanager
+    def engine(self, ydl_opts, path, params=None, progress_hooks=(), postprocessor_hooks=()):
+        """Check out an engine for ydl_opts that writes into path.
+
+        params are per-request overrides (e.g. download tuning) that don't
+        belong in the profile key; progress_hooks and postprocessor_hooks are
+        attached for this checkout only.
+        """
+        key = self.profile_key(ydl_opts)
+        ydl = self._take(key, ydl_opts)
+        ydl.params['paths'] = {'home': path}
+        ydl.params.update(params or {})
+        for hook in progress_hooks:
+            ydl.add_progress_hook(hook)
+        for hook in postprocessor_hooks:
+            ydl.add_postprocessor_hook(hook)
+        try:
+            yield ydl
+        except BaseException:
+            # Don't reuse an engine whose state is unknown
+            ydl.close()
+            raise
+        for hook in progress_hooks:
+            ydl._progress_hooks.remove(hook)
+        for hook in postprocessor_hooks:
+            ydl._postprocessor_hooks.remove(hook)
+            for pps in ydl._pps.values():
+                for pp in pps:
+                    if hook in pp._progress_hooks:
+                        pp._progress_hooks.remove(hook)
+        ydl.params['paths'] = {}
+        self._give_back(key, ydl)
+
+    def prewarm(self, ydl_opts, count=1):
+        """Build idle engines for a profile ahead of the first request"""
+        key = self.profile_key(ydl_opts)
+        for _ in range(count):
+            self._give_back(key, self._build(ydl_opts))
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for engines in idle.values():
+            for ydl in engines:
+                ydl.close()
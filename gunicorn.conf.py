@@ -0,0 +1,36 @@
+"""Gunicorn settings for Bakraload (bind/workers/timeouts are passed on the command line)"""
+import gc
+import os
+import shutil
+import tempfile
+
+# Load the app once in the master and fork workers from it
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True').lower() == 'true'
+
+# Per-worker metric files, merged by /metrics. Must be set before the app (and prometheus_client)
+# is imported; the directory is emptied once per master start so counters don't carry over.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'bakraload-metrics'))
+if not os.environ.get('BAKRALOAD_METRICS_DIR_READY'):
+    shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+    os.environ['BAKRALOAD_METRICS_DIR_READY'] = '1'
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Threaded workers, so long-lived progress streams (/jobs/<id>/events) don't each pin a worker
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+
+def when_ready(server):
+    """Import yt-dlp, instaloader etc. in the master so workers share those pages copy-on-write"""
+    if not preload_app or os.getenv('WARM_UP', 'True').lower() != 'true':
+        return
+    import app
+    app.warm_up()
+    # Keep the garbage collector from touching (and so copying) the inherited objects
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges (e.g. active jobs) from the merged metrics"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,63 @@
+"""TTL cache of extractor metadata, in process memory or Redis"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CACHE_REQUESTS
+
+
+class InfoCache:
+    """Stores JSON-serializable extractor results for a short TTL.
+
+    Values are stored as JSON so every get() returns a private copy that
+    callers (e.g. yt-dlp's process_ie_result) are free to mutate.
+    """
+    KEY_PREFIX = 'bakraload:info:'
+
+    def __init__(self, ttl=300, redis_url=None, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._redis = None
+        if redis_url and redis_url.startswith(('redis://', 'rediss://', 'unix://')):
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self._get(key)
+        CACHE_REQUESTS.labels('info', 'miss' if value is None else 'hit').inc()
+        return value
+
+    def _get(self, key):
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(self.KEY_PREFIX + key)
+            except Exception:
+                return None
+        else:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None:
+                    return None
+                expires_at, raw = entry
+                if expires_at < time.time():
+                    del self._entries[key]
+                    return None
+                self._entries.move_to_end(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        raw = json.dumps(value)
+        if self._redis is not None:
+            try:
+                self._redis.setex(self.KEY_PREFIX + key, self.ttl, raw)
+            except Exception:
+                pass
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, raw)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
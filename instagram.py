@@ -0,0 +1,112 @@
+"""Shared Instaloader contexts and concurrent Instagram media fetching"""
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+LOADER_OPTIONS = dict(
+    filename_pattern='{profile}_{mediaid}_{date_utc}',
+    download_videos=True,
+    download_video_thumbnails=False,
+    download_geotags=False,
+    download_comments=False,  # Do not download comments
+    save_metadata=False,      # Do not save metadata JSON
+    compress_json=False,      # Do not compress JSON (no JSON will be saved)
+    quiet=True,
+)
+
+
+class InstaloaderPool:
+    """A fixed number of long-lived Instaloader instances shared by all requests.
+
+    Each instance keeps its HTTP session, login and rate-limit bookkeeping
+    between requests instead of starting from scratch, and the pool size
+    caps how many Instagram requests run against Instagram at once. When
+    session_user is set, every instance loads the session file written by
+    `instaloader --login`.
+    """
+
+    def __init__(self, size=2, session_user=None, session_file=None, timeout=120):
+        self.size = size
+        self.session_user = session_user
+        self.session_file = session_file
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _build(self):
+        # instaloader is imported on first use to keep worker startup fast
+        import instaloader
+        loader = instaloader.Instaloader(**LOADER_OPTIONS)
+        if self.session_user:
+            loader.load_session_from_file(self.session_user, self.session_file)
+        return loader
+
+    def _take(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            build = self._created < self.size
+            if build:
+                self._created += 1
+        if build:
+            try:
+                return self._build()
+            except BaseException:
+                with self._lock:
+                    self._created -= 1
+                raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise RuntimeError('Instagram is busy. Please try again shortly.') from None
+
+    @contextmanager
+    def loader(self, path):
+        """Check out a loader that saves into path"""
+        loader = self._take()
+        loader.dirname_pattern = path
+        try:
+            yield loader
+        finally:
+            loader.dirname_pattern = ''
+            self._idle.put(loader)
+
+
+def media_for(item):
+    """(url, filename suffix) for every file of a Post or StoryItem, as Instaloader would save them"""
+    if getattr(item, 'typename', None) == 'GraphSidecar':
+        return [(node.video_url if node.is_video else node.display_url, str(index))
+                for index, node in enumerate(item.get_sidecar_nodes(), 1)]
+    return [(item.video_url if item.is_video else item.url, None)]
+
+
+def download_items(loader, items, target, max_workers=4, on_item=None, captions=True, dirname=None):
+    """Fetch the media of posts/story items concurrently; returns how many items were saved.
+
+    Files go to dirname, or to the loader's download directory.
+
+    Metadata (post pages, sidecar nodes) is resolved item by item on the
+    calling thread, since that is what Instagram rate-limits; the media
+    files themselves are fetched on a bounded pool.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bakraload-insta') as pool:
+        futures = []
+        count = 0
+        for index, item in enumerate(items, 1):
+            if on_item:
+                on_item(index, item)
+            base = os.path.join(dirname or loader.dirname_pattern, loader.format_filename(item, target=target))
+            if captions and item.caption:
+                loader.save_caption(filename=base, mtime=item.date_local, caption=item.caption)
+            for url, suffix in media_for(item):
+                futures.append(pool.submit(loader.download_pic, filename=base, url=url, mtime=item.date_local,
+                                           filename_suffix=suffix))
+            count += 1
+        for future in futures:
+            future.result()
+    return count
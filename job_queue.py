@@ -0,0 +1,160 @@
+"""Redis-backed job records and download queue, so downloads can run on separate worker nodes"""
+import fnmatch
+import json
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+
+from jobs import JobStore
+
+
+def connect(url):
+    """Client for JOB_QUEUE_URL: redis://... (shared by every node) or memory:// (in-process stand-in)"""
+    if url == 'memory://':
+        return MemoryRedis()
+    import redis
+    return redis.Redis.from_url(url, decode_responses=True)
+
+
+class MemoryRedis:
+    """In-process stand-in for the few Redis commands used here (tests, single-process setups)"""
+
+    def __init__(self):
+        self._values = {}
+        self._expires = {}
+        self._lists = defaultdict(deque)
+        self._cond = threading.Condition()
+
+    def _live(self, name):
+        expires_at = self._expires.get(name)
+        if expires_at is not None and expires_at < time.time():
+            self._values.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._values
+
+    def get(self, name):
+        with self._cond:
+            return self._values.get(name) if self._live(name) else None
+
+    def set(self, name, value, ex=None):
+        with self._cond:
+            self._values[name] = value
+            if ex:
+                self._expires[name] = time.time() + ex
+            else:
+                self._expires.pop(name, None)
+        return True
+
+    def delete(self, *names):
+        with self._cond:
+            return sum(self._values.pop(name, None) is not None for name in names)
+
+    def scan_iter(self, match='*'):
+        with self._cond:
+            names = [name for name in list(self._values) if self._live(name) and fnmatch.fnmatchcase(name, match)]
+        yield from names
+
+    def lpush(self, name, *values):
+        with self._cond:
+            self._lists[name].extendleft(values)
+            self._cond.notify_all()
+            return len(self._lists[name])
+
+    def llen(self, name):
+        with self._cond:
+            return len(self._lists[name])
+
+    def rpoplpush(self, src, dst):
+        with self._cond:
+            if not self._lists[src]:
+                return None
+            value = self._lists[src].pop()
+            self._lists[dst].appendleft(value)
+            return value
+
+    def brpoplpush(self, src, dst, timeout=0):
+        deadline = time.monotonic() + timeout if timeout else None
+        with self._cond:
+            while not self._lists[src]:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            return self.rpoplpush(src, dst)
+
+    def lrem(self, name, count, value):
+        with self._cond:
+            items = self._lists[name]
+            removed = 0
+            for item in list(items):
+                if item == value and (count == 0 or removed < abs(count)):
+                    items.remove(item)
+                    removed += 1
+            return removed
+
+
+class RedisJobStore(JobStore):
+    """Job records in Redis, so the web tier and every worker node see the same state.
+
+    Records expire `ttl` seconds after their last update; JobManager still
+    reaps finished ones after its result TTL.
+    """
+    KEY_PREFIX = 'bakraload:job:'
+
+    def __init__(self, redis, ttl=24 * 3600):
+        self.redis = redis
+        self.ttl = ttl
+
+    def save(self, job):
+        self.redis.set(self.KEY_PREFIX + job['id'], json.dumps(job), ex=self.ttl)
+
+    def get(self, job_id):
+        if not self.is_valid_id(job_id):
+            return None
+        raw = self.redis.get(self.KEY_PREFIX + job_id)
+        return json.loads(raw) if raw is not None else None
+
+    def delete(self, job_id):
+        self.redis.delete(self.KEY_PREFIX + job_id)
+
+    def all(self):
+        for key in self.redis.scan_iter(match=self.KEY_PREFIX + '*'):
+            job = self.get(key[len(self.KEY_PREFIX):])
+            if job is not None:
+                yield job
+
+
+class DownloadQueue:
+    """FIFO of job ids in a Redis list, shared by every node.
+
+    A popped id is parked in this node's processing list until ack(), so
+    that a worker restarted under the same name can recover() the jobs it
+    was running when it died. Give every worker process its own name.
+    """
+    KEY = 'bakraload:queue'
+
+    def __init__(self, redis, node=None):
+        self.redis = redis
+        self.node = node or socket.gethostname()
+        self.processing_key = f'{self.KEY}:processing:{self.node}'
+
+    def __len__(self):
+        return self.redis.llen(self.KEY)
+
+    def push(self, job_id):
+        self.redis.lpush(self.KEY, job_id)
+
+    def pop(self, timeout=5):
+        """Next job id, or None after timeout seconds"""
+        return self.redis.brpoplpush(self.KEY, self.processing_key, timeout)
+
+    def ack(self, job_id):
+        self.redis.lrem(self.processing_key, 0, job_id)
+
+    def recover(self):
+        """Requeue the jobs this node had taken but not finished; returns how many"""
+        count = 0
+        while self.redis.rpoplpush(self.processing_key, self.KEY) is not None:
+            count += 1
+        return count
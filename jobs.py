@@ -0,0 +1,268 @@
+"""Background download jobs for Bakraload"""
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import profiling
+from admission import Overloaded
+from cache import public_info
+from progress import ProgressReporter
+from quality import Quality
+from zipstream import zip_filename_for
+
+
+class QueueFull(Exception):
+    """Raised when a worker already has too many pending jobs"""
+
+
+class JobStore:
+    """File-backed job records, shared by every gunicorn worker on the host"""
+    JOB_ID_REGEX = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.root, f'{job_id}.json')
+
+    def is_valid_id(self, job_id):
+        return bool(job_id and self.JOB_ID_REGEX.match(job_id))
+
+    def save(self, job):
+        """Atomically write a job record"""
+        path = self._path(job['id'])
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id):
+        if not self.is_valid_id(job_id):
+            return None
+        try:
+            with open(self._path(job_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update(self, job_id, **fields):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.update(fields)
+        job['updated_at'] = time.time()
+        self.save(job)
+        return job
+
+    def delete(self, job_id):
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def all(self):
+        for name in os.listdir(self.root):
+            if name.endswith('.json'):
+                job = self.get(name[:-5])
+                if job is not None:
+                    yield job
+
+
+class JobManager:
+    """Runs download_content on a bounded pool of background threads and publishes the results.
+
+    With a queue (a job_queue.DownloadQueue), submit() only records and
+    enqueues the job, and work() runs queued jobs wherever it is called:
+    in worker.py on separate download nodes, or in-process.
+    """
+    FINISHED_STATES = ('succeeded', 'failed')
+
+    def __init__(self, downloader, store, artifacts, max_workers=2, queue_limit=50, result_ttl=3600,
+                 admission=None, profiler=None, queue=None, platform_wait=900):
+        self.downloader = downloader
+        self.store = store
+        self.artifacts = artifacts
+        self.admission = admission
+        self.profiler = profiler
+        self.queue = queue
+        self.max_workers = max_workers
+        self.queue_limit = queue_limit
+        self.result_ttl = result_ttl
+        self.platform_wait = platform_wait
+        self._executor = None
+        self._worker = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Threads are started lazily so a preloaded app forks cleanly
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='bakraload-job')
+            return self._executor
+
+    def submit(self, url, format_type='default', profile=False, quality=None):
+        """Queue a download and return the new job record; profile=True always keeps a profile of it"""
+        if self.queue is not None:
+            if len(self.queue) >= self.queue_limit:
+                raise QueueFull('Too many downloads in progress. Please try again shortly.')
+        else:
+            with self._lock:
+                if self._pending >= self.queue_limit:
+                    raise QueueFull('Too many downloads in progress. Please try again shortly.')
+                self._pending += 1
+        now = time.time()
+        job = {
+            'id': secrets.token_urlsafe(16),
+            'url': url,
+            'format': format_type,
+            'quality': quality._asdict() if quality else None,
+            'state': 'queued',
+            'created_at': now,
+            'updated_at': now,
+            'error': None,
+            'info': None,
+            'artifact': None,
+            'progress': None,
+            'profile': profile,
+        }
+        self.store.save(job)
+        if self.queue is not None:
+            self.queue.push(job['id'])
+            return job
+        try:
+            self._get_executor().submit(self._run, job['id'])
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            self.store.delete(job['id'])
+            raise
+        return job
+
+    def _run(self, job_id):
+        active = False
+        capture = None
+        try:
+            if self.admission is not None:
+                # Stay queued while temp space or CPU is exhausted
+                self.admission.wait()
+            job = self.store.update(job_id, state='running', started_at=time.time(),
+                                    node=self.queue.node if self.queue is not None else None)
+            if job is None:
+                return
+            metrics.ACTIVE_JOBS.inc()
+            active = True
+            if self.profiler is not None:
+                capture = self.profiler.start(f'job {job_id}', force=job.get('profile', False))
+            progress = ProgressReporter(lambda snapshot: self.store.update(job_id, progress=snapshot))
+            temp_dir, file_list, error, info = self._download(job, progress)
+            if error:
+                self.store.update(job_id, state='failed', error=error, finished_at=time.time())
+                return
+            progress.update(stage='publishing')
+            start = time.perf_counter()
+            try:
+                with profiling.stage('publish'):
+                    artifact = self.artifacts.publish(temp_dir, file_list, zip_filename_for(info))
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            metrics.STAGE_SECONDS.labels('publish', self.downloader.detect_platform(job['url']),
+                                         metrics.format_label(job['format'])).observe(time.perf_counter() - start)
+            self.store.update(job_id, state='succeeded', artifact=artifact, info=public_info(info),
+                              finished_at=time.time())
+        except Exception:
+            self.store.update(job_id, state='failed', error='An error occurred while processing your request.',
+                              finished_at=time.time())
+        finally:
+            if capture is not None:
+                capture.finish()
+            if active:
+                metrics.ACTIVE_JOBS.dec()
+            with self._lock:
+                self._pending -= 1
+
+    def _download(self, job, progress):
+        """download_content, waiting up to platform_wait while the job's platform is paced or its circuit is open"""
+        deadline = time.monotonic() + self.platform_wait
+        quality = Quality(**job['quality']) if job.get('quality') else None
+        while True:
+            try:
+                return self.downloader.download_content(job['url'], job['format'], progress=progress, quality=quality)
+            except Overloaded as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    return None, None, str(e), None
+                progress.update(force=True, stage='waiting', retry_after=e.retry_after)
+                time.sleep(e.retry_after)
+
+    def work(self, stop=None, poll=5):
+        """Take jobs off the queue and run them, max_workers at a time, until stop is set.
+
+        A job is only taken when a thread is free for it, so the rest stay
+        queued for other nodes. Jobs this node was running when it last
+        stopped are requeued first.
+        """
+        stop = stop or threading.Event()
+        self.queue.recover()
+        slots = threading.BoundedSemaphore(self.max_workers)
+        executor = self._get_executor()
+        while not stop.is_set():
+            if not slots.acquire(timeout=poll):
+                continue
+            job_id = self.queue.pop(timeout=poll)
+            if job_id is None:
+                slots.release()
+                continue
+            with self._lock:
+                self._pending += 1
+            executor.submit(self._work_one, job_id, slots)
+        executor.shutdown(wait=True)
+        with self._lock:
+            self._executor = None
+
+    def start_worker(self):
+        """Run work() on a daemon thread of this process (for the in-process memory:// queue)"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self.work, name='bakraload-queue', daemon=True)
+                self._worker.start()
+
+    def _work_one(self, job_id, slots):
+        try:
+            self._run(job_id)
+        finally:
+            self.queue.ack(job_id)
+            slots.release()
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def reap_expired(self):
+        """Delete finished job records older than the result TTL; run by the janitor, off the request path"""
+        cutoff = time.time() - self.result_ttl
+        for job in list(self.store.all()):
+            if job['state'] in self.FINISHED_STATES and job.get('finished_at', job['updated_at']) < cutoff:
+                self.store.delete(job['id'])
+
+    @staticmethod
+    def public_view(job):
+        """Job fields that are safe to return to clients"""
+        return {
+            'id': job['id'],
+            'state': job['state'],
+            'format': job['format'],
+            'quality': job.get('quality'),
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at'],
+            'error': job.get('error'),
+            'info': job.get('info'),
+            'progress': job.get('progress'),
+            'filename': (job.get('artifact') or {}).get('filename'),
+            'size': (job.get('artifact') or {}).get('size'),
+        }
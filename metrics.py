@@ -0,0 +1,152 @@
+"""Prometheus metrics for Bakraload.
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+(set in gunicorn.conf.py) and /metrics merges them, so the numbers cover
+the whole host rather than whichever worker answered the scrape.
+"""
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+import closing
+from tuning import THROTTLE_MARKERS
+
+# From a quick info probe up to long playlist downloads
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+STAGE_SECONDS = Histogram(
+    'bakraload_stage_seconds', 'Time spent in each stage of a download',
+    ['stage', 'platform', 'format'], buckets=STAGE_BUCKETS)
+DOWNLOADS = Counter(
+    'bakraload_downloads_total', 'Downloads by outcome (success, cached, error)',
+    ['platform', 'format', 'outcome'])
+DOWNLOADED_BYTES = Counter(
+    'bakraload_downloaded_bytes_total', 'Bytes fetched from upstream platforms', ['platform'])
+SENT_BYTES = Counter(
+    'bakraload_sent_bytes_total', 'Bytes sent to clients', ['delivery'])
+CACHE_REQUESTS = Counter(
+    'bakraload_cache_requests_total', 'Cache lookups by cache and result (hit, miss)', ['cache', 'result'])
+ERRORS = Counter(
+    'bakraload_errors_total', 'Failed downloads by error class', ['platform', 'error_class'])
+REJECTED = Counter(
+    'bakraload_rejected_requests_total', 'Requests turned away before downloading', ['reason'])
+ACTIVE_JOBS = Gauge(
+    'bakraload_active_jobs', 'Background jobs currently running', multiprocess_mode='livesum')
+AUDIO_OUTPUTS = Counter(
+    'bakraload_audio_outputs_total', 'Audio files delivered by how they were produced (kept, remux, transcode)',
+    ['format', 'mode'])
+TRANSCODES_WAITING = Gauge(
+    'bakraload_transcodes_waiting', 'Audio transcodes queued for a free CPU slot', multiprocess_mode='livesum')
+DIRECT_FETCHES = Counter(
+    'bakraload_direct_fetches_total', 'Direct media links fetched without yt-dlp (ranged, single, passthrough)',
+    ['mode'])
+CIRCUIT_STATE = Gauge(
+    'bakraload_circuit_state', 'Per-platform circuit breaker (0 closed, 1 half-open, 2 open)',
+    ['platform'], multiprocess_mode='max')
+TEMP_BYTES = Gauge(
+    'bakraload_temp_bytes', 'Bytes held by in-flight download directories', multiprocess_mode='max')
+
+# Formats the app serves; anything else is counted as 'other' so labels stay a fixed set
+FORMAT_LABELS = {'default', 'mp4', 'mp3', 'm4a', 'opus'}
+
+# Substrings of yt-dlp/instaloader error messages, checked in order
+ERROR_CLASSES = (
+    ('throttled', THROTTLE_MARKERS),
+    # Before login_required: "Private video. Sign in if you've been granted access" is about that one video
+    ('private', ('private', 'Private')),
+    ('login_required', ('login', 'Login', 'Sign in', 'cookies')),
+    ('unavailable', ('unavailable', 'Unavailable', 'removed', 'not found', 'Not Found', 'HTTP Error 404')),
+    ('unsupported', ('Unsupported URL', 'Invalid or unsupported', 'No video formats')),
+    ('timeout', ('timed out', 'Timeout', 'timeout')),
+    ('postprocessing', ('Postprocessing', 'ffmpeg', 'ffprobe')),
+    ('empty', ('No downloadable content',)),
+)
+
+
+def error_class(message):
+    """Coarse, low-cardinality class of an error message"""
+    for name, markers in ERROR_CLASSES:
+        if any(marker in (message or '') for marker in markers):
+            return name
+    return 'other'
+
+
+def format_label(format_type):
+    return format_type if isinstance(format_type, str) and format_type in FORMAT_LABELS else 'other'
+
+
+def observe_stages(platform, format_type, stages):
+    for stage, seconds in stages.items():
+        if seconds:
+            STAGE_SECONDS.labels(stage, platform, format_label(format_type)).observe(seconds)
+
+
+def record_download(platform, format_type, error=None, info=None, stages=None, downloaded_bytes=0):
+    """Count a finished download_content call and its per-stage timings"""
+    format_type = format_label(format_type)
+    if error:
+        DOWNLOADS.labels(platform, format_type, 'error').inc()
+        ERRORS.labels(platform, error_class(error)).inc()
+    elif (info or {}).get('cached'):
+        DOWNLOADS.labels(platform, format_type, 'cached').inc()
+    else:
+        DOWNLOADS.labels(platform, format_type, 'success').inc()
+    observe_stages(platform, format_type, stages or {})
+    if downloaded_bytes:
+        DOWNLOADED_BYTES.labels(platform).inc(downloaded_bytes)
+
+
+def timed_iter(chunks, stage, platform, format_type):
+    """Yield from chunks, timing only the work of producing them (e.g. zip building)"""
+    spent = 0.0
+    chunks = iter(chunks)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                spent += time.perf_counter() - start
+            yield chunk
+    finally:
+        STAGE_SECONDS.labels(stage, platform, format_label(format_type)).observe(spent)
+
+
+def track_transfer(response, delivery, platform='unknown', format_type='default'):
+    """Time a response until the client has it (or went away) and count the bytes sent.
+
+    Files sent by send_file go to the server untouched (and out with
+    sendfile()), so for them the bytes are the response's Content-Length.
+    """
+    start = time.perf_counter()
+    sent = [0]
+    if response.is_streamed and not response.direct_passthrough:
+        body = response.response
+
+        def counted():
+            for chunk in body:
+                sent[0] += len(chunk)
+                yield chunk
+        response.response = counted()
+    else:
+        sent[0] = response.content_length or 0
+
+    def done():
+        STAGE_SECONDS.labels('transfer', platform, format_label(format_type)).observe(time.perf_counter() - start)
+        SENT_BYTES.labels(delivery).inc(sent[0])
+    closing.call_on_close(done)
+    return response
+
+
+def render():
+    """(body, content type) for the /metrics endpoint"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,68 @@
+"""Hand-off of finished playlist entries from a download thread to the response that zips them"""
+import os
+import queue
+import shutil
+import threading
+
+
+class EntryFeed:
+    """Files of playlist entries as they finish, for a response that streams them before the rest are done.
+
+    The download side calls entry() for every finished entry and finish()
+    with the download_content() result; the response side calls wait()
+    and then iterates files(). Once streaming has started, whichever side
+    lets go last removes the download directory, and a response that is
+    closed early cancels the entries that haven't started yet.
+    """
+
+    def __init__(self):
+        self.cancelled = threading.Event()
+        self.title = None
+        self.result = None
+        # Raised by the download instead of a result (e.g. Overloaded), for the response side to re-raise
+        self.exception = None
+        self._events = queue.Queue()
+        self._head = None
+        self._lock = threading.Lock()
+        self._holders = 2
+
+    def entry(self, temp_dir, paths):
+        self._events.put(('entry', temp_dir, paths))
+
+    def finish(self, result, exception=None):
+        self.result = result
+        self.exception = exception
+        self._events.put(('done', None, None))
+        self.release()
+
+    def wait(self):
+        """Block until the first entry is ready (True) or the download has ended without one (False)"""
+        self._head = self._events.get()
+        return self._head[0] == 'entry'
+
+    def files(self):
+        """(path, arcname) of every file, entry by entry, then whatever else the finished download has"""
+        sent = set()
+        event = self._head
+        while event[0] == 'entry':
+            _, temp_dir, paths = event
+            for path in paths:
+                sent.add(path)
+                yield path, os.path.relpath(path, temp_dir)
+            event = self._events.get()
+        temp_dir, file_list, error, info = self.result
+        for path in file_list or []:
+            if path not in sent:
+                yield path, os.path.relpath(path, temp_dir)
+
+    def close(self):
+        """The response is done (or the client went away)"""
+        self.cancelled.set()
+        self.release()
+
+    def release(self):
+        with self._lock:
+            self._holders -= 1
+            last = self._holders == 0
+        if last and self.result and self.result[0]:
+            shutil.rmtree(self.result[0], ignore_errors=True)
@@ -0,0 +1,122 @@
+"""Incremental Instagram profile sync: a per-profile media library with a newest-post watermark"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from cache import FileLock, link_or_copy
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    username TEXT NOT NULL,
+    mediaid INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    pinned INTEGER NOT NULL DEFAULT 0,
+    prefix TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (username, kind, mediaid)
+);
+'''
+
+
+class ProfileLibrary:
+    """Media already downloaded per Instagram profile, indexed in SQLite.
+
+    The newest non-pinned post stored for a profile is its watermark: a
+    repeat sync walks the profile feed only until it reaches that post,
+    downloads what is newer, and hard-links everything else from the
+    library. Stories are matched by media id, since they all expire within
+    a day. Only the `keep` newest posts per profile are retained.
+    """
+    USERNAME_REGEX = re.compile(r'^[A-Za-z0-9._]{1,30}$')
+    STORY_TTL = 24 * 3600
+
+    def __init__(self, root, keep=10):
+        self.root = root
+        self.keep = keep
+        os.makedirs(self.root, exist_ok=True)
+        self._db_path = os.path.join(root, 'profiles.sqlite3')
+        self._local = threading.local()
+        with self._db() as db:
+            db.executescript(SCHEMA)
+
+    def _db(self):
+        # One connection per thread; WAL lets workers read while another writes
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(self._db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    def media_dir(self, username):
+        if not self.USERNAME_REGEX.match(username or ''):
+            raise ValueError(f'Invalid Instagram username: {username!r}')
+        path = os.path.join(self.root, username)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def lock(self, username):
+        """Serializes syncs of one profile across threads and workers"""
+        return FileLock(os.path.join(self.media_dir(username), '.lock'))
+
+    def watermark(self, username):
+        """taken_at of the newest non-pinned post in the library, or None"""
+        row = self._db().execute(
+            "SELECT MAX(taken_at) FROM media WHERE username = ? AND kind = 'post' AND pinned = 0",
+            (username,)).fetchone()
+        return row[0]
+
+    def known_ids(self, username, kind):
+        rows = self._db().execute('SELECT mediaid FROM media WHERE username = ? AND kind = ?', (username, kind))
+        return {row[0] for row in rows}
+
+    def add(self, username, kind, mediaid, taken_at, prefix, pinned=False):
+        with self._db() as db:
+            db.execute('INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (username, mediaid, kind, taken_at, int(pinned), prefix, time.time()))
+
+    def files_for(self, username, kind, mediaids=None, limit=None):
+        """Library files of the given (or newest) items: one list of paths per item, newest first"""
+        rows = self._db().execute(
+            'SELECT mediaid, prefix FROM media WHERE username = ? AND kind = ? ORDER BY taken_at DESC',
+            (username, kind)).fetchall()
+        if mediaids is not None:
+            rows = [row for row in rows if row[0] in mediaids]
+        if limit is not None:
+            rows = rows[:limit]
+        media_dir = self.media_dir(username)
+        names = sorted(os.listdir(media_dir))
+        return [[os.path.join(media_dir, name) for name in names if name.startswith(prefix)] for _, prefix in rows]
+
+    def link_into(self, items, dest_dir):
+        """Hard-link the files of library items into a request's download directory"""
+        for files in items:
+            for path in files:
+                link_or_copy(path, os.path.join(dest_dir, os.path.basename(path)))
+
+    def prune(self, username):
+        """Drop posts beyond the newest `keep` (pinned ones stay) and stories that have expired"""
+        db = self._db()
+        stale = db.execute(
+            "SELECT mediaid, kind, prefix FROM media WHERE username = ? AND ("
+            "  (kind = 'post' AND pinned = 0 AND mediaid NOT IN ("
+            "    SELECT mediaid FROM media WHERE username = ? AND kind = 'post' AND pinned = 0"
+            "    ORDER BY taken_at DESC LIMIT ?))"
+            "  OR (kind = 'story' AND taken_at < ?))",
+            (username, username, self.keep, time.time() - self.STORY_TTL)).fetchall()
+        if not stale:
+            return
+        media_dir = self.media_dir(username)
+        names = os.listdir(media_dir)
+        for _, _, prefix in stale:
+            for name in names:
+                if name.startswith(prefix):
+                    try:
+                        os.remove(os.path.join(media_dir, name))
+                    except OSError:
+                        pass
+        with db:
+            db.executemany('DELETE FROM media WHERE username = ? AND kind = ? AND mediaid = ?',
+                           [(username, kind, mediaid) for mediaid, kind, _ in stale])
@@ -0,0 +1,233 @@
+"""Opt-in profiling of slow requests, kept in an on-disk ring buffer"""
+import cProfile
+import json
+import pstats
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+_current = threading.local()
+
+
+def stage(name):
+    """Attribute what runs inside to a named stage of the current capture (no-op when not profiling)"""
+    capture = current()
+    return capture.stage(name) if capture is not None else nullcontext()
+
+
+def current():
+    """The capture of the calling thread, if it is being profiled"""
+    return getattr(_current, 'capture', None)
+
+
+def _folded_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class _Sampler:
+    """One background thread that samples the stacks of every thread being profiled"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._captures = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, capture):
+        with self._lock:
+            self._captures[capture.thread_id] = capture
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='bakraload-sampler', daemon=True)
+                self._thread.start()
+
+    def remove(self, capture):
+        with self._lock:
+            self._captures.pop(capture.thread_id, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._captures:
+                    self._thread = None
+                    return
+                captures = list(self._captures.values())
+            frames = sys._current_frames()
+            for capture in captures:
+                thread_id = capture.thread_id
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    capture.samples[f'{capture.stage_of(thread_id)};{_folded_stack(frame)}'] += 1
+
+
+class Capture:
+    """Profile of one request: stack samples per stage, plus cProfile stats when forced.
+
+    A request's stages can run on several threads (the handler, a download
+    thread, the thread sending the body), so each thread keeps its own
+    stack of stages and every stage entry gets its own cProfile.Profile,
+    enabled and disabled on the thread that does the work. Only stages that
+    have ended make it into the saved pstats.
+    """
+
+    def __init__(self, profiler, name, forced):
+        self.profiler = profiler
+        self.name = name
+        self.forced = forced
+        self.thread_id = threading.get_ident()
+        self.started_at = time.time()
+        self.stage_seconds = {}
+        self.samples = Counter()
+        self.profiles = {}
+        # thread id -> (stage, its cProfile.Profile or None) the thread is in
+        self._active = {}
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def stage_of(self, thread_id):
+        """Stage the given thread is in ('request' outside any)"""
+        return self._active.get(thread_id, ('request', None))[0]
+
+    @contextmanager
+    def stage(self, name):
+        thread_id = threading.get_ident()
+        previous = self._active.get(thread_id)
+        profile = None
+        if self.forced:
+            # The enclosing stage on this thread is paused, so time is counted once
+            if previous is not None and previous[1] is not None:
+                previous[1].disable()
+            profile = cProfile.Profile()
+            profile.enable()
+        self._active[thread_id] = (name, profile)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                with self._lock:
+                    self.profiles.setdefault(name, []).append(profile)
+            if previous is None:
+                self._active.pop(thread_id, None)
+            else:
+                self._active[thread_id] = previous
+                if previous[1] is not None:
+                    previous[1].enable()
+
+    def finished_profiles(self):
+        """stage -> the cProfile.Profile of each of its entries that has ended"""
+        with self._lock:
+            return {name: list(profiles) for name, profiles in self.profiles.items()}
+
+    def attach(self):
+        """Make this the capture of the calling thread (the thread that runs the response body)"""
+        _current.capture = self
+        if self.thread_id != threading.get_ident():
+            self.profiler.sampler.remove(self)
+            self.thread_id = threading.get_ident()
+            self.profiler.sampler.add(self)
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self.profiler.sampler.remove(self)
+        if getattr(_current, 'capture', None) is self:
+            _current.capture = None
+        duration = time.time() - self.started_at
+        if self.forced or duration >= self.profiler.threshold:
+            self.profiler.save(self, duration)
+
+
+class Profiler:
+    """Samples requests while enabled and keeps the ones slower than `threshold` seconds.
+
+    Sampling reads thread stacks from a background thread every `interval`
+    seconds, so profiled requests run at full speed. A forced capture (an
+    admin asked for it) also runs cProfile per stage and is always kept.
+    Captures are written under `root`, shared by every worker, and only
+    the newest `keep` are retained. When disabled and not forced, start()
+    returns None and nothing else happens.
+    """
+    CAPTURE_ID_REGEX = re.compile(r'^[0-9]+-[A-Za-z0-9_-]{8,32}$')
+
+    def __init__(self, root, enabled=False, threshold=30.0, interval=0.01, keep=50):
+        self.root = root
+        self.enabled = enabled
+        self.threshold = threshold
+        self.keep = keep
+        self.sampler = _Sampler(interval)
+        os.makedirs(self.root, exist_ok=True)
+
+    def start(self, name, force=False):
+        if not (self.enabled or force):
+            return None
+        capture = Capture(self, name, force)
+        _current.capture = capture
+        self.sampler.add(capture)
+        return capture
+
+    def save(self, capture, duration):
+        capture_id = f'{int(capture.started_at * 1000)}-{secrets.token_urlsafe(6)}'
+        base = os.path.join(self.root, capture_id)
+        with open(f'{base}.folded', 'w') as f:
+            for stack, count in capture.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        profiles = capture.finished_profiles()
+        for stage_name, stage_profiles in profiles.items():
+            pstats.Stats(*stage_profiles).dump_stats(f'{base}.{stage_name}.prof')
+        meta = {
+            'id': capture_id,
+            'name': capture.name,
+            'forced': capture.forced,
+            'started_at': capture.started_at,
+            'duration': round(duration, 3),
+            'stages': {name: round(seconds, 3) for name, seconds in capture.stage_seconds.items()},
+            'samples': sum(capture.samples.values()),
+            'pstats': sorted(profiles),
+        }
+        with open(f'{base}.json', 'w') as f:
+            json.dump(meta, f)
+        self._prune()
+
+    def _prune(self):
+        captures = sorted(name[:-5] for name in os.listdir(self.root) if name.endswith('.json'))
+        for capture_id in captures[:-self.keep] if self.keep else captures:
+            for name in os.listdir(self.root):
+                if name.startswith(capture_id + '.'):
+                    try:
+                        os.remove(os.path.join(self.root, name))
+                    except OSError:
+                        pass
+
+    def list(self):
+        """Metadata of the stored captures, newest first"""
+        captures = []
+        for name in sorted(os.listdir(self.root), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.root, name)) as f:
+                        captures.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return captures
+
+    def path_for(self, capture_id, kind):
+        """Path of a capture's folded stacks ('folded') or a stage's pstats ('<stage>.prof'), or None"""
+        if not self.CAPTURE_ID_REGEX.match(capture_id or '') or not re.match(r'^(folded|[a-z]+\.prof)$', kind):
+            return None
+        path = os.path.join(self.root, f'{capture_id}.{kind}')
+        return path if os.path.exists(path) else None
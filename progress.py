@@ -0,0 +1,64 @@
+"""Throttled download progress reporting for yt-dlp and instaloader"""
+import time
+
+
+class ProgressReporter:
+    """Turns yt-dlp/instaloader callbacks into progress snapshots for one download.
+
+    publish(snapshot) is called at most once per min_interval while bytes are
+    flowing; a change of stage (downloading, postprocessing, next playlist
+    entry...) is always published right away. The hooks only compare a
+    timestamp on the hot path, so they don't slow the download loop.
+    """
+
+    def __init__(self, publish, min_interval=0.5):
+        self.publish = publish
+        self.min_interval = min_interval
+        self.snapshot = {'stage': 'starting'}
+        self._last_publish = 0.0
+
+    def update(self, force=False, **fields):
+        now = time.monotonic()
+        stage_changed = fields.get('stage', self.snapshot['stage']) != self.snapshot['stage']
+        if not (force or stage_changed) and now - self._last_publish < self.min_interval:
+            return
+        self.snapshot = dict(self.snapshot, **fields)
+        self._last_publish = now
+        try:
+            self.publish(dict(self.snapshot))
+        except Exception:
+            # Progress is best effort; never fail the download over it
+            pass
+
+    def ydl_hook(self, d):
+        """yt-dlp progress_hooks entry"""
+        status = d.get('status')
+        if status == 'downloading' and time.monotonic() - self._last_publish < self.min_interval \
+                and self.snapshot['stage'] == 'downloading':
+            return
+        info = d.get('info_dict') or {}
+        self.update(
+            force=status == 'finished',
+            stage='downloading',
+            downloaded_bytes=d.get('downloaded_bytes'),
+            total_bytes=d.get('total_bytes') or d.get('total_bytes_estimate'),
+            speed=round(d['speed']) if d.get('speed') else None,
+            eta=d.get('eta'),
+            filename=info.get('title') or info.get('id'),
+            entry=info.get('playlist_index'),
+            entry_count=info.get('n_entries') or info.get('playlist_count'),
+        )
+
+    def postprocessor_hook(self, d):
+        """yt-dlp postprocessor_hooks entry"""
+        self.update(
+            force=True,
+            stage='postprocessing' if d.get('status') != 'finished' else 'postprocessed',
+            postprocessor=d.get('postprocessor'),
+            speed=None,
+            eta=None,
+        )
+
+    def item(self, index, count, label=None):
+        """An instaloader post/story item is about to be fetched"""
+        self.update(force=True, stage='downloading', entry=index, entry_count=count, filename=label)
@@ -0,0 +1,114 @@
+"""Request-level quality profiles (resolution, size budget, codec, subtitles) turned into yt-dlp format selection"""
+from collections import namedtuple
+
+MB = 1024 * 1024
+
+# Requested limits are rounded down to a rung of these ladders, so every request stays within what it asked
+# for while the number of distinct engine profiles and cache entries stays small
+HEIGHT_LADDER = (144, 240, 360, 480, 720, 1080, 1440, 2160, 4320)
+SIZE_LADDER = tuple(n * MB for n in (1, 2, 5, 10, 25, 50, 100, 250, 500, 1024, 2048, 4096))
+
+# Codec preference -> yt-dlp format_sort vcodec value
+CODECS = {'h264': 'h264', 'avc': 'h264', 'h265': 'h265', 'hevc': 'h265', 'vp9': 'vp9', 'av1': 'av01'}
+
+# Audio merged into a capped video gets the highest bitrate up to this (kbit/s) rather than the best there is
+AUDIO_BITRATE = 128
+
+
+class Quality(namedtuple('Quality', 'max_height max_filesize codec subtitles')):
+    """What a client needs: max_height (px), max_filesize (bytes per file), codec preference, subtitles on/off.
+
+    None in a field leaves the platform's default for it.
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """Stable text form, part of the result cache key"""
+        return ','.join(f'{name}={value}' for name, value in zip(self._fields, self) if value is not None)
+
+
+def _rung(value, ladder, field):
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError(f'quality.{field} must be a positive integer.')
+    if value < ladder[0]:
+        raise ValueError(f'quality.{field} must be at least {ladder[0]}.')
+    return max(rung for rung in ladder if rung <= value)
+
+
+def parse_quality(value):
+    """Quality from a request's "quality" object, or None when it asks for nothing; raises ValueError if invalid"""
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise ValueError('quality must be an object.')
+    unknown = set(value) - set(Quality._fields)
+    if unknown:
+        raise ValueError(f'Unknown quality field: {sorted(unknown)[0]}.')
+    max_height = value.get('max_height')
+    max_filesize = value.get('max_filesize')
+    codec = value.get('codec')
+    subtitles = value.get('subtitles')
+    if codec is not None and (not isinstance(codec, str) or codec.lower() not in CODECS):
+        raise ValueError(f'quality.codec must be one of: {", ".join(CODECS)}.')
+    if subtitles is not None and not isinstance(subtitles, bool):
+        raise ValueError('quality.subtitles must be true or false.')
+    quality = Quality(
+        _rung(max_height, HEIGHT_LADDER, 'max_height') if max_height is not None else None,
+        _rung(max_filesize, SIZE_LADDER, 'max_filesize') if max_filesize is not None else None,
+        CODECS[codec.lower()] if codec is not None else None,
+        subtitles,
+    )
+    return quality if any(field is not None for field in quality) else None
+
+
+def _size_filter(max_filesize):
+    # '<?' also lets through formats whose size isn't known up front
+    return f'[filesize<?{max_filesize}][filesize_approx<?{max_filesize}]' if max_filesize else ''
+
+
+def apply_quality(ydl_opts, quality, audio_format=None, merge=True, max_height=None, ext=None):
+    """Narrow a platform's yt-dlp options to a quality profile; ydl_opts is returned as is without one.
+
+    With a height target (the profile's, else the platform's max_height)
+    the tallest format up to it is picked and, at that height, the
+    cheapest format: the preferred codec, then a file that needs no merge,
+    then the smallest. Without one the platform's best format within the
+    size budget is kept. merge=False is for platforms served as single
+    files; audio formats only take the size budget, which applies per file.
+    """
+    if quality is None:
+        return ydl_opts
+    size = _size_filter(quality.max_filesize)
+    if quality.max_filesize:
+        # Formats that didn't say how big they are are stopped once their download turns out bigger
+        ydl_opts['max_filesize'] = quality.max_filesize
+    if audio_format is not None:
+        ydl_opts['format'] = '/'.join(f'{selector}{size}' for selector in audio_format.selector.split('/'))
+        return ydl_opts
+    height = quality.max_height or max_height
+    # A hard cap on height, not res (the shorter side), so portrait videos are capped too
+    cap = f'[height<={height}]' if height else ''
+    format_sort = []
+    if height:
+        format_sort.append(f'height:{height}')
+    if quality.codec:
+        format_sort.append(f'vcodec:{quality.codec}')
+    if ext:
+        format_sort.append(f'ext:{ext}')
+    if height:
+        format_sort += ['hasaud', f'abr:{AUDIO_BITRATE}', '+size', '+br']
+    # With one audio stream allowed, a selected video that already has audio is not merged again
+    def selector(cap):
+        return f'bv*{cap}{size}+ba{size}/b{cap}{size}' if merge else f'b{cap}{size}'
+    # Sources with nothing under the cap still get the format closest to it
+    ydl_opts['format'] = f'{selector(cap)}/{selector("")}' if cap else selector('')
+    if format_sort:
+        ydl_opts['format_sort'] = format_sort
+    if quality.subtitles is False:
+        for option in ('writesubtitles', 'writeautomaticsub', 'subtitleslangs'):
+            ydl_opts.pop(option, None)
+    elif quality.subtitles:
+        ydl_opts['writesubtitles'] = True
+        ydl_opts.setdefault('subtitleslangs', ['en'])
+    return ydl_opts
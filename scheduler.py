@@ -0,0 +1,180 @@
+"""Per-platform request pacing and circuit breaking, so a degraded platform can't tie up the workers"""
+import math
+import threading
+import time
+from collections import deque
+
+from admission import Overloaded
+from metrics import CIRCUIT_STATE, error_class
+
+# Upstream requests per second per worker, and how many may go out back to back.
+# Instagram and TikTok answer bursts with 429s and login walls.
+DEFAULT_LIMITS = {
+    'instagram': {'rate': 0.5, 'burst': 5},
+    'tiktok': {'rate': 1.0, 'burst': 10},
+    'default': {'rate': None, 'burst': None},
+}
+
+# Error classes (see metrics.error_class) that say the platform is the problem, not the link.
+# Private, removed or age-gated content is a problem of that one link, so anyone could
+# open a circuit for everybody with a handful of such links.
+DEGRADED_CLASSES = {'throttled', 'timeout'}
+# Where a login wall goes up for every anonymous request at once rather than for one post
+LOGIN_WALL_PLATFORMS = {'instagram'}
+
+CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+
+class PlatformScheduler:
+    """Paces upstream requests per platform and stops sending them while a platform is degraded.
+
+    Each platform has a token bucket of `rate` requests per second and
+    `burst` tokens; a request that would wait longer than max_wait for its
+    token is turned away instead. The rate is halved whenever the platform
+    throttles us and creeps back up with successes.
+
+    Outcomes of the last `window` seconds feed a circuit breaker: once
+    min_requests have been seen and failure_ratio of them failed with a
+    throttle, timeout or Instagram login wall, the circuit opens and requests fail
+    fast with Retry-After for `cooldown` seconds. Then one probe request is
+    let through (half-open); its success closes the circuit, its failure
+    opens it again for twice as long, up to max_cooldown. State is per
+    worker, like DownloadTuner. Platforms in `exempt` are never held back.
+    """
+
+    def __init__(self, limits=None, max_wait=10, window=60, min_requests=5, failure_ratio=0.5, cooldown=30,
+                 max_cooldown=600, probe_timeout=300, exempt=('unknown',)):
+        self.limits = {name: dict(limit) for name, limit in DEFAULT_LIMITS.items()}
+        for name, limit in (limits or {}).items():
+            self.limits.setdefault(name, dict(self.limits['default'])).update(limit)
+        self.max_wait = max_wait
+        self.window = window
+        self.min_requests = min_requests
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.exempt = set(exempt)
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _platform_state(self, platform):
+        state = self._state.get(platform)
+        if state is None:
+            limit = self.limits.get(platform, self.limits['default'])
+            state = self._state[platform] = {
+                'rate': limit['rate'],
+                'tokens': limit['burst'] or 1,
+                'refilled_at': time.monotonic(),
+                'outcomes': deque(),
+                'circuit': CLOSED,
+                'open_until': 0.0,
+                'cooldown': self.cooldown,
+                'probe_started': None,
+                'probe_thread': None,
+            }
+        return state
+
+    def _set_circuit(self, platform, state, circuit):
+        state['circuit'] = circuit
+        CIRCUIT_STATE.labels(platform).set(circuit)
+
+    def _open(self, platform, state, now, cooldown):
+        state['cooldown'] = min(cooldown, self.max_cooldown)
+        state['open_until'] = now + state['cooldown']
+        state['probe_started'] = None
+        state['probe_thread'] = None
+        state['outcomes'].clear()
+        self._set_circuit(platform, state, OPEN)
+
+    def _reserve_token(self, platform, state, now):
+        """Seconds until this request's token is due; raises if that is more than max_wait"""
+        if not state['rate']:
+            return 0.0
+        burst = self.limits.get(platform, self.limits['default'])['burst'] or 1
+        state['tokens'] = min(burst, state['tokens'] + (now - state['refilled_at']) * state['rate'])
+        state['refilled_at'] = now
+        wait = (1 - state['tokens']) / state['rate'] if state['tokens'] < 1 else 0.0
+        if wait > self.max_wait:
+            raise Overloaded(f'Too many {platform} downloads right now. Please try again shortly.',
+                             math.ceil(wait), reason='paced')
+        # Tokens may go negative: later requests queue behind the ones already waiting
+        state['tokens'] -= 1
+        return wait
+
+    def acquire(self, platform):
+        """Wait for the platform's next request slot; raises Overloaded while it is degraded or too busy"""
+        if platform in self.exempt:
+            return
+        with self._lock:
+            now = time.monotonic()
+            state = self._platform_state(platform)
+            if state['circuit'] == OPEN:
+                if now < state['open_until']:
+                    raise Overloaded(f'Downloads from {platform} are paused while it is failing or throttling '
+                                     'requests. Please try again later.',
+                                     math.ceil(state['open_until'] - now), reason='circuit_open')
+                self._set_circuit(platform, state, HALF_OPEN)
+            probing = state['circuit'] == HALF_OPEN
+            if probing and state['probe_started'] is not None and now - state['probe_started'] < self.probe_timeout:
+                raise Overloaded(f'Downloads from {platform} are paused while it recovers. Please try again later.',
+                                 self.cooldown, reason='circuit_open')
+            wait = self._reserve_token(platform, state, now)
+            if probing:
+                state['probe_started'] = now
+                # acquire() and record() of one request run on the same thread
+                state['probe_thread'] = threading.get_ident()
+        if wait:
+            time.sleep(wait)
+
+    def release(self, platform):
+        """Give back a slot taken by acquire() whose request hands over to another one without an outcome"""
+        if platform in self.exempt:
+            return
+        with self._lock:
+            state = self._platform_state(platform)
+            if state['rate']:
+                burst = self.limits.get(platform, self.limits['default'])['burst'] or 1
+                state['tokens'] = min(burst, state['tokens'] + 1)
+            if state['circuit'] == HALF_OPEN and state['probe_thread'] == threading.get_ident():
+                # The request taking over may be the probe instead
+                state['probe_started'] = None
+                state['probe_thread'] = None
+
+    def record(self, platform, error=None):
+        """Feed back the outcome of a request let through by acquire(); error is its message, if it failed"""
+        if platform in self.exempt:
+            return
+        kind = error_class(error) if error else None
+        degraded = kind in DEGRADED_CLASSES or (kind == 'login_required' and platform in LOGIN_WALL_PLATFORMS)
+        with self._lock:
+            now = time.monotonic()
+            state = self._platform_state(platform)
+            configured = self.limits.get(platform, self.limits['default'])['rate']
+            if configured:
+                if kind == 'throttled':
+                    state['rate'] = max(configured / 8, state['rate'] / 2)
+                elif not degraded:
+                    state['rate'] = min(configured, state['rate'] + configured / 10)
+            if state['circuit'] == HALF_OPEN:
+                # Requests let through before the circuit opened say nothing about whether it recovered
+                if state['probe_thread'] != threading.get_ident():
+                    return
+                if degraded:
+                    self._open(platform, state, now, state['cooldown'] * 2)
+                else:
+                    state['cooldown'] = self.cooldown
+                    state['probe_started'] = None
+                    state['probe_thread'] = None
+                    state['outcomes'].clear()
+                    self._set_circuit(platform, state, CLOSED)
+                return
+            outcomes = state['outcomes']
+            outcomes.append((now, degraded))
+            while outcomes and outcomes[0][0] < now - self.window:
+                outcomes.popleft()
+            failures = sum(failed for _, failed in outcomes)
+            if state['circuit'] == CLOSED and len(outcomes) >= self.min_requests \
+                    and failures >= self.failure_ratio * len(outcomes):
+                self._open(platform, state, now, self.cooldown)
+
@@ -32,38 +32,28 @@
             button.disabled = true;
             
             try {
-                const response = await fetch('/download', {
+                const response = await fetch('/jobs', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ url, format })
                 });
+                const result = await response.json();
                 
                 if (!response.ok) {
-                    const result = await response.json();
                     showStatus(statusDiv, `❌ ${result.message || 'Download failed'}`, 'error');
                     return;
                 }
                 
-                // Get filename from Content-Disposition header
-                const contentDisposition = response.headers.get('Content-Disposition');
-                let filename = 'download.zip';
-                if (contentDisposition) {
-                    const matches = /filename[^;=\n]*=(['"]?)([^'"\n]*?)\1/.exec(contentDisposition);
-                    if (matches && matches[2]) {
-                        filename = matches[2];
-                    }
+                const job = await waitForJob(result, progress => {
+                    showStatus(statusDiv, formatProgress(progress), 'loading');
+                });
+                if (job.state === 'failed') {
+                    showStatus(statusDiv, `❌ ${job.error || 'Download failed'}`, 'error');
+                    return;
                 }
                 
-                // Download the file
-                const blob = await response.blob();
-                const downloadUrl = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = downloadUrl;
-                a.download = filename;
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                window.URL.revokeObjectURL(downloadUrl);
+                // Let the browser stream the file straight to disk (resumable)
+                startDownload(job.artifact_url, job.filename);
                 
                 showStatus(statusDiv, '✅ Download started!', 'success');
                 document.getElementById('single-url').value = '';
@@ -76,6 +66,54 @@
             }
         }
 
+        // Follow a job's progress events until it has succeeded or failed
+        function waitForJob(created, onProgress) {
+            if (!window.EventSource || !created.events_url) {
+                return pollJob(created.status_url);
+            }
+            return new Promise((resolve, reject) => {
+                const source = new EventSource(created.events_url);
+                source.addEventListener('progress', e => {
+                    const job = JSON.parse(e.data);
+                    if (job.progress) onProgress(job.progress);
+                });
+                source.addEventListener('done', e => {
+                    source.close();
+                    resolve(JSON.parse(e.data));
+                });
+                source.onerror = () => {
+                    // Server went away mid-stream: fall back to polling
+                    if (source.readyState === EventSource.CLOSED) {
+                        pollJob(created.status_url).then(resolve, reject);
+                    }
+                };
+            });
+        }
+
+        // Poll a job until it has succeeded or failed
+        async function pollJob(statusUrl) {
+            while (true) {
+                const response = await fetch(statusUrl);
+                const result = await response.json();
+                if (!response.ok) {
+                    throw new Error(result.message || 'Job lookup failed');
+                }
+                if (result.job.state === 'succeeded' || result.job.state === 'failed') {
+                    return result.job;
+                }
+                await new Promise(resolve => setTimeout(resolve, 1500));
+            }
+        }
+
+        function startDownload(downloadUrl, filename) {
+            const a = document.createElement('a');
+            a.href = downloadUrl;
+            a.download = filename || '';
+            document.body.appendChild(a);
+            a.click();
+            document.body.removeChild(a);
+        }
+
         // Bulk download
         async function downloadBulk() {
             const urlsText = document.getElementById('bulk-urls').value.trim();
@@ -106,35 +144,17 @@
                 const response = await fetch('/bulk-download', {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ urls, format })
+                    body: JSON.stringify({ urls, format, delivery: 'link' })
                 });
+                const result = await response.json();
                 
                 if (!response.ok) {
-                    const result = await response.json();
                     showStatus(statusDiv, `❌ ${result.message || 'Bulk download failed'}`, 'error');
                     return;
                 }
                 
-                // Get filename from Content-Disposition header
-                const contentDisposition = response.headers.get('Content-Disposition');
-                let filename = 'bakraload_bulk_download.zip';
-                if (contentDisposition) {
-                    const matches = /filename[^;=\n]*=(['"]?)([^'"\n]*?)\1/.exec(contentDisposition);
-                    if (matches && matches[2]) {
-                        filename = matches[2];
-                    }
-                }
-                
-                // Download the file
-                const blob = await response.blob();
-                const downloadUrl = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = downloadUrl;
-                a.download = filename;
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                window.URL.revokeObjectURL(downloadUrl);
+                // Let the browser stream the zip straight to disk (resumable)
+                startDownload(result.artifact_url, result.filename);
                 
                 showStatus(statusDiv, `✅ Bulk download started! (${urls.length} URLs processed)`, 'success');
                 document.getElementById('bulk-urls').value = '';
@@ -158,6 +178,29 @@
             }
         }
 
+        function formatProgress(progress) {
+            let message = '⏳ ' + {
+                starting: 'Starting...',
+                downloading: 'Downloading',
+                postprocessing: 'Converting',
+                postprocessed: 'Converting',
+                publishing: 'Preparing file...',
+            }[progress.stage] || 'Working...';
+            if (progress.entry_count > 1) {
+                message += ` item ${progress.entry || 1} of ${progress.entry_count}`;
+            }
+            if (progress.stage === 'downloading' && progress.downloaded_bytes) {
+                message += ` ${formatFileSize(progress.downloaded_bytes)}`;
+                if (progress.total_bytes) {
+                    const percent = Math.min(100, 100 * progress.downloaded_bytes / progress.total_bytes);
+                    message += ` of ${formatFileSize(progress.total_bytes)} (${percent.toFixed(0)}%)`;
+                }
+                if (progress.speed) message += ` at ${formatFileSize(progress.speed)}/s`;
+                if (progress.eta != null) message += `, ${progress.eta}s left`;
+            }
+            return escapeHtml(message);
+        }
+
         function formatFileSize(bytes) {
             if (bytes === 0) return '0 Bytes';
             const k = 1024;
@@ -186,9 +229,42 @@
             if (platform && url.trim()) {
                 const statusDiv = document.getElementById('single-status');
                 showStatus(statusDiv, `🌐 Detected: ${platforms[platform]}`, 'loading');
+                schedulePreview(e.target.value.trim(), platforms[platform]);
             }
         });
 
+        // Metadata preview (also warms the server-side cache for the download)
+        let previewTimer = null;
+        function schedulePreview(url, platformName) {
+            clearTimeout(previewTimer);
+            previewTimer = setTimeout(async () => {
+                try {
+                    const response = await fetch('/info', {
+                        method: 'POST',
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ url })
+                    });
+                    if (!response.ok) return;
+                    const info = await response.json();
+                    if (document.getElementById('single-url').value.trim() !== url) return;
+                    let details = info.title || '';
+                    if (info.type === 'playlist' && info.entry_count) {
+                        details += ` (${info.entry_count} items)`;
+                    }
+                    const statusDiv = document.getElementById('single-status');
+                    showStatus(statusDiv, `🌐 ${platformName}: ${escapeHtml(details)}`, 'loading');
+                } catch (error) {
+                    // Preview is best effort
+                }
+            }, 600);
+        }
+
+        function escapeHtml(text) {
+            const div = document.createElement('div');
+            div.textContent = text;
+            return div.innerHTML;
+        }
+
         // Initialize particles
         function createParticles() {
             const particlesContainer = document.getElementById('particles');
@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Set before app is imported: a throwaway data dir, no result cache, no rate limits
+os.environ.setdefault('DATA_DIR', tempfile.mkdtemp(prefix='bakraload-tests-'))
+os.environ.setdefault('RESULT_CACHE_ENABLED', 'False')
+os.environ.setdefault('RATE_LIMIT_ENABLED', 'False')
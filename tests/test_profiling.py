@@ -0,0 +1,69 @@
+"""Slow-request captures: finished once the response is closed, with per-thread cProfile stages"""
+import os
+import pstats
+import tempfile
+import threading
+
+import pytest
+
+import app
+import profiling
+from profiling import Profiler
+
+
+def busy_download():
+    return sum(i * i for i in range(20000))
+
+
+def busy_elsewhere():
+    return sum(i * i for i in range(20000))
+
+
+def test_stage_on_another_thread_is_profiled_there(tmp_path):
+    profiler = Profiler(str(tmp_path), enabled=True, threshold=0)
+    capture = profiler.start('test', force=True)
+    with capture.stage('handler'):
+        def run():
+            capture.attach()
+            with profiling.stage('download'):
+                busy_download()
+            # Outside any stage: belongs to neither the download nor the handler thread's stage
+            busy_elsewhere()
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+    capture.finish()
+    [meta] = profiler.list()
+    assert meta['pstats'] == ['download', 'handler']
+
+    def functions(stage):
+        return {name for _, _, name in pstats.Stats(profiler.path_for(meta['id'], f'{stage}.prof')).stats}
+    assert 'busy_download' in functions('download')
+    assert 'busy_download' not in functions('handler')
+    assert 'busy_elsewhere' not in functions('handler') | functions('download')
+
+
+@pytest.fixture
+def slow_request_profiler(monkeypatch):
+    monkeypatch.setattr(app.profiler, 'enabled', True)
+    monkeypatch.setattr(app.profiler, 'threshold', 0)
+    return app.profiler
+
+
+def test_single_file_downloads_are_saved_and_released(slow_request_profiler, tmp_path, monkeypatch):
+    def download_content(*args, **kwargs):
+        # Each download gets its own dir; it is removed once the file is sent
+        temp_dir = tempfile.mkdtemp(dir=tmp_path)
+        path = os.path.join(temp_dir, 'clip.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 1000)
+        return temp_dir, [path], None, {'title': 'clip'}
+    monkeypatch.setattr(app.downloader, 'download_content', download_content)
+    saved = len(slow_request_profiler.list())
+    client = app.app.test_client()
+    for _ in range(3):
+        response = client.post('/download', json={'url': 'https://www.youtube.com/watch?v=abcdefghijk'})
+        assert response.status_code == 200
+        response.close()
+    assert len(slow_request_profiler.list()) == saved + 3
+    assert not slow_request_profiler.sampler._captures
@@ -0,0 +1,55 @@
+"""Format selection for quality profiles, run through yt-dlp's own selector on canned format lists"""
+import pytest
+from yt_dlp import YoutubeDL
+
+from quality import apply_quality, parse_quality
+
+# A shorts-style source: portrait video-only streams plus one audio stream
+PORTRAIT_FORMATS = [
+    {'format_id': 'a', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'filesize': 500_000},
+    *({'format_id': f'v{height}', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'none',
+       'width': height * 9 // 16, 'height': height, 'filesize': height * 10_000}
+      for height in (426, 640, 854, 1280, 1920)),
+]
+
+# YouTube's default options (see UniversalDownloader.get_youtube_opts)
+YOUTUBE_DEFAULT = {'format': 'bestvideo[height<=1080]+bestaudio/best[height<=1080]', 'merge_output_format': 'mp4'}
+
+
+def selected_heights(ydl_opts, formats=PORTRAIT_FORMATS):
+    info = {'id': 'x', 'title': 'x', 'extractor': 'test', 'extractor_key': 'Test',
+            'webpage_url': 'https://example.com/x', 'formats': [dict(f, url=f'https://example.com/{f["format_id"]}')
+                                                                  for f in formats]}
+    with YoutubeDL(dict(ydl_opts, quiet=True, simulate=True)) as ydl:
+        result = ydl.process_ie_result(info, download=False)
+    chosen = result.get('requested_formats') or [result]
+    return [f.get('height') for f in chosen if f.get('vcodec') != 'none']
+
+
+def profile(value, **kwargs):
+    return apply_quality(dict(YOUTUBE_DEFAULT), parse_quality(value), max_height=1080, **kwargs)
+
+
+def test_baseline_caps_portrait_height():
+    assert selected_heights(YOUTUBE_DEFAULT) == [854]
+
+
+@pytest.mark.parametrize('value, height', [
+    ({'max_height': 720}, 640),
+    ({'max_height': 1080}, 854),
+    ({'subtitles': False}, 854),
+    ({'max_filesize': 10 * 1024 * 1024}, 854),
+])
+def test_profile_keeps_a_hard_height_cap_on_portrait_video(value, height):
+    assert selected_heights(profile(value)) == [height]
+
+
+def test_single_file_platforms_are_capped_too():
+    muxed = [dict(f, acodec='mp4a.40.2') for f in PORTRAIT_FORMATS if f['vcodec'] != 'none']
+    opts = apply_quality({}, parse_quality({'max_height': 720}), merge=False)
+    assert selected_heights(opts, muxed) == [640]
+
+
+def test_falls_back_when_nothing_is_under_the_cap():
+    tall = [f for f in PORTRAIT_FORMATS if f.get('height', 0) >= 1280 or f['vcodec'] == 'none']
+    assert selected_heights(profile({'max_height': 720}), tall) == [1280]
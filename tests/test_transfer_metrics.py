@@ -0,0 +1,54 @@
+"""Sent bytes and transfer time for send_file responses, which werkzeug hands to the server untouched"""
+import os
+
+import pytest
+from prometheus_client import REGISTRY
+
+import app
+
+BODY = b'x' * 12345
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / 'clip.mp4'
+    path.write_bytes(BODY)
+    return str(tmp_path), [str(path)]
+
+
+def test_single_file_download_is_counted(client, media, monkeypatch):
+    temp_dir, file_list = media
+    monkeypatch.setattr(app.downloader, 'download_content',
+                        lambda *args, **kwargs: (temp_dir, file_list, None, {'title': 'clip'}))
+    sent = sample('bakraload_sent_bytes_total', delivery='file')
+    transfers = sample('bakraload_stage_seconds_count', stage='transfer', platform='youtube', format='default')
+    response = client.post('/download', json={'url': 'https://www.youtube.com/watch?v=abcdefghijk'})
+    assert response.status_code == 200
+    assert response.data == BODY
+    response.close()
+    assert sample('bakraload_sent_bytes_total', delivery='file') == sent + len(BODY)
+    assert sample('bakraload_stage_seconds_count', stage='transfer', platform='youtube', format='default') \
+        == transfers + 1
+
+
+def test_artifact_download_is_counted(client, media):
+    temp_dir, file_list = media
+    artifact = app.artifact_store.publish(temp_dir, file_list, 'clip.zip')
+    sent = sample('bakraload_sent_bytes_total', delivery='artifact')
+    with app.app.test_request_context():
+        url = app.artifact_url_for(artifact)
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.data == BODY
+    response.close()
+    assert sample('bakraload_sent_bytes_total', delivery='artifact') == sent + len(BODY)
+    assert os.path.exists(artifact['path'])
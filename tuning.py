@@ -0,0 +1,93 @@
+"""Per-platform yt-dlp download tuning that adapts to measured throughput"""
+import threading
+
+MB = 1024 * 1024
+
+# Starting points for each platform. YouTube, Twitch and Facebook serve
+# fragmented DASH/HLS, so several fragments are fetched at once.
+DEFAULT_PROFILES = {
+    'youtube': {'concurrent_fragment_downloads': 4, 'http_chunk_size': 10 * MB, 'buffersize': 1 * MB},
+    'twitch': {'concurrent_fragment_downloads': 8, 'http_chunk_size': None, 'buffersize': 1 * MB},
+    'facebook': {'concurrent_fragment_downloads': 4, 'http_chunk_size': None, 'buffersize': 1 * MB},
+    'default': {'concurrent_fragment_downloads': 2, 'http_chunk_size': None, 'buffersize': 256 * 1024},
+}
+
+# Upstream errors that mean "slow down"
+THROTTLE_MARKERS = ('HTTP Error 429', 'HTTP Error 403', 'Too Many Requests', 'rate-limit', 'rate limit')
+
+
+class DownloadTuner:
+    """Chooses fragment concurrency, chunk size and buffer size per platform.
+
+    After every download the concurrency is nudged up while throughput keeps
+    up with its moving average, trimmed when it falls behind, and halved
+    when the platform throttles us (additive increase, multiplicative decrease).
+    """
+
+    def __init__(self, profiles=None, adaptive=True, min_fragments=1, max_fragments=16, smoothing=0.3):
+        self.profiles = {name: dict(profile) for name, profile in DEFAULT_PROFILES.items()}
+        for name, profile in (profiles or {}).items():
+            self.profiles.setdefault(name, dict(self.profiles['default'])).update(profile)
+        self.adaptive = adaptive
+        self.min_fragments = min_fragments
+        self.max_fragments = max_fragments
+        self.smoothing = smoothing
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def _platform_state(self, platform):
+        state = self._state.get(platform)
+        if state is None:
+            profile = self.profiles.get(platform, self.profiles['default'])
+            state = self._state[platform] = {
+                'concurrent_fragment_downloads': profile['concurrent_fragment_downloads'],
+                'throughput': None,
+                'throttled': 0,
+            }
+        return state
+
+    def options_for(self, platform):
+        """yt-dlp params to apply to an engine for the next download"""
+        profile = self.profiles.get(platform, self.profiles['default'])
+        with self._lock:
+            fragments = self._platform_state(platform)['concurrent_fragment_downloads']
+        return {
+            'concurrent_fragment_downloads': fragments,
+            'http_chunk_size': profile['http_chunk_size'],
+            'buffersize': profile['buffersize'],
+        }
+
+    def record(self, platform, downloaded_bytes, seconds):
+        """Feed back the throughput of a finished download"""
+        if not self.adaptive or seconds <= 0 or downloaded_bytes <= 0:
+            return
+        throughput = downloaded_bytes / seconds
+        with self._lock:
+            state = self._platform_state(platform)
+            average = state['throughput']
+            fragments = state['concurrent_fragment_downloads']
+            if average is None or throughput >= average * 0.9:
+                fragments += 1
+            elif throughput < average * 0.7:
+                fragments -= 1
+            state['concurrent_fragment_downloads'] = max(self.min_fragments, min(self.max_fragments, fragments))
+            state['throughput'] = throughput if average is None else (
+                self.smoothing * throughput + (1 - self.smoothing) * average)
+
+    def record_error(self, platform, message):
+        """Back off hard when an error looks like upstream throttling"""
+        if not self.adaptive or not any(marker in (message or '') for marker in THROTTLE_MARKERS):
+            return
+        with self._lock:
+            state = self._platform_state(platform)
+            state['concurrent_fragment_downloads'] = max(self.min_fragments, state['concurrent_fragment_downloads'] // 2)
+            state['throttled'] += 1
+
+    def snapshot(self, platform):
+        """Current tuning for a platform, for reporting"""
+        options = self.options_for(platform)
+        with self._lock:
+            state = self._platform_state(platform)
+            options['throughput_ewma'] = round(state['throughput']) if state['throughput'] else None
+            options['throttled'] = state['throttled']
+        return options
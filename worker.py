@@ -0,0 +1,40 @@
+"""Download worker entry point: runs jobs queued in Redis, separately from the web tier.
+
+    JOB_QUEUE_URL=redis://localhost:6379/1 python worker.py
+
+Start as many as needed, on as many hosts as needed (each with its own
+WORKER_NAME, and DATA_DIR/artifacts shared with the web tier); each runs
+JOB_WORKERS downloads at a time.
+"""
+import argparse
+import signal
+import threading
+
+from app import janitor, job_manager, job_queue_url, warm_up
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='serve this worker\'s Prometheus metrics on this port (0 = off)')
+    parser.add_argument('--no-warm-up', action='store_true', help='skip importing yt-dlp/instaloader up front')
+    args = parser.parse_args()
+    if not job_queue_url or job_queue_url == 'memory://':
+        parser.error('JOB_QUEUE_URL must point at a Redis server shared with the web tier (redis://...)')
+
+    stop = threading.Event()
+    # Finish the running downloads, then exit; anything killed mid-way is requeued on the next start
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    if args.metrics_port:
+        from prometheus_client import start_http_server
+        start_http_server(args.metrics_port)
+    if not args.no_warm_up:
+        warm_up()
+    janitor.start()
+    job_manager.work(stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Streaming ZIP writer: emits an archive chunk by chunk without building it on disk"""
+import os
+import re
+import zipfile
+
+# Media that is already compressed; deflating it again only burns CPU
+STORED_EXTENSIONS = {
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.flv', '.3gp', '.ts',
+    '.mp3', '.m4a', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wav',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.zip', '.gz', '.xz', '.7z',
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _StreamBuffer:
+    """Write-only sink that zipfile writes into and the generator drains"""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._size += len(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # Having tell() but no seek() makes zipfile write data descriptors
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+def zip_filename_for(info):
+    """Use playlist title if available, otherwise default name"""
+    zip_filename = 'download.zip'
+    if info and isinstance(info, dict):
+        if info.get('type') == 'playlist':
+            playlist_title = info.get('playlist_title', 'Playlist')
+            # Sanitize playlist title for filename
+            safe_title = re.sub(r'[<>:"/\\|?*]', '_', playlist_title)
+            safe_title = safe_title.strip()[:100]  # Limit length
+            if safe_title:
+                zip_filename = f"{safe_title}.zip"
+    return zip_filename
+
+
+def compression_for(path):
+    """STORED for already-compressed media, DEFLATED for everything else"""
+    if os.path.splitext(path)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """Yield a ZIP archive of (path, arcname) entries as byte chunks.
+
+    Entries may be a lazy iterable; each file is read and emitted as soon as
+    it is reached, so the first bytes go out before later files exist.
+    """
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, 'w', allowZip64=True) as zipf:
+        for path, arcname in entries:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            zinfo.compress_type = compression_for(path)
+            with open(path, 'rb') as src, zipf.open(zinfo, 'w') as dest:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    if buf.pending() >= chunk_size:
+                        yield buf.drain()
+            if buf.pending():
+                yield buf.drain()
+    if buf.pending():
+        yield buf.drain()